@@ -0,0 +1,212 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from image_writer import ObjectInfo
+
+
+# Times reading the batch metadata into numpy arrays, with the new tracks
+# found on the arrays, against the per object walk of the pad probe. The arrays were tried in the probe and dropped: the lists still
+# have to be walked through the bindings to fill them, so they only add
+# work. ArrayTrackCache is the TrackCache stand-in of that approach.
+
+# One row per frame of the batch
+FRAME_DTYPE = np.dtype([
+    ("pad_index", np.int32),
+    ("batch_id", np.int32),
+    ("frame_num", np.int64),
+    ("buf_pts", np.uint64),
+    ("num_obj_meta", np.int32),
+])
+
+# One row per object of the batch, "frame" is the row of its frame in the
+# frame array. Rows are in frame order.
+OBJECT_DTYPE = np.dtype([
+    ("frame", np.int32),
+    ("pad_index", np.int32),
+    ("frame_num", np.int64),
+    ("object_id", np.uint64),
+    ("class_id", np.int32),
+    ("confidence", np.float32),
+    ("left", np.float32),
+    ("top", np.float32),
+    ("width", np.float32),
+    ("height", np.float32),
+])
+
+# columns in the order of ObjectInfo
+OBJECT_INFO_COLUMNS = ("object_id", "class_id", "confidence", "left", "top", "width", "height")
+
+
+def extract_batch(batch_meta, pyds):
+    # Reads the frame and object lists of batch_meta into (frames, objects)
+    # structured arrays
+    frames = []
+    objects = []
+    l_frame = batch_meta.frame_meta_list
+    while l_frame is not None:
+        try:
+            frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+        except StopIteration:
+            break
+        row = len(frames)
+        pad_index = frame_meta.pad_index
+        frame_num = frame_meta.frame_num
+        frames.append((pad_index, frame_meta.batch_id, frame_num, frame_meta.buf_pts, frame_meta.num_obj_meta))
+        l_obj = frame_meta.obj_meta_list
+        while l_obj is not None:
+            try:
+                obj_meta = pyds.NvDsObjectMeta.cast(l_obj.data)
+            except StopIteration:
+                break
+            rect = obj_meta.rect_params
+            objects.append((row, pad_index, frame_num, obj_meta.object_id, obj_meta.class_id, obj_meta.confidence,
+                            rect.left, rect.top, rect.width, rect.height))
+            try:
+                l_obj = l_obj.next
+            except StopIteration:
+                break
+        try:
+            l_frame = l_frame.next
+        except StopIteration:
+            break
+    return np.array(frames, dtype=FRAME_DTYPE), np.array(objects, dtype=OBJECT_DTYPE)
+
+
+def object_infos(objects):
+    # ObjectInfo per row, for the few objects that get an image
+    return [ObjectInfo(*row) for row in objects[list(OBJECT_INFO_COLUMNS)].tolist()]
+
+
+class ArrayTrackCache:
+
+    # TrackCache for one stream that takes all object ids of a frame at once.
+    # Same eviction rules: least recently seen first beyond max_size ids,
+    # and/or once not seen for ttl seconds.
+    def __init__(self, max_size=20, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._ids = np.empty(0, dtype=np.uint64)
+        self._last_seen = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, object_id):
+        return bool(np.any(self._ids == np.uint64(object_id)))
+
+    def seen_many(self, object_ids, now=None):
+        # Boolean array, True for the ids that were already known. All of
+        # them are marked as seen now. An id repeated within object_ids is
+        # new only the first time, as with TrackCache.seen in a loop, but ids
+        # are only evicted after the whole frame. The cache holds tens of
+        # ids, comparing every id with every entry is cheaper there than the
+        # sort behind np.isin.
+        if now is None:
+            now = time.time()
+        ids = np.asarray(object_ids, dtype=np.uint64)
+        match = ids[:, None] == self._ids[None, :]
+        cached = match.any(axis=1)
+        if self.ttl > 0:
+            known = match[:, now - self._last_seen <= self.ttl].any(axis=1)
+        else:
+            known = cached.copy()
+        ordered = np.sort(ids)
+        if (ordered[1:] == ordered[:-1]).any():
+            repeated = np.triu(ids[:, None] == ids[None, :], 1).any(axis=0)
+            known |= repeated
+        else:
+            repeated = np.zeros(len(ids), dtype=bool)
+
+        self._last_seen[match.any(axis=0)] = now
+        added = ids[~cached & ~repeated]
+        if len(added):
+            self._ids = np.concatenate([self._ids, added])
+            self._last_seen = np.concatenate([self._last_seen, np.full(len(added), now)])
+        self._evict(now)
+        return known
+
+    def seen(self, object_id, now=None):
+        return bool(self.seen_many([object_id], now)[0])
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        self._evict(now)
+
+    def resize(self, max_size=None, ttl=None):
+        if max_size is not None:
+            self.max_size = max_size
+        if ttl is not None:
+            self.ttl = ttl
+        self._evict(time.time())
+
+    def _evict(self, now):
+        if self.ttl > 0:
+            fresh = now - self._last_seen <= self.ttl
+            if not fresh.all():
+                self._ids = self._ids[fresh]
+                self._last_seen = self._last_seen[fresh]
+        if self.max_size > 0 and len(self._ids) > self.max_size:
+            keep = np.sort(np.argsort(self._last_seen, kind="stable")[-self.max_size:])
+            self._ids = self._ids[keep]
+            self._last_seen = self._last_seen[keep]
+
+
+def main():
+    # Extraction and new track detection of stand-in batches with both
+    # approaches
+    parser = argparse.ArgumentParser(description="Time the batch metadata extraction against the per object walk")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--objects", type=int, nargs="+", default=[5, 20, 50], help="objects per frame")
+    parser.add_argument("--batches", type=int, default=200)
+    args = parser.parse_args()
+
+    import simulation
+    from track_cache import TrackCache
+
+    print("%8s %8s %14s %14s" % ("streams", "objects", "walk us", "arrays us"))
+    for streams in args.streams:
+        for objects in args.objects:
+            config = {"processing_width": 1280, "processing_height": 720,
+                      "simulation": {"objects_per_frame": objects, "track_churn": 0.05, "empty_ratio": 0}}
+            source = simulation.SimulatedPyds(config, list(range(streams)))
+            batches = [source.gst_buffer_get_nvds_batch_meta(0) for _ in range(args.batches)]
+
+            caches = {s: TrackCache(20) for s in range(streams)}
+            t0 = time.perf_counter()
+            for batch_meta in batches:
+                now = time.time()
+                l_frame = batch_meta.frame_meta_list
+                while l_frame is not None:
+                    frame_meta = source.NvDsFrameMeta.cast(l_frame.data)
+                    tracks = caches[frame_meta.pad_index]
+                    l_obj = frame_meta.obj_meta_list
+                    while l_obj is not None:
+                        obj_meta = source.NvDsObjectMeta.cast(l_obj.data)
+                        if not tracks.seen(obj_meta.object_id, now):
+                            rect = obj_meta.rect_params
+                            ObjectInfo(obj_meta.object_id, obj_meta.class_id, obj_meta.confidence,
+                                       rect.left, rect.top, rect.width, rect.height)
+                        l_obj = l_obj.next
+                    l_frame = l_frame.next
+            walk = (time.perf_counter() - t0) / args.batches
+
+            caches = {s: ArrayTrackCache(20) for s in range(streams)}
+            t0 = time.perf_counter()
+            for batch_meta in batches:
+                now = time.time()
+                frames, rows = extract_batch(batch_meta, source)
+                bounds = np.searchsorted(rows["frame"], np.arange(len(frames) + 1))
+                for row, pad_index in enumerate(frames["pad_index"].tolist()):
+                    frame_objects = rows[bounds[row]:bounds[row + 1]]
+                    if len(frame_objects):
+                        object_infos(frame_objects[~caches[pad_index].seen_many(frame_objects["object_id"], now)])
+            arrays = (time.perf_counter() - t0) / args.batches
+            print("%8d %8d %14.1f %14.1f" % (streams, objects, walk * 1e6, arrays * 1e6))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
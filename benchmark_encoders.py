@@ -0,0 +1,94 @@
+import sys
+import time
+import json
+import argparse
+
+import numpy as np
+
+from encoders import make_encoder
+
+
+# Settings compared when none are given on the command line.
+DEFAULT_SPECS = [
+    {"format": "jpeg", "quality": 70},
+    {"format": "jpeg", "quality": 85},
+    {"format": "jpeg", "quality": 95},
+    {"format": "png", "compression": 1},
+    {"format": "png", "compression": 3},
+    {"format": "webp", "quality": 75},
+    {"format": "webp", "quality": 90},
+    {"format": "npy"},
+]
+
+
+def synthetic_frames(width, height, count, seed=0):
+    # Smooth gradients plus sensor-like noise and a few solid boxes, closer to
+    # a camera frame than pure noise (which no codec can compress).
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    frames = []
+    for i in range(count):
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        frame[..., 0] = (xs * 255 // max(1, width - 1) + i * 7) % 256
+        frame[..., 1] = (ys * 255 // max(1, height - 1) + i * 13) % 256
+        frame[..., 2] = ((xs + ys) * 255 // max(1, width + height - 2)) % 256
+        frame[..., 3] = 255
+        noise = rng.integers(0, 16, size=(height, width, 3), dtype=np.uint8)
+        frame[..., :3] = np.clip(frame[..., :3].astype(np.int16) + noise - 8, 0, 255)
+        for _ in range(3):
+            x, y = rng.integers(0, width // 2), rng.integers(0, height // 2)
+            frame[y:y + height // 4, x:x + width // 4, :3] = rng.integers(0, 256, size=3)
+        frames.append(frame)
+    return frames
+
+
+def benchmark(spec, frames, repeat):
+    encoder = make_encoder(spec)
+    latencies = []
+    sizes = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            t0 = time.perf_counter()
+            data = encoder.encode(frame)
+            latencies.append(time.perf_counter() - t0)
+            sizes.append(len(data))
+    total = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "spec": spec,
+        "fps": len(latencies) / total,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "bytes_per_frame": float(np.mean(sizes)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare image encoder backends on synthetic RGBA frames")
+    parser.add_argument("--config", default="config.json", help="config file to read processing_width/height from")
+    parser.add_argument("--frames", type=int, default=20, help="distinct synthetic frames")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the frames per backend")
+    parser.add_argument("--spec", action="append", default=[],
+                        help='encoder spec as json, e.g. \'{"format": "jpeg", "quality": 80}\'. May be repeated')
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = json.load(f)
+    width = config["processing_width"]
+    height = config["processing_height"]
+    specs = [json.loads(spec) for spec in args.spec] or DEFAULT_SPECS
+
+    print("Encoding %d x %d RGBA frames, %d frames x %d passes per backend\n" % (width, height, args.frames, args.repeat))
+    frames = synthetic_frames(width, height, args.frames)
+    print("%-40s %10s %10s %10s %10s %14s" % ("backend", "frames/s", "p50 ms", "p95 ms", "p99 ms", "bytes/frame"))
+    for spec in specs:
+        result = benchmark(spec, frames, args.repeat)
+        print("%-40s %10.1f %10.2f %10.2f %10.2f %14.0f" % (json.dumps(spec), result["fps"], result["p50_ms"],
+                                                             result["p95_ms"], result["p99_ms"],
+                                                             result["bytes_per_frame"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+
+from config_loader import with_defaults
+
+
+# Drives tiler_src_pad_buffer_probe with synthetic batch metadata shaped like
+# pyds NvDsBatchMeta/NvDsFrameMeta/NvDsObjectMeta and reports per batch probe
+# latency. Metadata is generated before timing so only the probe is measured.
+
+class _Buffer:
+    pass
+
+
+class _Info:
+
+    def __init__(self):
+        self._buffer = _Buffer()
+
+    def get_buffer(self):
+        return self._buffer
+
+
+class NullWriter:
+
+    # Keeps the frame copy the real writers do on the streaming thread but
+    # never touches the disk
+    def __init__(self):
+        self.submitted = 0
+
+    def start(self, threads=True):
+        pass
+
+    def stop(self, drain=True):
+        pass
+
+    def submit(self, record, copy=True):
+        if copy:
+            np.array(record.frame, copy=True, order='C')
+        self.submitted += 1
+        return True
+
+    def stats(self):
+        return {"submitted": self.submitted}
+
+
+class ReplayPyds:
+
+    # Serves pre-generated batches from a SimulatedPyds in order
+    def __init__(self, source, batches):
+        self._source = source
+        self.NvDsFrameMeta = source.NvDsFrameMeta
+        self.NvDsObjectMeta = source.NvDsObjectMeta
+        self._batches = [source.gst_buffer_get_nvds_batch_meta(0) for _ in range(batches)]
+        self._next = 0
+
+    def gst_buffer_get_nvds_batch_meta(self, gst_buffer_address):
+        batch = self._batches[self._next % len(self._batches)]
+        self._next += 1
+        return batch
+
+    def get_nvds_buf_surface(self, gst_buffer_address, batch_id):
+        return self._source.get_nvds_buf_surface(gst_buffer_address, batch_id)
+
+
+def run_case(ds, simulation, base_config, streams, objects, churn, queue_size, batches, null_writer=True):
+    config = dict(base_config)
+    config["source_type"] = "rtsp"
+    config["source"] = {"stream_%d" % i: "sim://stream_%d" % i for i in range(streams)}
+    config["queue_size"] = queue_size
+    config["simulation"] = dict(config["simulation"], objects_per_frame=objects, track_churn=churn)
+
+    stream_ids = ds.init_streams(config)
+    if null_writer:
+        ds.image_writer = NullWriter()
+        if ds.best_shot is not None:
+            ds.best_shot.submit = ds.image_writer.submit
+    ds.image_writer.start()
+    ds.pyds = ReplayPyds(simulation.SimulatedPyds(config, stream_ids), batches)
+
+    info = _Info()
+    latencies = np.empty(batches)
+    probe = ds.tiler_src_pad_buffer_probe
+    for i in range(batches):
+        t0 = time.perf_counter()
+        probe(None, info, 0)
+        latencies[i] = time.perf_counter() - t0
+    if ds.best_shot is not None:
+        ds.best_shot.flush()
+    ds.image_writer.stop()
+
+    latencies *= 1000.0
+    return {
+        "streams": streams,
+        "objects": objects,
+        "churn": churn,
+        "queue_size": queue_size,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "writer": ds.image_writer.stats(),
+        "best_shot": ds.best_shot.stats() if ds.best_shot is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tiler_src_pad_buffer_probe with synthetic metadata")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--objects", type=int, nargs="+", default=[0, 5, 20], help="objects per frame")
+    parser.add_argument("--churn", type=float, nargs="+", default=[0.0, 0.05, 0.2],
+                        help="probability per frame that a track ends")
+    parser.add_argument("--queue-size", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--batches", type=int, default=500, help="batches per case")
+    parser.add_argument("--with-writer", action="store_true",
+                        help="use the configured image writer and write images to a temporary directory")
+    parser.add_argument("--json", action="store_true", help="print one json object per case")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = with_defaults(json.load(f))
+    config["backend"] = "simulation"
+    config["encoder_process"] = False
+    config["index_db"] = ""
+
+    #images and the per stream directories go to a scratch directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [here, os.path.dirname(here)]
+    os.chdir(tempfile.mkdtemp(prefix="benchmark_probe_"))
+    import deepstream_all_save_images as ds
+    import simulation
+
+    if not args.json:
+        print("%8s %8s %8s %8s %10s %10s %10s %10s" % ("streams", "objects", "churn", "queue", "p50 ms", "p95 ms",
+                                                     "p99 ms", "max ms"))
+    for streams, objects, churn, queue_size in itertools.product(args.streams, args.objects, args.churn,
+                                                                 args.queue_size):
+        result = run_case(ds, simulation, config, streams, objects, churn, queue_size, args.batches,
+                          null_writer=not args.with_writer)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print("%8d %8d %8.2f %8d %10.3f %10.3f %10.3f %10.3f" % (streams, objects, churn, queue_size,
+                                                                  result["p50_ms"], result["p95_ms"],
+                                                                  result["p99_ms"], result["max_ms"]))
+    print("\nScratch directory: %s" % os.getcwd())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from image_writer import SaveRecord
+
+
+class Candidate:
+
+    # Best frame of one track so far. snapshot is a copy of the whole frame,
+    # shared by every track whose best frame it is.
+    __slots__ = ["stream", "obj", "score", "snapshot", "timestamp", "started", "last_seen"]
+
+    def __init__(self, stream, obj, now):
+        self.stream = stream
+        self.obj = obj
+        self.score = -1.0
+        self.snapshot = None
+        self.timestamp = now
+        self.started = now
+        self.last_seen = now
+
+
+def score(obj):
+    return max(obj.confidence, 0.0) * obj.width * obj.height
+
+
+class BestShotSelector:
+
+    # Keeps one candidate per new track instead of saving the frame the track
+    # first appears in. The candidate is replaced when a frame scores
+    # (confidence x box area) at least min_improvement times better, and is
+    # handed to submit(record, copy=False) once the track has not been seen
+    # for timeout seconds or is max_age seconds old, so every track gets
+    # exactly one image. At most max_pending candidates are held over all
+    # streams between frames; beyond that the oldest ones are sent off early
+    # once the frame's snapshot is taken, so that every track has an image
+    # when it leaves.
+    def __init__(self, submit, category="positive", timeout=1.0, max_age=10.0, max_pending=32,
+                 min_improvement=1.2):
+        self.submit = submit
+        self.category = category
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_pending = max(1, max_pending)
+        self.min_improvement = min_improvement
+        # (stream, object_id) -> Candidate, oldest track first
+        self._pending = OrderedDict()
+
+        self.tracks = 0
+        self.snapshots = 0
+        self.emitted = 0
+        self.early = 0
+        # tracks that left before a snapshot of them was taken
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def pending(self, stream, object_id):
+        return (stream, object_id) in self._pending
+
+    def observe(self, stream, obj, now):
+        # Called by the pad probe for a new track and for every later frame
+        # of a pending one. Returns True if this frame should become the
+        # track's snapshot, the caller then passes it to snapshot().
+        key = (stream, obj.object_id)
+        candidate = self._pending.get(key)
+        if candidate is None:
+            candidate = Candidate(stream, obj, now)
+            self._pending[key] = candidate
+            self.tracks += 1
+        candidate.last_seen = now
+        value = score(obj)
+        return candidate.snapshot is None or value > candidate.score * self.min_improvement
+
+    def snapshot(self, stream, objects, frame, now):
+        # Copies frame once for all objects that improved in it
+        snapshot = np.array(frame, copy=True, order='C')
+        self.snapshots += 1
+        for obj in objects:
+            candidate = self._pending.get((stream, obj.object_id))
+            if candidate is None:
+                continue
+            candidate.obj = obj
+            candidate.score = score(obj)
+            candidate.snapshot = snapshot
+            candidate.timestamp = now
+        if len(self._pending) > self.max_pending:
+            early = [c for c in self._pending.values() if c.snapshot is not None]
+            early = early[:len(self._pending) - self.max_pending]
+            self.early += len(early)
+            self._emit(early)
+
+    def expire(self, now=None):
+        # Sends off tracks that ended or are too old, once per batch
+        if now is None:
+            now = time.time()
+        done = [c for c in self._pending.values()
+                if now - c.last_seen > self.timeout or (self.max_age and now - c.started > self.max_age)]
+        self._emit(done)
+
+    def flush(self, stream=None):
+        # Sends off every pending track, or those of stream
+        self._emit([c for c in self._pending.values() if stream is None or c.stream == stream])
+
+    def _emit(self, candidates):
+        # Tracks whose best frame is the same snapshot share one record
+        records = OrderedDict()
+        for candidate in candidates:
+            self._pending.pop((candidate.stream, candidate.obj.object_id), None)
+            if candidate.snapshot is None:
+                self.dropped += 1
+                continue
+            key = (candidate.stream, id(candidate.snapshot))
+            if key not in records:
+                records[key] = SaveRecord(self.category, candidate.stream, candidate.timestamp, candidate.snapshot, [])
+            records[key].objects.append(candidate.obj)
+        for record in records.values():
+            self.submit(record, copy=False)
+            self.emitted += len(record.objects)
+
+    def stats(self):
+        return {"pending": len(self._pending), "tracks": self.tracks, "snapshots": self.snapshots,
+                "emitted": self.emitted, "early": self.early, "dropped": self.dropped}
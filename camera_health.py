@@ -0,0 +1,87 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class HealthCache:
+
+    # Last probe result per camera uri with the time it was taken, so a
+    # restart only re-probes cameras whose result went stale. A stream that
+    # is pointed at another camera is probed again.
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def update(self, stream, uri, ok, checked_at=None, error=None):
+        with self._lock:
+            self._results[uri] = {
+                "stream": stream,
+                "ok": ok,
+                "checked_at": checked_at if checked_at is not None else time.time(),
+                "error": error,
+            }
+
+    def get(self, uri, now=None):
+        # Returns the cached result if still fresh, else None
+        if now is None:
+            now = time.time()
+        with self._lock:
+            result = self._results.get(uri)
+        if result is None or now - result["checked_at"] > self.ttl:
+            return None
+        return result
+
+    def snapshot(self):
+        # {stream: result} of the camera each stream was last probed with,
+        # the uris may hold credentials
+        with self._lock:
+            results = sorted(self._results.values(), key=lambda result: result["checked_at"])
+        return {result["stream"]: {key: value for key, value in result.items() if key != "stream"}
+                for result in results}
+
+
+def probe_sources(sources, check, cache, timeout=10, workers=8):
+    # Probes every stream -> uri in sources in parallel with check(uri) and
+    # returns {stream: ok}. A probe that has not answered timeout seconds
+    # after it started counts as failed; its thread is left to finish on its
+    # own since OpenCV captures cannot be interrupted.
+    now = time.time()
+    results = {}
+    pending = {}
+    for stream, uri in sources.items():
+        cached = cache.get(uri, now)
+        if cached is not None:
+            results[stream] = cached["ok"]
+        else:
+            pending[stream] = uri
+    if not pending:
+        return results
+
+    started = {}
+
+    def run(stream, uri):
+        started[stream] = time.time()
+        return check(uri)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(int(workers), len(pending))))
+    futures = {executor.submit(run, stream, uri): stream for stream, uri in pending.items()}
+    while futures:
+        done, _ = wait(list(futures), timeout=0.1, return_when=FIRST_COMPLETED)
+        for future in done:
+            stream = futures.pop(future)
+            try:
+                ok = bool(future.result())
+                cache.update(stream, pending[stream], ok)
+            except Exception as e:
+                ok = False
+                cache.update(stream, pending[stream], ok, error=str(e) or type(e).__name__)
+            results[stream] = ok
+        now = time.time()
+        for future, stream in list(futures.items()):
+            if stream in started and now - started[stream] > timeout:
+                del futures[future]
+                cache.update(stream, pending[stream], False, error="no answer after %g s" % timeout)
+                results[stream] = False
+    executor.shutdown(wait=False)
+    return results
@@ -0,0 +1,297 @@
+import os
+import copy
+import json
+from collections import namedtuple, OrderedDict
+
+from encoders import make_encoder, DEFAULT_ENCODER
+
+
+# Marks the keys every config.json has to set
+REQUIRED = object()
+
+# One entry per config.json key: its default, a check of the value, what a
+# valid value looks like and how a change is applied to a running pipeline:
+#   "pipeline": by the deepstream processes, see
+#               deepstream_all_save_images.apply_config
+#   "main":     by main_deploy alone, without touching the pipeline
+#   "rebuild":  by rebuilding part of the pipeline (the sink for display)
+#   "restart":  only by restarting the processes
+# Keys that are not listed here need a restart too.
+ConfigKey = namedtuple("ConfigKey", ["name", "default", "check", "usage", "change"])
+
+
+def _boolean(value):
+    return isinstance(value, bool)
+
+
+def _integer(minimum=None, maximum=None):
+    return lambda value: type(value) == int and (minimum is None or value >= minimum) \
+        and (maximum is None or value <= maximum)
+
+
+def _number(minimum=0, above=False, maximum=None):
+    # int or float of at least minimum (above it with above=True)
+    return lambda value: type(value) in [int, float] and (value > minimum if above else value >= minimum) \
+        and (maximum is None or value <= maximum)
+
+
+def _choice(*values):
+    return lambda value: value in values
+
+
+def _string(value):
+    return isinstance(value, str)
+
+
+def _per_category(value):
+    # a number, or a dict of numbers per category
+    values = list(value.values()) if isinstance(value, dict) else [value]
+    return all(type(v) in [int, float] and v >= 0 for v in values)
+
+
+def _class_ids(value):
+    return isinstance(value, list) and all(type(c) == int and c >= 0 for c in value)
+
+
+def _pgie_config(value):
+    return isinstance(value, str) and os.path.exists(value)
+
+
+def _encoder(value):
+    try:
+        make_encoder(value)
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return True
+
+
+def _bool_usage(name):
+    return "Valid usage is '%s': true or '%s': false" % (name, name)
+
+
+CONFIG_SCHEMA = [
+    ConfigKey("backend", "deepstream", _choice("deepstream", "simulation"),
+              "Valid values are 'deepstream' or 'simulation'", "restart"),
+    ConfigKey("source_type", REQUIRED, _choice("rtsp", "mipi", "usb"),
+              "Valid values are 'rtsp', 'mipi' or 'usb'", "restart"),
+    ConfigKey("display", REQUIRED, _boolean, _bool_usage("display"), "rebuild"),
+    ConfigKey("processing_width", REQUIRED, _integer(), "Should be integer. eg. 640", "restart"),
+    ConfigKey("processing_height", REQUIRED, _integer(), "Should be integer. eg. 480", "restart"),
+    ConfigKey("tiler_width", REQUIRED, _integer(), "Should be integer. eg. 640", "pipeline"),
+    ConfigKey("tiler_height", REQUIRED, _integer(), "Should be integer. eg. 480", "pipeline"),
+    ConfigKey("image_timer", REQUIRED, _integer(), "Should be integer. eg. 600", "pipeline"),
+    ConfigKey("image_timer_jitter", 0, _number(), "Should be a number of seconds, 0 or more. e.g. 10", "pipeline"),
+    ConfigKey("queue_size", REQUIRED, _integer(), "Should be integer and greater than 0. e.g. 20", "pipeline"),
+    ConfigKey("track_ttl", 0, _number(), "Should be a number of seconds, 0 disables it. e.g. 60", "pipeline"),
+    ConfigKey("save_classes", [], _class_ids,
+              "Should be a list of class ids that get positive images, empty for all classes. e.g. [0, 2]",
+              "pipeline"),
+    ConfigKey("writer_workers", 2, _integer(1), "Should be integer and greater than 0. e.g. 2", "restart"),
+    ConfigKey("writer_queue_size", 32, _integer(1), "Should be integer and greater than 0. e.g. 32", "restart"),
+    ConfigKey("writer_policy", "drop_oldest", _choice("drop_oldest", "drop_newest"),
+              "Valid values are 'drop_oldest' or 'drop_newest'", "restart"),
+    ConfigKey("save_mode", "full", _choice("full", "crop", "both"), "Valid values are 'full', 'crop' or 'both'",
+              "restart"),
+    ConfigKey("crop_padding", 0.0, _number(), "Should be a fraction of the box size, 0 or more. e.g. 0.1", "restart"),
+    ConfigKey("positive_encoder", DEFAULT_ENCODER, _encoder,
+              "Should be an encoder spec. e.g. {\"format\": \"jpeg\", \"quality\": 95}", "restart"),
+    ConfigKey("negative_encoder", DEFAULT_ENCODER, _encoder,
+              "Should be an encoder spec. e.g. {\"format\": \"jpeg\", \"quality\": 80}", "restart"),
+    ConfigKey("encoder_process", False, _boolean, _bool_usage("encoder_process"), "restart"),
+    ConfigKey("ring_policy", "drop_newest", _choice("drop_newest", "wait"), "Valid values are 'drop_newest' or 'wait'",
+              "restart"),
+    ConfigKey("directory_layout", "flat", _choice("flat", "day", "hour"), "Valid values are 'flat', 'day' or 'hour'",
+              "restart"),
+    ConfigKey("retention_max_bytes", 0, _per_category,
+              "Should be a number, 0 disables it, or a dict of numbers per category "
+              "e.g. {\"positive\": 100, \"negative\": 24}", "restart"),
+    ConfigKey("retention_max_age_hours", 0, _per_category,
+              "Should be a number, 0 disables it, or a dict of numbers per category "
+              "e.g. {\"positive\": 100, \"negative\": 24}", "restart"),
+    ConfigKey("retention_interval", 60, _number(0, above=True),
+              "Should be a number of seconds greater than 0. e.g. 60", "restart"),
+    ConfigKey("index_db", "", _string,
+              "Should be the path of the sqlite index, empty disables it. e.g. \"images.db\"", "restart"),
+    ConfigKey("camera_check_timeout", 10, _number(0, above=True), "Should be a number greater than 0. e.g. 10", "main"),
+    ConfigKey("camera_check_workers", 8, _number(0, above=True), "Should be a number greater than 0. e.g. 8", "main"),
+    ConfigKey("health_cache_ttl", 30, _number(0, above=True), "Should be a number greater than 0. e.g. 30", "main"),
+    ConfigKey("max_sources", 0, _integer(0),
+              "Should be integer, the batch size to leave room for sources added at run time, 0 uses the number "
+              "of sources. e.g. 8", "restart"),
+    ConfigKey("source_fps", 30, _number(0, above=True),
+              "Should be the frame rate of the cameras, a batch waits at most one frame interval for a late "
+              "source. e.g. 30", "pipeline"),
+    ConfigKey("max_streams_per_shard", 0, _integer(0),
+              "Should be integer, 0 runs all sources in one process. e.g. 8", "restart"),
+    ConfigKey("restart_backoff", 2, _number(), "Should be a number of seconds, 0 or more. e.g. 2", "main"),
+    ConfigKey("restart_backoff_max", 60, _number(), "Should be a number of seconds, 0 or more. e.g. 60", "main"),
+    ConfigKey("crash_loop_restarts", 5, _integer(1), "Should be integer and greater than 0. e.g. 5", "main"),
+    ConfigKey("crash_loop_window", 300, _number(), "Should be a number of seconds, 0 or more. e.g. 300", "main"),
+    ConfigKey("shard_stall_timeout", 120, _number(), "Should be a number of seconds, 0 or more. e.g. 120", "main"),
+    ConfigKey("shard_start_timeout", 600, _number(), "Should be a number of seconds, 0 or more. e.g. 600", "main"),
+    ConfigKey("warm_standby", False, _boolean, _bool_usage("warm_standby"), "main"),
+    ConfigKey("source_stall_timeout", 15, _number(), "Should be a number of seconds, 0 disables it. e.g. 15",
+              "pipeline"),
+    ConfigKey("source_restart_backoff", 5, _number(), "Should be a number of seconds, 0 or more. e.g. 5", "pipeline"),
+    ConfigKey("source_restart_backoff_max", 300, _number(), "Should be a number of seconds, 0 or more. e.g. 300",
+              "pipeline"),
+    ConfigKey("pgie_config", "primary_config.txt", _pgie_config,
+              "Should be the path of the nvinfer config file. e.g. \"primary_config.txt\"", "restart"),
+    ConfigKey("engine_cache_dir", "", _string,
+              "Should be a directory, empty disables the engine cache. e.g. \"engines\"", "restart"),
+    ConfigKey("best_shot", False, _boolean, _bool_usage("best_shot"), "restart"),
+    ConfigKey("best_shot_timeout", 1.0, _number(0, above=True),
+              "Should be a number of seconds greater than 0. e.g. 1.0", "pipeline"),
+    ConfigKey("best_shot_max_age", 10, _number(0, above=True),
+              "Should be a number of seconds greater than 0. e.g. 10", "pipeline"),
+    ConfigKey("best_shot_max_pending", 32, _integer(1),
+              "Should be integer and greater than 0, the number of tracks held between frames. e.g. 32", "pipeline"),
+    ConfigKey("best_shot_min_improvement", 1.2, _number(1),
+              "Should be a number of 1 or more, how much better a frame has to score to replace the kept one. "
+              "e.g. 1.2", "pipeline"),
+    ConfigKey("negative_dedup_threshold", 0, _integer(0, 64),
+              "Should be integer between 0 and 64, the number of differing hash bits below which a negative image "
+              "is skipped, 0 saves all of them. e.g. 5", "pipeline"),
+    ConfigKey("negative_dedup_max_interval", 0, _number(),
+              "Should be a number of seconds after which a negative image is saved anyway, 0 never forces one. "
+              "e.g. 3600", "pipeline"),
+    ConfigKey("adaptive_interval", False, _boolean, _bool_usage("adaptive_interval"), "restart"),
+    ConfigKey("interval_min", 0, _integer(0), "Should be integer, 0 or more. e.g. 0", "pipeline"),
+    ConfigKey("interval_max", 10, _integer(0), "Should be integer, 0 or more. e.g. 10", "pipeline"),
+    ConfigKey("interval_period", 5, _number(0, above=True),
+              "Should be a number of seconds greater than 0. e.g. 5", "restart"),
+    ConfigKey("interval_busy_ratio", 0.3, _number(0, maximum=1),
+              "Should be a share of frames between 0 and 1. e.g. 0.3", "pipeline"),
+    ConfigKey("interval_idle_ratio", 0.05, _number(0, maximum=1),
+              "Should be a share of frames between 0 and 1. e.g. 0.05", "pipeline"),
+    ConfigKey("interval_hold", 3, _integer(1), "Should be integer and greater than 0. e.g. 3", "pipeline"),
+    ConfigKey("interval_target_fps", 0, _number(), "Should be a number, 0 disables it. e.g. 25", "pipeline"),
+    ConfigKey("interval_trace", "", _string,
+              "Should be a file path, empty disables the trace. e.g. \"interval_trace.txt\"", "restart"),
+    ConfigKey("latency_tracing", False, _boolean, _bool_usage("latency_tracing"), "restart"),
+    ConfigKey("latency_sample_every", 10, _integer(1), "Should be integer and greater than 0. e.g. 10", "restart"),
+    ConfigKey("latency_window", 1000, _integer(1), "Should be integer and greater than 0. e.g. 1000", "restart"),
+    ConfigKey("queue_poll_interval", 1.0, _number(0, above=True),
+              "Should be a number of seconds greater than 0. e.g. 1.0", "restart"),
+    ConfigKey("metrics_host", "127.0.0.1", _string, "Should be the address to serve metrics on. e.g. \"127.0.0.1\"",
+              "restart"),
+    ConfigKey("metrics_port", 9100, _integer(1), "Should be integer and greater than 0. e.g. 9100", "restart"),
+    ConfigKey("event_socket", "", _string,
+              "Should be the path of the Unix socket for detection events, empty disables it. "
+              "e.g. \"check/events.sock\"", "restart"),
+    ConfigKey("event_queue_size", 64, _integer(1), "Should be integer and greater than 0. e.g. 64", "restart"),
+    ConfigKey("event_subscriber_buffer", 1048576, _integer(1), "Should be integer and greater than 0. e.g. 1048576",
+              "restart"),
+    ConfigKey("run_duration", 0, _number(), "Should be a number of seconds, 0 runs until stopped. e.g. 60", "restart"),
+    ConfigKey("simulation", {}, lambda value: isinstance(value, dict),
+              "Should be a dict of simulation settings, see simulation.py", "restart"),
+]
+
+SCHEMA = OrderedDict((key.name, key) for key in CONFIG_SCHEMA)
+
+# Default of every key that has one
+DEFAULTS = OrderedDict((key.name, key.default) for key in CONFIG_SCHEMA if key.default is not REQUIRED)
+
+# Keys the running deepstream processes change in place
+PIPELINE_LIVE_KEYS = [key.name for key in CONFIG_SCHEMA if key.change == "pipeline"]
+
+# Keys only main_deploy uses, they take effect without touching the pipeline
+MAIN_LIVE_KEYS = [key.name for key in CONFIG_SCHEMA if key.change == "main"]
+
+# Keys that need part of the pipeline rebuilt
+REBUILD_KEYS = [key.name for key in CONFIG_SCHEMA if key.change == "rebuild"]
+
+# Changes between two configs. live and rebuild map keys to their new value,
+# restart lists the keys that need the processes restarted, added and
+# removed are the rtsp sources to add ({name: uri}) and remove (names).
+ConfigDiff = namedtuple("ConfigDiff", ["live", "rebuild", "restart", "added", "removed"])
+
+
+def with_defaults(config):
+    # Copy of config with every key it leaves out set to its default, the
+    # deepstream processes and main_deploy read keys without defaults of
+    # their own
+    full = copy.deepcopy(DEFAULTS)
+    full.update(config)
+    return full
+
+
+def load_config(config_file="config.json"):
+    # Reads and checks config_file, returns the config with defaults filled in
+    # or None after printing what is wrong. Values that are corrected
+    # (queue_size) are corrected in the returned config.
+    try:
+        with open(config_file, "r") as f:
+            config = json.load(f)
+
+        if len(list(config)) == 0:
+            print("No configurations provided in json file")
+            return None
+        missing = [key.name for key in CONFIG_SCHEMA if key.default is REQUIRED and key.name not in config]
+        if missing:
+            print("missing %s in json file" % ", ".join("'%s'" % name for name in missing))
+            return None
+        if config["source_type"] == "rtsp":
+            sources = config.get("source")
+            if not isinstance(sources, dict) or len(list(sources)) == 0:
+                print("No source provided in json file")
+                return None
+            for key, value in sources.items():
+                if value == "":
+                    print("No source provided in json file")
+                    return None
+
+        config = with_defaults(config)
+        for key in CONFIG_SCHEMA:
+            if not key.check(config[key.name]):
+                print("wrong value for '%s' in json file. %s" % (key.name, key.usage))
+                return None
+
+        if config["queue_size"] < 1:
+            print("'queue_size' cannot be 0 or less. Switching to default value 20.")
+            config["queue_size"] = 20
+        if config["interval_max"] < config["interval_min"]:
+            print("wrong value for 'interval_min' or 'interval_max' in json file. Should be 0 <= interval_min <= interval_max. e.g. 0 and 10")
+            return None
+        if config["interval_idle_ratio"] >= config["interval_busy_ratio"]:
+            print("wrong value for 'interval_idle_ratio' in json file. Should be smaller than 'interval_busy_ratio'")
+            return None
+
+        return config
+
+    except Exception as e:
+        print(e)
+        print("Error in json file")
+        return None
+
+
+def diff_configs(old, new):
+    # Sorts every key that differs between old and new into a ConfigDiff,
+    # by its change in CONFIG_SCHEMA. Both are expected to come from
+    # load_config, so a key left out and one set to its default compare
+    # equal. Sources of an rtsp config are compared one by one, a changed uri
+    # is removed and added again.
+    live = {}
+    rebuild = {}
+    restart = []
+    added = {}
+    removed = []
+    for key in sorted(set(old) | set(new)):
+        if old.get(key) == new.get(key):
+            continue
+        if key == "source" and old.get("source_type") == new.get("source_type") == "rtsp":
+            old_sources = old.get("source") or {}
+            new_sources = new.get("source") or {}
+            removed = sorted(name for name in old_sources if old_sources[name] != new_sources.get(name))
+            added = {name: uri for name, uri in new_sources.items() if old_sources.get(name) != uri}
+        elif key in SCHEMA and SCHEMA[key].change in ["pipeline", "main"]:
+            live[key] = new.get(key)
+        elif key in SCHEMA and SCHEMA[key].change == "rebuild":
+            rebuild[key] = new.get(key)
+        else:
+            restart.append(key)
+    #the frame ring has one slot per queue_size, it is sized at start
+    if "queue_size" in live and new.get("encoder_process", False):
+        del live["queue_size"]
+        restart.append("queue_size")
+    return ConfigDiff(live, rebuild, restart, added, removed)
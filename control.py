@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import queue
+import socket
+import threading
+import socketserver
+
+
+CONTROL_SOCKET = os.path.join("check", "control.sock")
+COMMANDS = ("start", "stop", "restart", "reload", "status", "add", "remove")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline().decode("utf-8").strip()
+        if not line:
+            return
+        parts = line.split(None, 1)
+        command = parts[0]
+        args = parts[1] if len(parts) > 1 else ""
+        if command not in self.server.commands_allowed:
+            reply = {"ok": False, "error": "unknown command '%s'" % command}
+        else:
+            replies = queue.Queue(maxsize=1)
+            self.server.commands.put((command, args, replies))
+            try:
+                reply = replies.get(timeout=self.server.reply_timeout)
+            except queue.Empty:
+                reply = {"ok": False, "error": "timed out waiting for '%s'" % command}
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+
+    # Local Unix socket taking one command per connection, e.g.
+    #   echo status | socat - UNIX-CONNECT:check/control.sock
+    # or "python control.py status". Sources are added and removed with
+    # "add stream_3 rtsp://..." and "remove stream_3", "reload" applies
+    # config.json changes without a restart where it can. Commands are put on a queue as
+    # (command, args, reply_queue) for the main loop of main_deploy, which
+    # puts a json serialisable dict on reply_queue.
+    def __init__(self, commands, path=CONTROL_SOCKET, allowed=COMMANDS, reply_timeout=60):
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = _Server(path, _Handler)
+        self._server.commands = commands
+        self._server.commands_allowed = allowed
+        self._server.reply_timeout = reply_timeout
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="control", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def send_command(command, path=CONTROL_SOCKET, timeout=120):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall((command.strip() + "\n").encode("utf-8"))
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    return json.loads(data.decode("utf-8"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python control.py <%s> [args]" % "|".join(COMMANDS))
+        sys.exit(1)
+    print(json.dumps(send_command(" ".join(sys.argv[1:])), indent=2))
@@ -31,21 +31,32 @@ from gi.repository import GObject, Gst
 from gi.repository import GLib
 from ctypes import *
 import time
-import sys
-import numpy as np
-import cv2
 import math
 import platform
 from common.is_aarch_64 import is_aarch64
 from common.bus_call import bus_call
 from common.FPS import GETFPS
-import pyds
+try:
+    import pyds
+except ImportError:
+    #only the simulation backend can run without the DeepStream bindings
+    pyds = None
 from threading import Thread
-import datetime
 import os
 import json
-import time
-from queue import Queue
+import queue
+import signal
+from track_cache import TrackCache
+from negative_scheduler import NegativeScheduler
+from negative_dedup import NegativeDedup
+from best_shot import BestShotSelector
+from event_stream import EventPublisher
+from image_writer import SaveRecord, ObjectInfo, make_image_writer
+from frame_ring import RingWriter
+from latency_tracer import LatencyTracer, MetricsServer
+from source_watchdog import SourceWatchdog
+from engine_cache import EngineCache
+from interval_controller import IntervalController
 
 
 MUXER_BATCH_TIMEOUT_USEC=4000000
@@ -59,20 +70,41 @@ if not os.path.exists(path1):
 if not os.path.exists(path2):
     os.mkdir(path2)
 
-#start timer
-init = time.time()
 image_timer = 0
 id_dict = {}
 fps_streams={}
 number_sources = 0 
+#batch size of pgie, sources can be added at run time up to it
+max_sources = 0
+current_config = None
+image_writer = None
+negative_scheduler = None
+negative_dedup = None
+#one image per track from its best frame instead of the first one
+best_shot = None
+#detections of every batch for local consumers
+event_publisher = None
+#class ids that get positive images, empty for all
+save_classes = []
+ready_event = None
+#shared with main_deploy, time of the first and of the latest batch
+frame_heartbeat = None
+latency_tracer = None
+#serves the tracer's metrics, see start_endpoints
+metrics_server = None
+source_watchdog = None
+interval_controller = None
+#stream -> uri of the rtsp sources and the elements of the running pipeline,
+#used to rebuild a single source bin
+source_uris = {}
+pipeline_elements = None
 
 
 # tiler_sink_pad_buffer_probe  will extract metadata received on OSD sink pad
 # and update params for drawing rectangle, object information etc.
 def tiler_src_pad_buffer_probe(pad,info,u_data):
 
-    global init
-    global image_timer
+    global ready_event
 
     frame_number=0
     num_rects=0
@@ -81,10 +113,38 @@ def tiler_src_pad_buffer_probe(pad,info,u_data):
         print("Unable to get GstBuffer ")
         return
 
+    #tell main_deploy that the pipeline is up once the first batch arrives
+    if ready_event is not None:
+        ready_event.set()
+        ready_event = None
+    #the pipeline is up, from now on every source has to deliver
+    if source_watchdog is not None and not source_watchdog.started:
+        source_watchdog.start(time.time())
+    if interval_controller is not None:
+        interval_controller.batch()
+    if frame_heartbeat is not None:
+        frame_heartbeat[1] = time.time()
+        if not frame_heartbeat[0]:
+            frame_heartbeat[0] = frame_heartbeat[1]
+
     # Retrieve batch metadata from the gst_buffer
     # Note that pyds.gst_buffer_get_nvds_batch_meta() expects the
     # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
     batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+    #only collected while a consumer is connected
+    events = [] if event_publisher is not None and event_publisher.active() else None
+    process_frame_list(gst_buffer, batch_meta, events)
+
+    #hand over the tracks that ended
+    if best_shot is not None:
+        best_shot.expire(time.time())
+    if events:
+        event_publisher.publish(time.monotonic(), events)
+        
+    return Gst.PadProbeReturn.OK
+
+def process_frame_list(gst_buffer, batch_meta, events):
+    #walks the frame and object lists of the batch one object at a time
     l_frame = batch_meta.frame_meta_list
     while l_frame is not None:
         try:
@@ -107,7 +167,24 @@ def tiler_src_pad_buffer_probe(pad,info,u_data):
         '''
         frame_number=frame_meta.frame_num
         l_obj=frame_meta.obj_meta_list
+        now = time.time()
         num_rects = frame_meta.num_obj_meta
+        new_objects = []
+        improved = []
+
+        tracks = id_dict.get(frame_meta.pad_index)
+        if tracks is None:
+            #last frames of a source that has just been removed
+            try:
+                l_frame=l_frame.next
+            except StopIteration:
+                break
+            continue
+
+        if latency_tracer is not None:
+            latency_tracer.frame(frame_meta.pad_index, frame_meta.buf_pts)
+        if interval_controller is not None:
+            interval_controller.observe(frame_meta.pad_index, frame_meta.num_obj_meta, now)
 
         while l_obj is not None:
             try: 
@@ -116,52 +193,74 @@ def tiler_src_pad_buffer_probe(pad,info,u_data):
             except StopIteration:
                 break
             
-            if obj_meta.object_id not in list(id_dict[frame_meta.pad_index].queue):
-                if id_dict[frame_meta.pad_index].full():
-                    id_dict[frame_meta.pad_index].get()
-                id_dict[frame_meta.pad_index].put(obj_meta.object_id)
-                #write image when object detected in "positive" folder
-                try:
-                    frame = get_frame(gst_buffer, frame_meta.batch_id)
-                    name= "img_"+datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")+".jpg"
-                    cv2.imwrite(os.path.join(os.path.join(path1,"stream_"+str(frame_meta.pad_index)), name), frame)
-                except cv2.error as e:
-                    print(e)
+            if events is not None:
+                rect = obj_meta.rect_params
+                events.append((frame_meta.pad_index, frame_number, obj_meta.object_id, obj_meta.class_id,
+                               obj_meta.confidence, rect.left, rect.top, rect.width, rect.height))
+            if save_classes and obj_meta.class_id not in save_classes:
+                #no images for this class
+                new = False
+            else:
+                new = not tracks.seen(obj_meta.object_id, now)
+            if best_shot is not None:
+                if new or best_shot.pending(frame_meta.pad_index, obj_meta.object_id):
+                    rect = obj_meta.rect_params
+                    obj = ObjectInfo(obj_meta.object_id, obj_meta.class_id, obj_meta.confidence,
+                                     rect.left, rect.top, rect.width, rect.height)
+                    if best_shot.observe(frame_meta.pad_index, obj, now):
+                        improved.append(obj)
+            elif new:
+                rect = obj_meta.rect_params
+                new_objects.append(ObjectInfo(obj_meta.object_id, obj_meta.class_id, obj_meta.confidence,
+                                              rect.left, rect.top, rect.width, rect.height))
 
             try: 
                 l_obj=l_obj.next
             except StopIteration:
                 break            
-        
-        #write image every n secs if object not detected in "negative" folder
-        if time.time() - init > image_timer:
-            if frame_meta.num_obj_meta==0:
-                try:
-                    frame = get_frame(gst_buffer, frame_meta.batch_id)
-                    name= "img_"+datetime.datetime.now().strftime("%Y%m%d_%H%M%S")+".jpg"
-                    cv2.imwrite(os.path.join(os.path.join(path2,"stream_"+str(frame_meta.pad_index)), name), frame)
-                    init = time.time()
-                except cv2.error as e:
-                    print(e)
-
-        # Get frame rate through this probe
-        fps_streams["stream{0}".format(frame_meta.pad_index)].get_fps()
+
+        save_frame(gst_buffer, frame_meta.pad_index, frame_meta.batch_id, frame_meta.num_obj_meta, now,
+                   new_objects, improved)
         # print([list(id_dict[x].queue) for x in list(id_dict)])
         
         try:
             l_frame=l_frame.next
         except StopIteration:
             break
-        
-    return Gst.PadProbeReturn.OK
+
+def save_frame(gst_buffer, pad_index, batch_id, num_objects, now, new_objects, improved):
+    #hand one image over to the writer for all new objects in this frame, in "positive" folder
+    if new_objects:
+        frame = get_frame(gst_buffer, batch_id)
+        image_writer.submit(SaveRecord(path1, pad_index, now, frame, new_objects))
+    #or keep a copy of the frame for the tracks it is the best one of so far
+    if improved:
+        frame = get_frame(gst_buffer, batch_id)
+        best_shot.snapshot(pad_index, improved, frame, now)
+
+    #write image every n secs per stream if object not detected in "negative" folder,
+    #unless it looks the same as the last one saved for the stream. A frame
+    #the writer refuses is tried again on the next frame.
+    if num_objects==0 and negative_scheduler.due(pad_index, now):
+        frame = get_frame(gst_buffer, batch_id)
+        save, frame_hash = negative_dedup.should_save(pad_index, frame, now)
+        if not save:
+            negative_scheduler.mark_saved(pad_index, now)
+        elif image_writer.submit(SaveRecord(path2, pad_index, now, frame, [])):
+            negative_dedup.mark_saved(pad_index, frame_hash, now)
+            negative_scheduler.mark_saved(pad_index, now)
+
+    # Get frame rate through this probe
+    fps_streams["stream{0}".format(pad_index)].get_fps()
+    if source_watchdog is not None:
+        source_watchdog.heartbeat(pad_index, now)
 
 def get_frame(gst_buffer, batch_id):
+    #numpy view of the RGBA surface. It is only valid inside the probe, the
+    #image writer copies it exactly once (into its queue or a shared-memory
+    #ring slot) and does the colour conversion off the streaming thread.
     n_frame=pyds.get_nvds_buf_surface(hash(gst_buffer),batch_id)
-    #convert python array into numy array format.
-    frame_image=np.array(n_frame,copy=True,order='C')
-    #covert the array into cv2 default color format
-    frame_image=cv2.cvtColor(frame_image,cv2.COLOR_RGBA2BGRA)
-    return frame_image
+    return n_frame
 
 def cb_newpad(decodebin, decoder_src_pad,data):
     print("In cb_newpad\n")
@@ -232,39 +331,362 @@ def create_source_bin(index,uri):
         return None
     return nbin
 
-def deepstream_main(config):
+def link_source_bin(pipeline, streammux, index, uri):
+    #create the source bin of one stream and link it to streammux pad sink_<index>
+    source_bin=create_source_bin(index, uri)
+    if not source_bin:
+        sys.stderr.write("Unable to create source bin \n")
+        return None
+    pipeline.add(source_bin)
+    padname="sink_%u" %index
+    sinkpad= streammux.get_request_pad(padname) 
+    if not sinkpad:
+        sys.stderr.write("Unable to create sink pad bin \n")
+    srcpad=source_bin.get_static_pad("src")
+    if not srcpad:
+        sys.stderr.write("Unable to create src pad bin \n")
+    srcpad.link(sinkpad)
+    return source_bin
+
+def release_source_bin(index):
+    #stop the source bin of one stream and give its streammux pad back,
+    #the other streams keep running
+    pipeline = pipeline_elements["pipeline"]
+    streammux = pipeline_elements["streammux"]
+    source_bin = pipeline_elements["source_bins"].pop(index, None)
+    if source_bin is None:
+        return
+    state_return = source_bin.set_state(Gst.State.NULL)
+    if state_return == Gst.StateChangeReturn.ASYNC:
+        source_bin.get_state(Gst.CLOCK_TIME_NONE)
+    elif state_return == Gst.StateChangeReturn.FAILURE:
+        sys.stderr.write(" Unable to stop source bin %d \n" % index)
+    sinkpad = streammux.get_static_pad("sink_%u" % index)
+    if sinkpad is not None:
+        sinkpad.send_event(Gst.Event.new_flush_stop(False))
+        streammux.release_request_pad(sinkpad)
+    pipeline.remove(source_bin)
+
+def restart_source(index):
+    #rebuild the source bin of one stream on the same streammux pad
+    release_source_bin(index)
+    source_bin = link_source_bin(pipeline_elements["pipeline"], pipeline_elements["streammux"], index,
+                                 source_uris[index])
+    if source_bin is None:
+        return False
+    pipeline_elements["source_bins"][index] = source_bin
+    if latency_tracer is not None:
+        latency_tracer.attach_source(index, source_bin.get_static_pad("src"))
+    source_bin.sync_state_with_parent()
+    return True
+
+def set_tiler_layout(tiler, streams):
+    #tiles are placed by pad index, leave room for the highest one. The
+    #simulation stand-in has no layout.
+    if tiler.find_property("rows") is None:
+        return
+    tiler_sources=max(streams)+1
+    tiler_rows=int(math.sqrt(tiler_sources))
+    tiler_columns=int(math.ceil((1.0*tiler_sources)/tiler_rows))
+    tiler.set_property("rows",tiler_rows)
+    tiler.set_property("columns",tiler_columns)
+
+def set_batch_size(streammux, config):
+    #streammux pushes a batch once it has a frame of every attached source, or
+    #one frame interval after the first one when a source is late. Its batch
+    #size follows the attached sources, pgie keeps max_sources so that the
+    #engine does not change. The simulation stand-in does no batching.
+    if streammux.find_property("batch-size") is None:
+        return
+    streammux.set_property('batch-size', max(1, len(id_dict)))
+    streammux.set_property('batched-push-timeout', int(1000000 / config["source_fps"]))
+
+def add_source(index, uri):
+    #add a camera to the running pipeline on streammux pad sink_<index>
+    if index in id_dict:
+        return {"ok": False, "error": "stream_%d is already running" % index}
+    if len(id_dict) >= max_sources:
+        return {"ok": False, "error": "all %d batch slots are in use, raise 'max_sources' and restart" % max_sources}
+    backend = current_config["backend"]
+    if backend != "simulation" and current_config["source_type"] != "rtsp":
+        return {"ok": False, "error": "sources can only be added to rtsp pipelines"}
+
+    #the source bin is linked first and only started once the stream state
+    #exists, so nothing changes if it cannot be created and the probe knows
+    #the stream before its first frame
+    source_bin = None
+    if backend != "simulation":
+        source_bin = link_source_bin(pipeline_elements["pipeline"], pipeline_elements["streammux"], index, uri)
+        if source_bin is None:
+            return {"ok": False, "error": "unable to create the source bin of stream_%d" % index}
+    init_stream(index, current_config)
+    negative_scheduler.add_stream(index)
+    set_tiler_layout(pipeline_elements["tiler"], list(id_dict))
+    set_batch_size(pipeline_elements["streammux"], current_config)
+    if source_bin is None:
+        pyds.scene.add_stream(index)
+    else:
+        source_uris[index] = uri
+        pipeline_elements["source_bins"][index] = source_bin
+        if latency_tracer is not None:
+            latency_tracer.attach_source(index, source_bin.get_static_pad("src"))
+        if source_watchdog is not None:
+            source_watchdog.add_stream(index)
+        source_bin.sync_state_with_parent()
+    print("Added stream_%d: %s" % (index, uri))
+    return {"ok": True, "streams": sorted(id_dict)}
+
+def remove_source(index):
+    #remove a camera from the running pipeline, the other streams keep going
+    if index not in id_dict:
+        return {"ok": False, "error": "stream_%d is not running" % index}
+    if len(id_dict) == 1:
+        return {"ok": False, "error": "stream_%d is the last source, use stop instead" % index}
+    if current_config["backend"] == "simulation":
+        pyds.scene.remove_stream(index)
+    else:
+        release_source_bin(index)
+    remove_stream(index)
+    set_tiler_layout(pipeline_elements["tiler"], list(id_dict))
+    set_batch_size(pipeline_elements["streammux"], current_config)
+    print("Removed stream_%d" % index)
+    return {"ok": True, "streams": sorted(id_dict)}
+
+def remove_stream(index):
+    id_dict.pop(index, None)
+    fps_streams.pop("stream{0}".format(index), None)
+    source_uris.pop(index, None)
+    negative_scheduler.remove_stream(index)
+    negative_dedup.remove_stream(index)
+    if best_shot is not None:
+        best_shot.flush(index)
+    if source_watchdog is not None:
+        source_watchdog.remove_stream(index)
+    if latency_tracer is not None:
+        latency_tracer.detach_source(index)
+
+def process_commands(commands, results):
+    #GLib timeout callback, runs source changes sent by main_deploy on the
+    #main loop thread and answers each of them on results, tagged with the
+    #request id it came with
+    while True:
+        try:
+            request, command, args = commands.get_nowait()
+        except queue.Empty:
+            return True
+        try:
+            if command == "add":
+                reply = add_source(*args)
+            elif command == "remove":
+                reply = remove_source(*args)
+            elif command == "config":
+                reply = apply_config(*args)
+            else:
+                reply = {"ok": False, "error": "unknown command '%s'" % command}
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        results.put((request, reply))
+
+def apply_config(changes):
+    #config.json changes that main_deploy found can be applied to the running
+    #pipeline, {key: new value}. Everything is set again from the updated
+    #config, which is cheap and keeps the helpers in line with it.
+    global image_timer
+    global save_classes
+    current_config.update(changes)
+    config = current_config
+
+    image_timer = config["image_timer"]
+    save_classes = list(config["save_classes"])
+    negative_scheduler.set_interval(image_timer, config["image_timer_jitter"])
+    for tracks in id_dict.values():
+        tracks.resize(max_size=config["queue_size"], ttl=config["track_ttl"])
+    set_batch_size(pipeline_elements["streammux"], config)
+    tiler = pipeline_elements["tiler"]
+    if tiler.find_property("width") is not None:
+        tiler.set_property("width", config["tiler_width"])
+        tiler.set_property("height", config["tiler_height"])
+    negative_dedup.threshold = config["negative_dedup_threshold"]
+    negative_dedup.max_interval = config["negative_dedup_max_interval"]
+    if best_shot is not None:
+        best_shot.timeout = config["best_shot_timeout"]
+        best_shot.max_age = config["best_shot_max_age"]
+        best_shot.max_pending = max(1, config["best_shot_max_pending"])
+        best_shot.min_improvement = config["best_shot_min_improvement"]
+    if source_watchdog is not None:
+        source_watchdog.stall_timeout = config["source_stall_timeout"]
+        source_watchdog.backoff = config["source_restart_backoff"]
+        source_watchdog.backoff_max = config["source_restart_backoff_max"]
+    if interval_controller is not None:
+        interval_controller.min_interval = config["interval_min"]
+        interval_controller.max_interval = config["interval_max"]
+        interval_controller.busy_ratio = config["interval_busy_ratio"]
+        interval_controller.idle_ratio = config["interval_idle_ratio"]
+        interval_controller.hold = config["interval_hold"]
+        interval_controller.target_fps = config["interval_target_fps"]
+
+    if changes.get("bind_endpoints"):
+        #main_deploy has stopped the pipeline this one replaces
+        start_endpoints(config)
+    if "display" in changes:
+        error = swap_sink(config["display"])
+        if error is not None:
+            return {"ok": False, "error": error}
+    print("Applied config changes: ", sorted(changes))
+    return {"ok": True, "applied": sorted(changes)}
+
+def swap_sink(display):
+    #switch the sink between nveglglessink and fakesink while the pipeline
+    #keeps running. The swap is done from an idle probe on queue8 so that no
+    #buffer is on its way into the old sink.
+    if current_config["backend"] == "simulation":
+        #the simulation pipeline always ends in a fakesink
+        return None
+    pipeline = pipeline_elements["pipeline"]
+    old_sink = pipeline_elements["sink"]
+    queue8 = pipeline_elements["queues"][7]
+    transform = pipeline.get_by_name("nvegl-transform")
+    if display:
+        sink = Gst.ElementFactory.make("nveglglessink", "nvvideo-renderer")
+    else:
+        sink = Gst.ElementFactory.make("fakesink", "fakesink")
+    if not sink:
+        return "unable to create the %s" % ("egl sink" if display else "fake sink")
+    sink.set_property("qos",0)
+    sink.set_property("sync",0)
+
+    def swap(pad, info):
+        #queue8 feeds either the sink or, on jetson with display, the transform
+        peer = pad.get_peer()
+        if peer is not None:
+            pad.unlink(peer)
+        if transform is not None:
+            transform.unlink(old_sink)
+        old_sink.set_state(Gst.State.NULL)
+        pipeline.remove(old_sink)
+        pipeline.add(sink)
+        if transform is not None and display:
+            queue8.link(transform)
+            transform.link(sink)
+        else:
+            queue8.link(sink)
+        sink.sync_state_with_parent()
+        pipeline_elements["sink"] = sink
+        print("Swapped the sink for", sink.get_factory().get_name())
+        return Gst.PadProbeReturn.REMOVE
+
+    queue8.get_static_pad("src").add_probe(Gst.PadProbeType.IDLE, swap)
+    return None
+
+def start_endpoints(config):
+    #metrics port and event socket, the fixed addresses other programs
+    #connect to. Bound at start, or once the old pipeline is gone when this
+    #one was started next to it.
+    global metrics_server
+    global event_publisher
+    if latency_tracer is not None and metrics_server is None:
+        metrics_host = config["metrics_host"]
+        metrics_port = config["metrics_port"]
+        metrics_server = MetricsServer(latency_tracer, port=metrics_port, host=metrics_host)
+        metrics_server.start()
+        print("Metrics on http://%s:%d/metrics" % (metrics_host, metrics_port))
+
+    #detection events on a local socket, see event_stream.py
+    if config["event_socket"] and event_publisher is None:
+        event_publisher = EventPublisher(config["event_socket"], queue_size=config["event_queue_size"],
+                                         subscriber_buffer=config["event_subscriber_buffer"])
+        event_publisher.start()
+        print("Detection events on", config["event_socket"])
+        if latency_tracer is not None:
+            latency_tracer.add_provider("events", event_publisher.stats)
+
+def check_sources():
+    #GLib timeout callback, restarts stalled sources with backoff
+    now = time.time()
+    for stream in source_watchdog.due(now):
+        print("Source %d stalled for %.1f s, restarting its source bin" % (stream, source_watchdog.stalled_for(stream, now)))
+        restart_source(stream)
+        source_watchdog.restarted(stream, now)
+    return True
+
+def get_stream_ids(config):
+    #"stream_2" -> 2 for every configured source, sorted
+    if config["source_type"] != "rtsp":
+        return [0]
+    return sorted(int(name.split("_")[-1]) for name in config["source"])
+
+def init_streams(config, frame_ring=None):
 
     global image_timer
     global number_sources
     global id_dict
     global fps_streams
+    global image_writer
+    global negative_scheduler
+    global negative_dedup
+    global best_shot
+    global save_classes
+    global source_uris
+    global max_sources
+
+    #main_deploy may leave out cameras that failed their health check, so the
+    #stream numbers (used as streammux pad index) are not always contiguous
+    streams = get_stream_ids(config)
+    number_sources = len(streams)
+    max_sources = max(number_sources, config["max_sources"])
+    if config["source_type"] == "rtsp":
+        source_uris = {i: config["source"]["stream_" + str(i)] for i in streams}
+    else:
+        source_uris = {}
+
+    image_timer = config["image_timer"]
+    save_classes = list(config["save_classes"])
+    #background writer so that encoding and disk writes stay off the streaming thread
+    #when main_deploy runs a separate encoder process, frames go through the
+    #shared-memory ring instead
+    if frame_ring is not None:
+        image_writer = RingWriter(frame_ring)
+    else:
+        image_writer = make_image_writer(config)
+    #per stream deadlines for "negative" images, staggered across streams
+    negative_scheduler = NegativeScheduler(streams, image_timer,
+                                           jitter=config["image_timer_jitter"])
+    #skip negatives that look like the last one saved, static cameras would
+    #otherwise fill the folder with copies of the same empty scene
+    negative_dedup = NegativeDedup(threshold=config["negative_dedup_threshold"],
+                                   max_interval=config["negative_dedup_max_interval"])
+    best_shot = None
+    if config["best_shot"]:
+        best_shot = BestShotSelector(image_writer.submit, category=path1,
+                                     timeout=config["best_shot_timeout"],
+                                     max_age=config["best_shot_max_age"],
+                                     max_pending=config["best_shot_max_pending"],
+                                     min_improvement=config["best_shot_min_improvement"])
+    id_dict.clear()
+    fps_streams.clear()
+    for i in streams:
+        init_stream(i, config)
+    return streams
+
+def init_stream(i, config):
+    #initialise id dictionary to keep track of object_id streamwise
+    id_dict[i] = TrackCache(max_size=config["queue_size"], ttl=config["track_ttl"])
+    fps_streams["stream{0}".format(i)]=GETFPS(i)
+    #create image directories for separate streams
+    if not os.path.exists(os.path.join(path1,"stream_"+str(i))):
+        os.mkdir(os.path.join(path1,"stream_"+str(i)))
+    if not os.path.exists(os.path.join(path2,"stream_"+str(i))):
+        os.mkdir(os.path.join(path2,"stream_"+str(i)))
+
+def build_pipeline(config, streams):
 
     source_type = config["source_type"]
     sources = config["source"]
-    if config["source_type"] == "rtsp":
-        number_sources = len(list(sources))
-    elif config["source_type"] == "mipi" or config["source_type"] == "usb":
-        number_sources = 1
-
     display = config["display"]
     MUXER_OUTPUT_WIDTH = config["processing_width"]
     MUXER_OUTPUT_HEIGHT = config["processing_height"]
     TILED_OUTPUT_WIDTH = config["tiler_width"]
     TILED_OUTPUT_HEIGHT = config["tiler_height"]
-    image_timer = config["image_timer"]
-    for i in range(number_sources):
-        #initialise id dictionary to keep track of object_id streamwise
-        id_dict[i] = Queue(maxsize=config["queue_size"])
-        fps_streams["stream{0}".format(i)]=GETFPS(i)
-        #create image directories for separate streams
-        if not os.path.exists(os.path.join(path1,"stream_"+str(i))):
-            os.mkdir(os.path.join(path1,"stream_"+str(i)))
-        if not os.path.exists(os.path.join(path2,"stream_"+str(i))):
-            os.mkdir(os.path.join(path2,"stream_"+str(i)))
-
-    # Standard GStreamer initialization
-    GObject.threads_init()
-    Gst.init(None)
 
     # Create gstreamer elements */
     # Create Pipeline element that will form a connection of other elements
@@ -281,25 +703,17 @@ def deepstream_main(config):
         sys.stderr.write(" Unable to create NvStreamMux \n")
     pipeline.add(streammux)
 
+    source_bins = {}
     if source_type == "rtsp":
         is_live = False
-        for i in range(number_sources):
+        for i in streams:
             print("Creating source_bin ",i," \n ")
             uri_name=sources["stream_"+str(i)]
             if uri_name.find("rtsp://") == 0 :
                 is_live = True
-            source_bin=create_source_bin(i, uri_name)
-            if not source_bin:
-                sys.stderr.write("Unable to create source bin \n")
-            pipeline.add(source_bin)
-            padname="sink_%u" %i
-            sinkpad= streammux.get_request_pad(padname) 
-            if not sinkpad:
-                sys.stderr.write("Unable to create sink pad bin \n")
-            srcpad=source_bin.get_static_pad("src")
-            if not srcpad:
-                sys.stderr.write("Unable to create src pad bin \n")
-            srcpad.link(sinkpad)
+            source_bin=link_source_bin(pipeline, streammux, i, uri_name)
+            if source_bin:
+                source_bins[i] = source_bin
 
         if is_live:
             print("Atleast one of the sources is live")
@@ -407,46 +821,47 @@ def deepstream_main(config):
             sys.stderr.write(" Unable to create fake sink \n")
 
     # Set properties of tracker
-    config = configparser.ConfigParser()
-    config.read('dstest2_tracker_config.txt')
-    config.sections()
+    tracker_config = configparser.ConfigParser()
+    tracker_config.read('dstest2_tracker_config.txt')
+    tracker_config.sections()
 
-    for key in config['tracker']:
+    for key in tracker_config['tracker']:
         if key == 'tracker-width':
-            tracker_width = config.getint('tracker', key)
+            tracker_width = tracker_config.getint('tracker', key)
             tracker.set_property('tracker-width', tracker_width)
         if key == 'tracker-height':
-            tracker_height = config.getint('tracker', key)
+            tracker_height = tracker_config.getint('tracker', key)
             tracker.set_property('tracker-height', tracker_height)
         if key == 'gpu-id':
-            tracker_gpu_id = config.getint('tracker', key)
+            tracker_gpu_id = tracker_config.getint('tracker', key)
             tracker.set_property('gpu_id', tracker_gpu_id)
         if key == 'll-lib-file':
-            tracker_ll_lib_file = config.get('tracker', key)
+            tracker_ll_lib_file = tracker_config.get('tracker', key)
             tracker.set_property('ll-lib-file', tracker_ll_lib_file)
         if key == 'll-config-file':
-            tracker_ll_config_file = config.get('tracker', key)
+            tracker_ll_config_file = tracker_config.get('tracker', key)
             tracker.set_property('ll-config-file', tracker_ll_config_file)
         if key == 'enable-batch-process':
-            tracker_enable_batch_process = config.getint('tracker', key)
+            tracker_enable_batch_process = tracker_config.getint('tracker', key)
             tracker.set_property('enable_batch_process',
                                  tracker_enable_batch_process)
 
     streammux.set_property('width', MUXER_OUTPUT_WIDTH)
     streammux.set_property('height', MUXER_OUTPUT_HEIGHT)
-    streammux.set_property('batch-size', number_sources)
-    streammux.set_property('batched-push-timeout', 4000000)
-
-    pgie.set_property('config-file-path', "primary_config.txt")
+    set_batch_size(streammux, config)
+
+    #per run copy of the pgie config pointing at a cached engine built for
+    #this batch size, so that nvinfer does not rebuild it on every start
+    pgie_config = config["pgie_config"]
+    if config["engine_cache_dir"]:
+        pgie_config = EngineCache(config["engine_cache_dir"]).run_config(pgie_config, max_sources)
+    pgie.set_property('config-file-path', pgie_config)
     pgie_batch_size=pgie.get_property("batch-size")
-    if(pgie_batch_size != number_sources):
-        print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", number_sources," \n")
-        pgie.set_property("batch-size",number_sources)
+    if(pgie_batch_size != max_sources):
+        print("WARNING: Overriding infer-config batch-size",pgie_batch_size," with number of sources ", max_sources," \n")
+        pgie.set_property("batch-size",max_sources)
 
-    tiler_rows=int(math.sqrt(number_sources))
-    tiler_columns=int(math.ceil((1.0*number_sources)/tiler_rows))
-    tiler.set_property("rows",tiler_rows)
-    tiler.set_property("columns",tiler_columns)
+    set_tiler_layout(tiler, streams)
     tiler.set_property("width", TILED_OUTPUT_WIDTH)
     tiler.set_property("height", TILED_OUTPUT_HEIGHT)
 
@@ -553,23 +968,137 @@ def deepstream_main(config):
         nvosd.link(queue8)
         queue8.link(sink)   
 
+    return {"pipeline": pipeline, "streammux": streammux, "pgie": pgie, "tracker": tracker,
+            "tiler": tiler, "nvosd": nvosd, "sink": sink, "source_bins": source_bins,
+            "queues": [queue1, queue2, queue3, queue4, queue5, queue6, queue7, queue8]}
+
+def deepstream_main(config, frame_ring=None, ready=None, commands=None, results=None, heartbeat=None):
+
+    global ready_event
+    global pyds
+    global latency_tracer
+    global source_watchdog
+    global pipeline_elements
+    global current_config
+    global frame_heartbeat
+    global interval_controller
+    global event_publisher
+    global metrics_server
+
+    current_config = config
+    streams = init_streams(config, frame_ring)
+    ready_event = ready
+    frame_heartbeat = heartbeat
+    sources = config["source"]
+
+    # Standard GStreamer initialization
+    GObject.threads_init()
+    Gst.init(None)
+
+    #the simulation backend swaps the NV elements for stand-ins and pyds for a
+    #synthetic metadata provider, the probe and save path stay the same
+    if config["backend"] == "simulation":
+        import simulation
+        pyds = simulation.SimulatedPyds(config, streams)
+        elements = simulation.build_pipeline(config, streams)
+    else:
+        elements = build_pipeline(config, streams)
+    pipeline_elements = elements
+    pipeline = elements["pipeline"]
+    tiler = elements["tiler"]
+
     # create an event loop and feed gstreamer bus messages to it
     loop = GObject.MainLoop()
     bus = pipeline.get_bus()
     bus.add_signal_watch()
     bus.connect ("message", bus_call, loop)
 
+    #main_deploy stops the worker with SIGTERM, leave the loop so that the
+    #cleanup below writes what is still queued instead of dropping it
+    def stop_loop():
+        print("Stop signal received")
+        loop.quit()
+        return False
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, stop_loop)
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, stop_loop)
+
+    #optional fixed run time, used for benchmarking
+    duration = config["run_duration"]
+    if duration:
+        GLib.timeout_add(int(duration * 1000), loop.quit)
+
+    #sources added or removed at run time by main_deploy
+    if commands is not None:
+        GLib.timeout_add(200, process_commands, commands, results)
+
     tiler_src_pad=tiler.get_static_pad("sink")
     if not tiler_src_pad:
         sys.stderr.write(" Unable to get src pad \n")
     tiler_src_pad.add_probe(Gst.PadProbeType.BUFFER, tiler_src_pad_buffer_probe, 0)
 
+    #optional per stage latency tracing, added after the save probe so that
+    #its time shows up as a stage of its own
+    latency_tracer = None
+    if config["latency_tracing"]:
+        latency_tracer = LatencyTracer(sample_every=config["latency_sample_every"],
+                                       window=config["latency_window"])
+        latency_tracer.attach(elements)
+        latency_tracer.add_provider("image_writer", image_writer.stats)
+        latency_tracer.add_provider("negative_dedup", negative_dedup.stats)
+        if best_shot is not None:
+            latency_tracer.add_provider("best_shot", best_shot.stats)
+        GLib.timeout_add(int(config["queue_poll_interval"] * 1000), latency_tracer.poll_queues)
+
+    #main_deploy clears bind_endpoints when this pipeline starts next to the
+    #one it replaces, which still holds the metrics port and event socket
+    metrics_server = None
+    event_publisher = None
+    if config.get("bind_endpoints", True):
+        start_endpoints(config)
+
+    #inference interval following how busy the scenes are
+    interval_controller = None
+    if config["adaptive_interval"]:
+        pgie = elements["pgie"]
+        if pgie.find_property("interval") is not None:
+            interval = pgie.get_property("interval")
+            apply = lambda value: pgie.set_property("interval", value)
+        else:
+            #simulation stand-in, decisions are only logged
+            interval = config["interval_max"]
+            apply = None
+        trace = open(config["interval_trace"], "a") if config["interval_trace"] else None
+        interval_controller = IntervalController(interval=interval,
+                                                 min_interval=config["interval_min"],
+                                                 max_interval=config["interval_max"],
+                                                 period=config["interval_period"],
+                                                 busy_ratio=config["interval_busy_ratio"],
+                                                 idle_ratio=config["interval_idle_ratio"],
+                                                 hold=config["interval_hold"],
+                                                 target_fps=config["interval_target_fps"],
+                                                 apply=apply, trace=trace)
+        GLib.timeout_add(int(config["interval_period"] * 1000), interval_controller.tick)
+        if latency_tracer is not None:
+            latency_tracer.add_provider("inference", interval_controller.stats)
+
+    #rebuild the source bin of a camera that stops sending instead of the whole pipeline
+    source_watchdog = None
+    stall_timeout = config["source_stall_timeout"]
+    if stall_timeout and elements["source_bins"]:
+        source_watchdog = SourceWatchdog(streams, stall_timeout=stall_timeout,
+                                         backoff=config["source_restart_backoff"],
+                                         backoff_max=config["source_restart_backoff_max"])
+        GLib.timeout_add(1000, check_sources)
+        if latency_tracer is not None:
+            latency_tracer.add_provider("sources", source_watchdog.stats)
+
     # List the sources
     print("Now playing...")
     for i, src in sources.items():
         print(i, ": ", src)
 
     print("Starting pipeline \n")
+    image_writer.start()
     # start play back and listed to events		
     pipeline.set_state(Gst.State.PLAYING)
     try:
@@ -580,6 +1109,33 @@ def deepstream_main(config):
 
     print("Exiting app\n")
     pipeline.set_state(Gst.State.NULL)
+    if best_shot is not None:
+        best_shot.flush()
+    image_writer.stop()
+    print("Image writer: ", image_writer.stats())
+    if metrics_server is not None:
+        metrics_server.stop()
+    if event_publisher is not None:
+        event_publisher.stop()
+        print("Detection events: ", event_publisher.stats())
+    if interval_controller is not None and interval_controller.trace is not None:
+        interval_controller.trace.close()
+    return elements
+
+def standby_main(conn, ready=None, commands=None, results=None, heartbeat=None):
+    #warm standby worker: imports and Gst.init are done before the config
+    #arrives on conn, None means stop
+    GObject.threads_init()
+    Gst.init(None)
+    conn.send("warm")
+    try:
+        config = conn.recv()
+    except EOFError:
+        return
+    conn.close()
+    if config is None:
+        return
+    return deepstream_main(config, None, ready, commands, results, heartbeat)
 
 # if __name__ == '__main__':
 #     sys.exit(deepstream_main(config))
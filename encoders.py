@@ -0,0 +1,76 @@
+import numpy as np
+import cv2
+
+
+# Image encoders used by the image writer. Every encoder takes the RGBA frame
+# copied from the NVMM surface and converts it once, straight to the layout
+# the backend needs.
+
+class JpegEncoder:
+
+    extension = ".jpg"
+
+    def __init__(self, quality=95):
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+
+    def encode(self, frame):
+        ok, data = cv2.imencode(self.extension, cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR), self.params)
+        if not ok:
+            raise cv2.error("Unable to encode " + self.extension)
+        return data.tobytes()
+
+    def write(self, path, frame):
+        return cv2.imwrite(path, cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR), self.params)
+
+
+class PngEncoder(JpegEncoder):
+
+    extension = ".png"
+
+    def __init__(self, compression=3):
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, int(compression)]
+
+
+class WebpEncoder(JpegEncoder):
+
+    extension = ".webp"
+
+    def __init__(self, quality=90):
+        self.params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+
+
+class NpyEncoder:
+
+    # Raw RGBA passthrough, no colour conversion or compression at all.
+    extension = ".npy"
+
+    def encode(self, frame):
+        return np.ascontiguousarray(frame).tobytes()
+
+    def write(self, path, frame):
+        np.save(path, frame)
+        return True
+
+
+ENCODERS = {
+    "jpeg": (JpegEncoder, ["quality"]),
+    "png": (PngEncoder, ["compression"]),
+    "webp": (WebpEncoder, ["quality"]),
+    "npy": (NpyEncoder, []),
+}
+
+DEFAULT_ENCODER = {"format": "jpeg", "quality": 95}
+
+
+def make_encoder(spec=None):
+    # spec is a dict from config.json, e.g. {"format": "jpeg", "quality": 90}
+    if spec is None:
+        spec = DEFAULT_ENCODER
+    fmt = spec.get("format", "jpeg")
+    if fmt not in ENCODERS:
+        raise ValueError("Unknown encoder format '%s'. Valid values are %s" % (fmt, ", ".join(ENCODERS)))
+    cls, params = ENCODERS[fmt]
+    for key in spec:
+        if key != "format" and key not in params:
+            raise ValueError("Unknown option '%s' for encoder format '%s'" % (key, fmt))
+    return cls(**{key: spec[key] for key in params if key in spec})
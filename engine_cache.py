@@ -0,0 +1,169 @@
+import os
+import re
+import sys
+import shutil
+import argparse
+import configparser
+
+
+# network-mode of the nvinfer config -> suffix nvinfer uses for engine files
+NETWORK_MODES = {0: "fp32", 1: "int8", 2: "fp16"}
+
+# keys whose value is the model nvinfer builds the engine from, in the order
+# nvinfer looks at them
+MODEL_KEYS = ["tlt-encoded-model", "onnx-file", "uff-file", "model-file"]
+
+# keys holding paths relative to the config file
+PATH_KEYS = MODEL_KEYS + ["model-engine-file", "labelfile-path", "proto-file", "int8-calib-file", "mean-file",
+                          "custom-lib-path"]
+
+ENGINE_PATTERN = re.compile(r"^(?P<model>.+)_b(?P<batch>\d+)_gpu(?P<gpu>\d+)_(?P<mode>fp32|int8|fp16)\.engine$")
+
+
+def read_pgie_config(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read(path)
+    return parser
+
+
+def engine_name(model, batch, gpu_id=0, network_mode=0):
+    # googlenet.etlt, 4, 0, 0 -> googlenet.etlt_b4_gpu0_fp32.engine, the name
+    # nvinfer gives the engines it builds
+    return "%s_b%d_gpu%d_%s.engine" % (os.path.basename(model), batch, gpu_id, NETWORK_MODES[network_mode])
+
+
+def engine_key(parser):
+    # (model path, gpu id, network mode) of the [property] section
+    prop = parser["property"]
+    model = next((prop[key] for key in MODEL_KEYS if prop.get(key)), None)
+    if model is None:
+        raise ValueError("no model file (%s) in the pgie config" % ", ".join(MODEL_KEYS))
+    return model, int(prop.get("gpu-id", 0)), int(prop.get("network-mode", 0))
+
+
+class EngineCache:
+
+    # Engines live in cache_dir under the nvinfer name, which encodes model,
+    # batch size, gpu and precision. For a batch size the exact engine is
+    # taken if there is one, otherwise the smallest engine built for a larger
+    # batch (implicit batch engines run any batch up to the one they were
+    # built for). The directory of the model is searched too since that is
+    # where nvinfer saves engines it had to build.
+    def __init__(self, cache_dir="engines"):
+        self.cache_dir = cache_dir
+
+    def engines(self, model, gpu_id=0, network_mode=0, search=()):
+        # {batch: path} of the usable engines
+        found = {}
+        base = os.path.basename(model)
+        for directory in (self.cache_dir,) + tuple(search):
+            if not directory or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                match = ENGINE_PATTERN.match(name)
+                if match is None or match.group("model") != base:
+                    continue
+                if int(match.group("gpu")) != gpu_id or match.group("mode") != NETWORK_MODES[network_mode]:
+                    continue
+                found.setdefault(int(match.group("batch")), os.path.join(directory, name))
+        return found
+
+    def select(self, model, batch, gpu_id=0, network_mode=0, search=()):
+        # Path of the engine to use for batch, None if it has to be built
+        engines = self.engines(model, gpu_id, network_mode, search)
+        usable = [b for b in engines if b >= batch]
+        if not usable:
+            return None
+        return engines[min(usable)]
+
+    def run_config(self, pgie_config, batch):
+        # Writes the nvinfer config for batch into the cache directory and
+        # returns its path. Relative paths are made absolute, batch-size is
+        # set and model-engine-file points at the selected engine, or at the
+        # name nvinfer will build so the next start finds it.
+        parser = read_pgie_config(pgie_config)
+        base_dir = os.path.dirname(os.path.abspath(pgie_config))
+        prop = parser["property"]
+        for key in PATH_KEYS:
+            if prop.get(key) and not os.path.isabs(prop[key]):
+                prop[key] = os.path.normpath(os.path.join(base_dir, prop[key]))
+        model, gpu_id, network_mode = engine_key(parser)
+        engine = self.select(model, batch, gpu_id, network_mode, search=(os.path.dirname(model),))
+        if engine is None:
+            engine = os.path.join(os.path.dirname(model), engine_name(model, batch, gpu_id, network_mode))
+            print("No engine for batch size %d in %s, nvinfer will build %s" % (batch, self.cache_dir, engine))
+        else:
+            print("Using engine %s for batch size %d" % (engine, batch))
+        prop["model-engine-file"] = os.path.abspath(engine)
+        prop["batch-size"] = str(batch)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(pgie_config))[0]
+        path = os.path.join(self.cache_dir, "%s_b%d_gpu%d_%s.txt" % (name, batch, gpu_id, NETWORK_MODES[network_mode]))
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "w") as f:
+            parser.write(f)
+        os.replace(tmp, path)
+        return path
+
+    def collect(self, pgie_config):
+        # Moves engines nvinfer built next to the model into the cache
+        parser = read_pgie_config(pgie_config)
+        model, gpu_id, network_mode = engine_key(parser)
+        model = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(pgie_config)), model))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        moved = []
+        for batch, path in self.engines(model, gpu_id, network_mode, search=(os.path.dirname(model),)).items():
+            if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.cache_dir):
+                target = os.path.join(self.cache_dir, os.path.basename(path))
+                shutil.move(path, target)
+                moved.append(target)
+        return moved
+
+
+def prebuild(pgie_config, batch, cache, width=640, height=480):
+    # Builds the engine for batch by running nvinfer on a single test frame
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    Gst.init(None)
+    run_config = cache.run_config(pgie_config, batch)
+    pipeline = Gst.parse_launch(
+        "videotestsrc num-buffers=1 ! nvvideoconvert ! video/x-raw(memory:NVMM),format=NV12 ! m.sink_0 "
+        "nvstreammux name=m batch-size=%d width=%d height=%d ! nvinfer config-file-path=%s batch-size=%d ! fakesink"
+        % (batch, width, height, run_config, batch))
+    pipeline.set_state(Gst.State.PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if message.type == Gst.MessageType.ERROR:
+        err, debug = message.parse_error()
+        sys.stderr.write("Building the batch %d engine failed: %s %s\n" % (batch, err, debug))
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or pre-build TensorRT engines for the pgie config")
+    parser.add_argument("--config", default="primary_config.txt", help="nvinfer config file")
+    parser.add_argument("--cache-dir", default="engines")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--build", action="store_true", help="build the engines that are missing")
+    args = parser.parse_args()
+
+    cache = EngineCache(args.cache_dir)
+    pgie = read_pgie_config(args.config)
+    model, gpu_id, network_mode = engine_key(pgie)
+    model = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(args.config)), model))
+    for batch in args.batch_sizes:
+        engine = cache.select(model, batch, gpu_id, network_mode, search=(os.path.dirname(model),))
+        if engine is None and args.build:
+            print("Building engine for batch size %d" % batch)
+            if prebuild(args.config, batch, cache):
+                cache.collect(args.config)
+                engine = cache.select(model, batch, gpu_id, network_mode)
+        print("batch %3d: %s" % (batch, engine or "missing"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+import numpy as np
+
+
+EVENT_SOCKET = os.path.join("check", "events.sock")
+
+# Order of the values of one detection in a published batch
+EVENT_FIELDS = ("stream", "frame", "track", "class", "confidence", "left", "top", "width", "height")
+
+
+def encode_batch(timestamp, events):
+    # One json line per batch: {"time": <monotonic seconds>, "events": [[...], ...]}
+    # with the values of every event in EVENT_FIELDS order
+    rows = [[stream, frame, track, class_id, round(confidence, 3), round(left, 1), round(top, 1),
+             round(width, 1), round(height, 1)]
+            for stream, frame, track, class_id, confidence, left, top, width, height in events]
+    return (json.dumps({"time": round(timestamp, 6), "events": rows}, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class _Subscriber:
+
+    # Connected consumer with its own bounded send buffer. A batch that does
+    # not fit is dropped for this consumer only, whole lines at a time.
+    def __init__(self, sock, max_buffer):
+        self.sock = sock
+        self.max_buffer = max_buffer
+        self.buffer = bytearray()
+        self.dropped = 0
+
+    def write(self, data, batches):
+        if len(self.buffer) + len(data) > self.max_buffer:
+            self.dropped += batches
+        else:
+            self.buffer += data
+        return self.flush()
+
+    def unsent(self):
+        # batches in the buffer that the consumer has not fully received
+        return self.buffer.count(b"\n")
+
+    def flush(self):
+        # False once the consumer has gone away
+        while self.buffer:
+            try:
+                sent = self.sock.send(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return True
+            except OSError:
+                return False
+            del self.buffer[:sent]
+        return True
+
+
+class EventPublisher:
+
+    # Publishes the detections of every batch as json lines on a Unix socket
+    # that any number of consumers can connect to. publish() only appends to
+    # a bounded queue, the serialisation and the non-blocking sends run in a
+    # background thread. Batches are dropped and counted when the queue is
+    # full, and per consumer when its send buffer is full, so a slow consumer
+    # never holds up the pad probe. stop() sends what is queued and gives the
+    # consumers stop_timeout seconds to read it, the rest counts as dropped.
+    def __init__(self, path=EVENT_SOCKET, queue_size=64, subscriber_buffer=1 << 20, stop_timeout=1.0):
+        self.path = path
+        self.queue_size = max(1, queue_size)
+        self.subscriber_buffer = subscriber_buffer
+        self.stop_timeout = stop_timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._subscribers = []
+        self._listener = None
+        self._thread = None
+        self._running = False
+
+        self.published = 0
+        self.dropped = 0
+        self.sent = 0
+        # batches dropped at consumers that have disconnected since
+        self.subscriber_dropped = 0
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen(8)
+        self._listener.setblocking(False)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close_subscribers()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def active(self):
+        # True while a consumer is connected, the probe skips collecting
+        # events otherwise
+        return bool(self._subscribers)
+
+    def publish(self, timestamp, events):
+        # Called from the pad probe with the (stream, frame, track, class,
+        # confidence, left, top, width, height) tuples of one batch
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                return False
+            self._queue.append((timestamp, events))
+            self.published += 1
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and not self._queue:
+                    self._cond.wait(0.1)
+                running = self._running
+                batches = list(self._queue)
+                self._queue.clear()
+            if running:
+                self._accept()
+            self._send(batches)
+            if not running:
+                self._drain()
+                return
+
+    def _send(self, batches):
+        data = b"".join(encode_batch(timestamp, events) for timestamp, events in batches)
+        self.sent += len(batches)
+        alive = []
+        for subscriber in self._subscribers:
+            if subscriber.write(data, len(batches)) if data else subscriber.flush():
+                alive.append(subscriber)
+            else:
+                self.subscriber_dropped += subscriber.dropped + subscriber.unsent()
+                subscriber.sock.close()
+        self._subscribers = alive
+
+    def _drain(self):
+        # Last sends on stop, until every consumer has its batches or
+        # stop_timeout is over
+        deadline = time.monotonic() + self.stop_timeout
+        while any(subscriber.buffer for subscriber in self._subscribers) and time.monotonic() < deadline:
+            self._send([])
+            time.sleep(0.005)
+        self._close_subscribers()
+
+    def _close_subscribers(self):
+        for subscriber in self._subscribers:
+            self.subscriber_dropped += subscriber.dropped + subscriber.unsent()
+            subscriber.sock.close()
+        self._subscribers = []
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    sys.stderr.write("Unable to accept event consumer: %s\n" % e)
+                return
+            sock.setblocking(False)
+            self._subscribers.append(_Subscriber(sock, self.subscriber_buffer))
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._queue)
+        subscribers = list(self._subscribers)
+        return {"published": self.published, "dropped": self.dropped, "sent": self.sent, "pending": pending,
+                "subscribers": len(subscribers),
+                "subscriber_dropped": self.subscriber_dropped + sum(s.dropped for s in subscribers)}
+
+
+def read_events(path=EVENT_SOCKET, timeout=None):
+    # Reference consumer: yields (time, [event dict, ...]) per batch until
+    # the publisher goes away or nothing arrives for timeout seconds
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.settimeout(timeout)
+    reader = sock.makefile("rb")
+    try:
+        while True:
+            try:
+                line = reader.readline()
+            except socket.timeout:
+                return
+            if not line.endswith(b"\n"):
+                #end of stream, possibly in the middle of a batch
+                return
+            batch = json.loads(line.decode("utf-8"))
+            yield batch["time"], [dict(zip(EVENT_FIELDS, row)) for row in batch["events"]]
+    finally:
+        reader.close()
+        sock.close()
+
+
+def bench(batches, events_per_batch, rate, slow, queue_size):
+    # Publishes synthetic batches to a stand-in consumer thread and reports
+    # the cost of publish() and what got through
+    path = os.path.join(tempfile.mkdtemp(prefix="event_stream_"), "events.sock")
+    publisher = EventPublisher(path, queue_size=queue_size)
+    publisher.start()
+    received = {"batches": 0, "events": 0}
+
+    def consume():
+        for _, events in read_events(path, timeout=2):
+            received["batches"] += 1
+            received["events"] += len(events)
+            if slow:
+                time.sleep(slow)
+
+    consumer = threading.Thread(target=consume, name="consumer", daemon=True)
+    consumer.start()
+    while not publisher.active():
+        time.sleep(0.01)
+
+    events = [(k % 4, 0, k, k % 6, 0.87654, 100.25, 200.5, 64.0, 128.0) for k in range(events_per_batch)]
+    costs = np.empty(batches)
+    start = time.perf_counter()
+    for i in range(batches):
+        if rate:
+            delay = start + i / float(rate) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        publisher.publish(time.monotonic(), events)
+        costs[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - start
+    publisher.stop()
+    consumer.join()
+    stats = publisher.stats()
+
+    costs *= 1e6
+    print("published %d batches of %d events in %.2f s (%.0f events/s)"
+          % (batches, events_per_batch, elapsed, batches * events_per_batch / elapsed))
+    print("publish() us: p50 %.1f  p99 %.1f  max %.1f"
+          % (np.percentile(costs, 50), np.percentile(costs, 99), costs.max()))
+    print("received %d batches, %d events; dropped %d in the queue, %d at the consumer"
+          % (received["batches"], received["events"], stats["dropped"], stats["subscriber_dropped"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read or benchmark the detection event stream")
+    sub = parser.add_subparsers(dest="command")
+    listen = sub.add_parser("listen", help="print the events published by the running pipeline")
+    listen.add_argument("--socket", default=EVENT_SOCKET)
+    test = sub.add_parser("bench", help="throughput of the publisher with a local consumer")
+    test.add_argument("--batches", type=int, default=20000)
+    test.add_argument("--events", type=int, default=20, help="events per batch")
+    test.add_argument("--rate", type=float, default=0, help="batches per second, 0 publishes as fast as possible")
+    test.add_argument("--slow", type=float, default=0, help="seconds the consumer sleeps per batch")
+    test.add_argument("--queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "listen":
+        for timestamp, events in read_events(args.socket):
+            for event in events:
+                print("%.3f %s" % (timestamp, json.dumps(event)))
+    elif args.command == "bench":
+        bench(args.batches, args.events, args.rate, args.slow, args.queue_size)
+    else:
+        parser.print_help()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import sys
+import queue
+import signal
+import ctypes
+import threading
+import multiprocessing
+
+import numpy as np
+
+from image_writer import SaveRecord, make_image_writer
+
+
+RING_POLICIES = ("drop_newest", "wait")
+
+
+class FrameRing:
+
+    # Fixed number of pre-allocated frame slots in shared memory. The
+    # DeepStream process copies a surface into a free slot and only passes the
+    # slot index (plus the small record metadata) to the encoder process,
+    # which hands the slot back once the image is on disk.
+    #
+    # The ring must be created in the parent before both processes are
+    # started so that they inherit the same shared memory. Slots held by an
+    # encoder that died are not recovered, the supervisor restarts the whole
+    # shard with a new ring.
+    def __init__(self, slots, height, width, channels=4, policy="drop_newest", wait=0.01):
+        if policy not in RING_POLICIES:
+            raise ValueError("Unknown ring policy '%s'. Valid values are %s" % (policy, ", ".join(RING_POLICIES)))
+        self.slots = max(1, slots)
+        self.shape = (height, width, channels)
+        self.policy = policy
+        self.wait = wait
+
+        self._buffer = multiprocessing.RawArray(ctypes.c_uint8, self.slots * height * width * channels)
+        self._frames = None
+        self._free = multiprocessing.Queue()
+        self._work = multiprocessing.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+
+        self._in_use = multiprocessing.Value(ctypes.c_int, 0)
+        self._high_water = multiprocessing.Value(ctypes.c_int, 0)
+        self._acquired = multiprocessing.Value(ctypes.c_long, 0)
+        self._released = multiprocessing.Value(ctypes.c_long, 0)
+        self._dropped = multiprocessing.Value(ctypes.c_long, 0)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_frames"] = None
+        return state
+
+    def frames(self):
+        if self._frames is None:
+            self._frames = np.frombuffer(self._buffer, dtype=np.uint8).reshape((self.slots,) + self.shape)
+        return self._frames
+
+    def acquire(self):
+        # Returns a free slot index, or None (and counts a drop) if the ring is
+        # full for longer than the policy allows.
+        try:
+            if self.policy == "wait":
+                slot = self._free.get(timeout=self.wait)
+            else:
+                slot = self._free.get_nowait()
+        except queue.Empty:
+            with self._dropped.get_lock():
+                self._dropped.value += 1
+            return None
+        with self._in_use.get_lock():
+            self._in_use.value += 1
+            if self._in_use.value > self._high_water.value:
+                self._high_water.value = self._in_use.value
+        with self._acquired.get_lock():
+            self._acquired.value += 1
+        return slot
+
+    def release(self, slot):
+        with self._in_use.get_lock():
+            self._in_use.value -= 1
+        with self._released.get_lock():
+            self._released.value += 1
+        self._free.put(slot)
+
+    def put(self, slot, frame_shape, meta):
+        self._work.put((slot, frame_shape, meta))
+
+    def get(self, timeout=None):
+        return self._work.get(timeout=timeout)
+
+    def close(self):
+        # Tells the encoder threads to exit once the work queued before this
+        # call is written. Every thread that sees the marker passes it on.
+        self._work.put(None)
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "in_use": self._in_use.value,
+            "occupancy": float(self._in_use.value) / self.slots,
+            "high_water": self._high_water.value,
+            "acquired": self._acquired.value,
+            "released": self._released.value,
+            "dropped": self._dropped.value,
+        }
+
+
+class RingWriter:
+
+    # Drop-in replacement for ImageWriter on the DeepStream side: submit()
+    # copies the frame into a ring slot instead of a local queue.
+    def __init__(self, ring):
+        self.ring = ring
+
+    def start(self):
+        pass
+
+    def stop(self, drain=True):
+        self.ring.close()
+
+    def submit(self, record, copy=True):
+        # the frame always goes through a slot, copy is only there to match
+        # ImageWriter.submit
+        frame = record.frame
+        height, width = frame.shape[:2]
+        if frame.ndim != 3 or height > self.ring.shape[0] or width > self.ring.shape[1] \
+                or frame.shape[2] != self.ring.shape[2]:
+            sys.stderr.write("Frame of shape %s does not fit in ring slots of shape %s\n"
+                             % (str(frame.shape), str(self.ring.shape)))
+            return False
+        slot = self.ring.acquire()
+        if slot is None:
+            return False
+        np.copyto(self.ring.frames()[slot, :height, :width], frame)
+        self.ring.put(slot, (height, width), (record.category, record.stream, record.timestamp, record.objects))
+        return True
+
+    def pending(self):
+        return self.ring.stats()["in_use"]
+
+    def stats(self):
+        return self.ring.stats()
+
+
+def encoder_main(ring, config):
+    # Target of the encoder Process started by main_deploy next to
+    # deepstream_main. Runs writer_workers threads that encode straight from
+    # the shared slots and release them once written.
+    writer = make_image_writer(config)
+    writer.start(threads=False)
+    frames = ring.frames()
+    #on SIGTERM, finish the slots already queued and exit
+    signal.signal(signal.SIGTERM, lambda signum, frame: ring.close())
+
+    def run():
+        while True:
+            item = ring.get()
+            if item is None:
+                ring.close()
+                return
+            slot, (height, width), meta = item
+            category, stream, timestamp, objects = meta
+            try:
+                writer.write(SaveRecord(category, stream, timestamp, frames[slot, :height, :width], objects))
+            finally:
+                ring.release(slot)
+
+    threads = [threading.Thread(target=run, name="ring-encoder-%d" % i, daemon=True)
+               for i in range(writer.workers)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    except KeyboardInterrupt:
+        pass
+    writer.stop()
+    print("Encoder process: ", writer.stats(), ring.stats())
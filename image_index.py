@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+import queue
+import sqlite3
+import argparse
+import datetime
+import threading
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY,
+        timestamp REAL NOT NULL,
+        stream INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        path TEXT NOT NULL,
+        track_id INTEGER,
+        class_id INTEGER,
+        confidence REAL,
+        left REAL,
+        top REAL,
+        width REAL,
+        height REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS images_stream_class_time ON images (stream, class_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS images_category_stream_time ON images (category, stream, timestamp)",
+    "CREATE INDEX IF NOT EXISTS images_time ON images (timestamp)",
+    "CREATE INDEX IF NOT EXISTS images_path ON images (path)",
+]
+
+COLUMNS = ["timestamp", "stream", "category", "path", "track_id", "class_id", "confidence",
+           "left", "top", "width", "height"]
+
+# NvDsObjectMeta.object_id is unsigned, untracked objects use the max value
+MAX_TRACK_ID = 2 ** 63 - 1
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def image_rows(record, path, objects):
+    # One row per object shown in the image, a single row without object
+    # columns for negative images.
+    if not objects:
+        return [(record.timestamp, record.stream, record.category, path) + (None,) * 7]
+    return [(record.timestamp, record.stream, record.category, path,
+             obj.object_id if obj.object_id <= MAX_TRACK_ID else None, obj.class_id, obj.confidence,
+             obj.left, obj.top, obj.width, obj.height) for obj in objects]
+
+
+class ImageIndex:
+
+    # SQLite (WAL) index of every saved image. Rows are queued by the image
+    # writer threads and inserted in batches by one background thread that
+    # owns the connection.
+    def __init__(self, db_path, batch_size=500, flush_interval=1.0, queue_size=100000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+
+        self.inserted = 0
+        self.removed = 0
+        self.dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="image-index", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def add(self, rows):
+        self._put(("add", rows))
+
+    def remove(self, paths):
+        # Called by the retention manager for files it deleted
+        self._put(("remove", paths))
+
+    def stats(self):
+        return {"inserted": self.inserted, "removed": self.removed, "dropped": self.dropped,
+                "pending": self._queue.qsize()}
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += len(item[1])
+
+    def _run(self):
+        conn = connect(self.db_path)
+        running = True
+        while running:
+            adds, removes = [], []
+            deadline = time.time() + self.flush_interval
+            while len(adds) + len(removes) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                action, values = item
+                if action == "add":
+                    adds.extend(values)
+                else:
+                    removes.extend(values)
+            if not adds and not removes:
+                continue
+            try:
+                with conn:
+                    if adds:
+                        conn.executemany("INSERT INTO images (%s) VALUES (%s)"
+                                         % (", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))), adds)
+                    if removes:
+                        conn.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removes])
+                self.inserted += len(adds)
+                self.removed += len(removes)
+            except sqlite3.Error as e:
+                sys.stderr.write("Unable to update image index: %s\n" % e)
+                self.dropped += len(adds)
+        conn.close()
+
+
+def query(db_path, stream=None, class_id=None, category=None, start=None, end=None, track_id=None, limit=None):
+    # start/end are unix timestamps. Returns a list of dicts, oldest first.
+    clauses, params = [], []
+    for column, value in (("stream", stream), ("class_id", class_id), ("category", category), ("track_id", track_id)):
+        if value is not None:
+            clauses.append(column + " = ?")
+            params.append(value)
+    if start is not None:
+        clauses.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("timestamp < ?")
+        params.append(end)
+    sql = "SELECT %s FROM images" % ", ".join(COLUMNS)
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY timestamp"
+    if limit:
+        sql += " LIMIT %d" % int(limit)
+    conn = connect(db_path)
+    try:
+        return [dict(zip(COLUMNS, row)) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def parse_time(value):
+    # accepts a unix timestamp or "YYYY-mm-dd HH:MM[:SS]" in local time
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time '%s'" % value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the index of saved images")
+    parser.add_argument("--db", default="images.db", help="index database")
+    parser.add_argument("--stream", type=int)
+    parser.add_argument("--class-id", type=int)
+    parser.add_argument("--track-id", type=int)
+    parser.add_argument("--category", choices=["positive", "negative"])
+    parser.add_argument("--start", type=parse_time, help='e.g. "2021-03-16 14:00" or a unix timestamp')
+    parser.add_argument("--end", type=parse_time, help='e.g. "2021-03-16 15:00" or a unix timestamp')
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--paths", action="store_true", help="print unique image paths only")
+    args = parser.parse_args()
+
+    rows = query(args.db, stream=args.stream, class_id=args.class_id, category=args.category,
+                 start=args.start, end=args.end, track_id=args.track_id, limit=args.limit)
+    if args.paths:
+        seen = set()
+        for row in rows:
+            if row["path"] not in seen:
+                seen.add(row["path"])
+                print(row["path"])
+    else:
+        for row in rows:
+            print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
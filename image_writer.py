@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import math
+import time
+import datetime
+import threading
+from collections import deque, namedtuple
+
+import numpy as np
+import cv2
+
+from encoders import make_encoder
+from retention import RetentionManager, LAYOUTS, bucket_dir
+from image_index import ImageIndex, image_rows
+
+
+# A single save request handed off by the pad probe. "frame" is the RGBA
+# surface of the frame, copied once by the writer's submit(), "objects" lists
+# every new track in that frame (empty for negative images).
+SaveRecord = namedtuple("SaveRecord", ["category", "stream", "timestamp", "frame", "objects"])
+
+# The parts of NvDsObjectMeta needed once the probe has returned.
+ObjectInfo = namedtuple("ObjectInfo", ["object_id", "class_id", "confidence", "left", "top", "width", "height"])
+
+POLICIES = ("drop_oldest", "drop_newest")
+SAVE_MODES = ("full", "crop", "both")
+SIDECAR_FORMAT = "detections_%Y%m%d_%H.jsonl"
+
+NAME_FORMATS = {
+    "positive": "img_%Y%m%d_%H%M%S_%f",
+    "negative": "img_%Y%m%d_%H%M%S",
+}
+
+
+class ImageWriter:
+
+    # Bounded queue + worker threads that convert and write frames to disk
+    # so the GStreamer streaming thread never blocks on cv2.imwrite.
+    def __init__(self, workers=2, queue_size=32, policy="drop_oldest", save_mode="full", crop_padding=0.0,
+                 encoders=None, layout="flat", retention=None, index=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown writer policy '%s'. Valid values are %s" % (policy, ", ".join(POLICIES)))
+        if save_mode not in SAVE_MODES:
+            raise ValueError("Unknown save mode '%s'. Valid values are %s" % (save_mode, ", ".join(SAVE_MODES)))
+        if layout not in LAYOUTS:
+            raise ValueError("Unknown directory layout '%s'. Valid values are %s" % (layout, ", ".join(LAYOUTS)))
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.save_mode = save_mode
+        self.crop_padding = crop_padding
+        # encoder per category ("positive"/"negative"), jpeg if not given
+        self.encoders = encoders or {}
+        self._default_encoder = make_encoder()
+        self.sidecar = Sidecar(on_close=retention.add if retention is not None else None)
+        # "flat", "day" or "hour" sub directories below stream_N
+        self.layout = layout
+        self.retention = retention
+        self.index = index
+        self._dirs = set()
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self, threads=True):
+        # threads=False only starts the helpers, for callers that drive
+        # write() from their own threads (the frame ring encoder process)
+        self._running = True
+        if self.index is not None:
+            self.index.start()
+        if self.retention is not None:
+            self.retention.start()
+        if not threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name="image-writer-%d" % i, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, drain=True):
+        with self._cond:
+            self._running = False
+            if not drain:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        self.sidecar.close()
+        if self.retention is not None:
+            self.retention.stop()
+        if self.index is not None:
+            self.index.stop()
+
+    def submit(self, record, copy=True):
+        # Called from the pad probe: never blocks, returns whether this record
+        # was queued. With drop_oldest it always is, an older record evicted
+        # to make room only shows up in the dropped counter. The frame may be
+        # a view of the NVMM surface, it is copied here because the surface
+        # is released once the probe returns. copy=False is for frames the
+        # caller already owns and will not change again.
+        if self.policy == "drop_newest" and self.pending() >= self.queue_size:
+            with self._cond:
+                self.dropped += 1
+            return False
+        if copy:
+            record = record._replace(frame=np.array(record.frame, copy=True, order='C'))
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                self.dropped += 1
+                if self.policy == "drop_newest":
+                    return False
+                self._queue.popleft()
+            self._queue.append(record)
+            self.enqueued += 1
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            done = self.written + self.failed
+            stats = {
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": len(self._queue),
+                "latency_avg_ms": 1000.0 * self.latency_total / done if done else 0.0,
+                "latency_max_ms": 1000.0 * self.latency_max,
+            }
+        if self.retention is not None:
+            stats["retention"] = self.retention.stats()
+        if self.index is not None:
+            stats["index"] = self.index.stats()
+        return stats
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and self._running:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                record = self._queue.popleft()
+            self.write(record)
+
+    def write(self, record):
+        # Synchronous write with accounting, used by the worker threads and by
+        # the encoder process of the shared-memory frame ring.
+        start = time.time()
+        ok = self._write(record)
+        elapsed = time.time() - start
+
+        with self._cond:
+            if ok:
+                self.written += 1
+            else:
+                self.failed += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+        return ok
+
+    def _write(self, record):
+        stream_dir = os.path.join(record.category, "stream_" + str(record.stream))
+        directory = bucket_dir(stream_dir, record.timestamp, self.layout)
+        fmt = NAME_FORMATS.get(record.category, NAME_FORMATS["positive"])
+        stem = datetime.datetime.fromtimestamp(record.timestamp).strftime(fmt)
+        encoder = self.encoders.get(record.category, self._default_encoder)
+        ok = True
+        for suffix, image, objects in self._outputs(record):
+            name = stem + suffix + encoder.extension
+            path = os.path.join(directory, name)
+            try:
+                if directory not in self._dirs:
+                    os.makedirs(directory, exist_ok=True)
+                    self._dirs.add(directory)
+                if not encoder.write(path, image) and not self._retry_write(encoder, directory, path, image):
+                    ok = False
+                    continue
+            except (cv2.error, OSError) as e:
+                sys.stderr.write("Unable to write image %s: %s\n" % (name, e))
+                ok = False
+                continue
+            if self.retention is not None:
+                self.retention.add(record.category, record.stream, path, os.path.getsize(path), record.timestamp)
+            if self.index is not None:
+                self.index.add(image_rows(record, path, objects))
+            if objects:
+                self.sidecar.append(record, directory, path, objects)
+        return ok
+
+    def _retry_write(self, encoder, directory, path, image):
+        # The retention manager removes bucket directories once they are
+        # empty, which can invalidate the cached directory.
+        if os.path.isdir(directory):
+            return False
+        os.makedirs(directory, exist_ok=True)
+        return encoder.write(path, image)
+
+    def _outputs(self, record):
+        # (file name suffix, image, objects shown in it) for every file to be
+        # written for this record. Negative images are always full frames.
+        if not record.objects or self.save_mode in ("full", "both"):
+            yield "", record.frame, record.objects
+        if record.objects and self.save_mode in ("crop", "both"):
+            for obj in record.objects:
+                crop = crop_object(record.frame, obj, self.crop_padding)
+                if crop is not None:
+                    yield "_id%d" % obj.object_id, crop, [obj]
+
+
+def make_image_writer(config):
+    index = None
+    if config["index_db"]:
+        index = ImageIndex(config["index_db"])
+    retention = make_retention_manager(config)
+    if retention is not None and index is not None:
+        retention.on_delete = index.remove
+    return ImageWriter(workers=config["writer_workers"],
+                       queue_size=config["writer_queue_size"],
+                       policy=config["writer_policy"],
+                       save_mode=config["save_mode"],
+                       crop_padding=config["crop_padding"],
+                       encoders={"positive": make_encoder(config["positive_encoder"]),
+                                 "negative": make_encoder(config["negative_encoder"])},
+                       layout=config["directory_layout"],
+                       retention=retention,
+                       index=index)
+
+
+def make_retention_manager(config):
+    max_age = config["retention_max_age_hours"]
+    if isinstance(max_age, dict):
+        max_age = {category: hours * 3600 for category, hours in max_age.items() if hours}
+    else:
+        max_age = max_age * 3600
+    #a shard only looks after the directories of its own streams
+    streams = None
+    if "shard" in config and config["source_type"] == "rtsp":
+        streams = [int(name.split("_")[-1]) for name in config["source"]]
+    retention = RetentionManager(max_bytes=config["retention_max_bytes"], max_age=max_age,
+                                 interval=config["retention_interval"], streams=streams)
+    if not retention.enabled():
+        return None
+    return retention
+
+
+def crop_object(frame, obj, padding=0.0):
+    # padding is a fraction of the bbox width/height added on every side
+    height, width = frame.shape[:2]
+    pad_x = obj.width * padding
+    pad_y = obj.height * padding
+    x0 = max(0, int(obj.left - pad_x))
+    y0 = max(0, int(obj.top - pad_y))
+    x1 = min(width, int(math.ceil(obj.left + obj.width + pad_x)))
+    y1 = min(height, int(math.ceil(obj.top + obj.height + pad_y)))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return frame[y0:y1, x0:x1]
+
+
+class Sidecar:
+
+    # One JSONL file per stream directory and hour, next to the images of
+    # that hour, with a line for every image that contains objects. Shared by
+    # all writer threads. on_close(category, stream, path, size, timestamp)
+    # is called once a file is complete, with the time of its last line, so
+    # that retention deletes it right after the images it lists.
+    def __init__(self, on_close=None):
+        self.on_close = on_close
+        # (category, stream) -> [file, path, time of the last line]
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def append(self, record, directory, image_path, objects):
+        key = (record.category, record.stream)
+        name = datetime.datetime.fromtimestamp(record.timestamp).strftime(SIDECAR_FORMAT)
+        path = os.path.join(directory, name)
+        with self._lock:
+            current = self._files.get(key)
+            #a record that is late for the file of the next hour goes into it anyway
+            if current is not None and current[1] != path and record.timestamp > current[2]:
+                self._close(key)
+                current = None
+            if current is None:
+                current = [open(path, "a"), path, record.timestamp]
+                self._files[key] = current
+            line = json.dumps({
+                "image": os.path.relpath(image_path, os.path.dirname(current[1])),
+                "stream": record.stream,
+                "timestamp": record.timestamp,
+                "objects": [obj._asdict() for obj in objects],
+            })
+            current[0].write(line + "\n")
+            current[0].flush()
+            current[2] = max(current[2], record.timestamp)
+
+    def _close(self, key):
+        f, path, timestamp = self._files.pop(key)
+        f.close()
+        if self.on_close is not None:
+            self.on_close(key[0], key[1], path, os.path.getsize(path), timestamp)
+
+    def close(self):
+        with self._lock:
+            for key in list(self._files):
+                self._close(key)
@@ -0,0 +1,170 @@
+import sys
+import time
+import argparse
+from collections import deque
+
+
+class IntervalController:
+
+    # Picks the nvinfer "interval" (frames skipped between inferences) from
+    # what the pad probe sees. nvinfer has one interval for the whole batch,
+    # so the busiest stream decides: every period seconds the share of frames
+    # with objects is computed per stream and
+    #   - at or above busy_ratio on any stream the interval drops to
+    #     min_interval right away,
+    #   - at or below idle_ratio on all streams for hold periods in a row it
+    #     goes up by one, up to max_interval,
+    #   - anything in between keeps it.
+    # With target_fps set, a pipeline running below it gets one step more
+    # interval regardless of the scene, and the interval is never lowered
+    # while it is short of the target.
+    def __init__(self, interval=0, min_interval=0, max_interval=10, period=5, busy_ratio=0.3, idle_ratio=0.05,
+                 hold=3, target_fps=0, apply=None, trace=None):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.period = period
+        self.busy_ratio = busy_ratio
+        self.idle_ratio = idle_ratio
+        self.hold = hold
+        self.target_fps = target_fps
+        # called with the new interval, e.g. to set the pgie property
+        self.apply = apply
+        # optional file object, one "time stream objects" line per frame
+        self.trace = trace
+
+        self._frames = {}
+        self._busy = {}
+        self._batches = 0
+        self._idle_periods = 0
+        self._last_tick = None
+        self.decisions = deque(maxlen=100)
+        self.periods = 0
+        self.changes = 0
+
+    def observe(self, stream, num_objects, now):
+        # Called by the pad probe for every frame
+        self._frames[stream] = self._frames.get(stream, 0) + 1
+        if num_objects:
+            self._busy[stream] = self._busy.get(stream, 0) + 1
+        if self.trace is not None:
+            self.trace.write("%.3f %d %d\n" % (now, stream, num_objects))
+
+    def batch(self):
+        self._batches += 1
+
+    def tick(self, now=None):
+        # Decides once per period, returns True to keep a GLib timeout running
+        if now is None:
+            now = time.time()
+        if self._last_tick is None:
+            self._last_tick = now
+            return True
+        elapsed = now - self._last_tick
+        if elapsed <= 0 or not self._frames:
+            return True
+        #the probe keeps counting on the streaming thread, swap the counters
+        #out first so that nothing is lost and the dicts read here do not
+        #change while they are read
+        frames, self._frames = self._frames, {}
+        busy, self._busy = self._busy, {}
+        batches, self._batches = self._batches, 0
+        ratios = {stream: busy.get(stream, 0) / float(count) for stream, count in list(frames.items())}
+        fps = batches / elapsed
+        self._last_tick = now
+        self.decide(ratios, fps, now)
+        return True
+
+    def decide(self, ratios, fps, now):
+        busiest = max(ratios, key=ratios.get)
+        ratio = ratios[busiest]
+        short = self.target_fps and fps < self.target_fps * 0.95
+        interval = self.interval
+        if short:
+            interval = min(self.interval + 1, self.max_interval)
+            reason = "%.1f fps below the %.1f fps target" % (fps, self.target_fps)
+            self._idle_periods = 0
+        elif ratio >= self.busy_ratio:
+            interval = self.min_interval
+            reason = "busy, %.2f of frames with objects on stream %s" % (ratio, busiest)
+            self._idle_periods = 0
+        elif ratio <= self.idle_ratio:
+            self._idle_periods += 1
+            reason = "idle for %d periods, at most %.2f of frames with objects" % (self._idle_periods, ratio)
+            if self._idle_periods >= self.hold:
+                interval = min(self.interval + 1, self.max_interval)
+                self._idle_periods = 0
+        else:
+            reason = "%.2f of frames with objects on stream %s" % (ratio, busiest)
+            self._idle_periods = 0
+        self.periods += 1
+        self.decisions.append({"time": now, "interval": interval, "previous": self.interval, "fps": fps,
+                               "busy_ratio": ratio, "reason": reason})
+        if interval != self.interval:
+            print("Inference interval %d -> %d: %s" % (self.interval, interval, reason))
+            self.interval = interval
+            self.changes += 1
+            if self.apply is not None:
+                self.apply(interval)
+        return interval
+
+    def stats(self):
+        last = self.decisions[-1] if self.decisions else {}
+        return {"interval": self.interval, "changes": self.changes, "fps": last.get("fps", 0),
+                "busy_ratio": last.get("busy_ratio", 0)}
+
+
+def read_trace(path):
+    # "time stream objects" lines as written by IntervalController.trace
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3:
+                yield float(parts[0]), int(parts[1]), int(parts[2])
+
+
+def replay(records, controller):
+    # Runs a recorded trace through controller in trace time, frames with
+    # the same time stamp count as one batch. Returns the share of frames
+    # that would have been inferred.
+    inferred = 0.0
+    frames = 0
+    last_time = None
+    next_tick = None
+    for now, stream, num_objects in records:
+        if next_tick is None or now >= next_tick:
+            controller.tick(now)
+            next_tick = now + controller.period
+        if now != last_time:
+            controller.batch()
+        last_time = now
+        controller.observe(stream, num_objects, now)
+        frames += 1
+        inferred += 1.0 / (controller.interval + 1)
+    return inferred / frames if frames else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded object count trace through the interval controller")
+    parser.add_argument("trace", help="file written with 'interval_trace' set in config.json")
+    parser.add_argument("--interval", type=int, default=5, help="interval at the start")
+    parser.add_argument("--min", type=int, default=0)
+    parser.add_argument("--max", type=int, default=10)
+    parser.add_argument("--period", type=float, default=5)
+    parser.add_argument("--busy-ratio", type=float, default=0.3)
+    parser.add_argument("--idle-ratio", type=float, default=0.05)
+    parser.add_argument("--hold", type=int, default=3)
+    args = parser.parse_args()
+
+    controller = IntervalController(interval=args.interval, min_interval=args.min, max_interval=args.max,
+                                    period=args.period, busy_ratio=args.busy_ratio, idle_ratio=args.idle_ratio,
+                                    hold=args.hold)
+    share = replay(read_trace(args.trace), controller)
+    print("\n%d decisions, %d changes, final interval %d" % (controller.periods, controller.changes,
+                                                               controller.interval))
+    print("frames inferred: %.1f%% (%.1f%% with the fixed interval %d)" % (100 * share, 100.0 / (args.interval + 1),
+                                                                        args.interval))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
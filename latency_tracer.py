@@ -0,0 +1,301 @@
+import sys
+import json
+import time
+import bisect
+import threading
+import socketserver
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+# Upper bounds in seconds of the cumulative histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Element names of the chain built by build_pipeline (and the simulation
+# backend), in stream order. Each stage ends at the src pad of its element.
+STAGE_ELEMENTS = ["Stream-muxer", "queue1", "primary-inference", "queue2", "tracker", "queue3", "convertor1",
+                  "queue4", "filter1", "queue5", "nvtiler", "queue6", "convertor", "queue7", "onscreendisplay",
+                  "queue8"]
+# Pseudo stage between queue5 and the tiler: the save probe on the tiler sink pad
+SAVE_PROBE_STAGE = "save_probe"
+
+
+class RollingHistogram:
+
+    # Prometheus style cumulative buckets, count and sum since start, plus
+    # the last window observations for percentiles.
+    def __init__(self, window=1000, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self._recent.append(value)
+
+    def snapshot(self):
+        recent = sorted(self._recent)
+        snap = {"count": self.count, "sum": self.sum, "buckets": list(self.counts)}
+        if recent:
+            n = len(recent)
+            snap.update(p50=recent[int(0.50 * (n - 1))], p95=recent[int(0.95 * (n - 1))],
+                        p99=recent[int(0.99 * (n - 1))], max=recent[-1])
+        return snap
+
+
+class LatencyTracer:
+
+    # Opt-in pad probes on every stage boundary of the pipeline. One batch in
+    # sample_every is followed from the streammux src pad to queue8 by its
+    # PTS and the time spent between two consecutive boundaries is recorded
+    # for the stage ending there. With source pads attached, one buffer in
+    # sample_every per stream is timed from its source bin to the save probe
+    # using frame_meta.buf_pts. Queue fill levels are polled from the GLib
+    # main loop.
+    def __init__(self, sample_every=10, window=1000, max_pending=1000):
+        self.sample_every = max(1, int(sample_every))
+        self.window = window
+        self.max_pending = max_pending
+
+        self.stages = OrderedDict()
+        self.streams = {}
+        self.end_to_end = RollingHistogram(window)
+        self.queues = {}
+        self._queue_elements = []
+
+        self._batches = 0
+        self._pending = OrderedDict()
+        self._source_counts = {}
+        self._source_pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._providers = OrderedDict()
+        self._ok = None
+
+    def attach(self, elements):
+        # elements is the dict returned by build_pipeline
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        self._ok = Gst.PadProbeReturn.OK
+        buffer_probe = Gst.PadProbeType.BUFFER
+
+        pipeline = elements["pipeline"]
+        chain = [pipeline.get_by_name(name) for name in STAGE_ELEMENTS]
+        missing = [name for name, element in zip(STAGE_ELEMENTS, chain) if element is None]
+        if missing:
+            sys.stderr.write(" Latency tracer: elements not found %s \n" % missing)
+        for name, element in zip(STAGE_ELEMENTS, chain):
+            if element is None:
+                continue
+            if name == "nvtiler":
+                #probes run in the order they are added, the save probe is already on this pad
+                self.stages[SAVE_PROBE_STAGE] = RollingHistogram(self.window)
+                element.get_static_pad("sink").add_probe(buffer_probe, self._stage_probe, SAVE_PROBE_STAGE)
+            self.stages[name] = RollingHistogram(self.window)
+            element.get_static_pad("src").add_probe(buffer_probe, self._stage_probe, name)
+        self._first = STAGE_ELEMENTS[0]
+        self._last = [name for name in self.stages][-1]
+        self._queue_elements = [q for q in elements["queues"] if q is not None]
+        for q in self._queue_elements:
+            self.queues[q.get_name()] = {"buffers": 0, "max_buffers": 0, "time": 0,
+                                         "recent": deque(maxlen=self.window)}
+
+        for stream, source_bin in elements.get("source_bins", {}).items():
+            self.attach_source(stream, source_bin.get_static_pad("src"))
+
+    def attach_source(self, stream, pad):
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        self._source_counts[stream] = 0
+        if stream not in self.streams:
+            self.streams[stream] = RollingHistogram(self.window)
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._source_probe, stream)
+
+    def detach_source(self, stream):
+        # Called when a source is removed, its pad goes away with the bin
+        self._source_counts.pop(stream, None)
+
+    def add_provider(self, name, provider):
+        # provider() returns a dict of numbers (nested dicts are flattened),
+        # exported as deepstream_<name>_<key>
+        self._providers[name] = provider
+
+    def _stage_probe(self, pad, info, name):
+        now = time.perf_counter()
+        pts = info.get_buffer().pts
+        if name == self._first:
+            self._batches += 1
+            if self._batches % self.sample_every == 0:
+                with self._lock:
+                    self._pending[pts] = (now, now)
+                    if len(self._pending) > self.max_pending:
+                        self._pending.popitem(last=False)
+            return self._ok
+        times = self._pending.get(pts)
+        if times is None:
+            return self._ok
+        with self._lock:
+            self.stages[name].observe(now - times[1])
+            if name == self._last:
+                self.end_to_end.observe(now - times[0])
+                self._pending.pop(pts, None)
+            else:
+                self._pending[pts] = (times[0], now)
+        return self._ok
+
+    def _source_probe(self, pad, info, stream):
+        count = self._source_counts.get(stream)
+        if count is None:
+            return self._ok
+        self._source_counts[stream] = count + 1
+        if count % self.sample_every == 0:
+            with self._lock:
+                self._source_pending[(stream, info.get_buffer().pts)] = time.perf_counter()
+                if len(self._source_pending) > self.max_pending:
+                    self._source_pending.popitem(last=False)
+        return self._ok
+
+    def frame(self, stream, buf_pts):
+        # Called by the save probe for every frame of a batch
+        if not self._source_pending:
+            return
+        started = self._source_pending.pop((stream, buf_pts), None)
+        if started is not None:
+            with self._lock:
+                self.streams[stream].observe(time.perf_counter() - started)
+
+    def poll_queues(self):
+        # GLib timeout callback, keeps running while it returns True
+        for q in self._queue_elements:
+            level = self.queues[q.get_name()]
+            buffers = q.get_property("current-level-buffers")
+            level["buffers"] = buffers
+            level["max_buffers"] = q.get_property("max-size-buffers")
+            level["time"] = q.get_property("current-level-time")
+            level["recent"].append(buffers)
+        return True
+
+    def metrics(self):
+        with self._lock:
+            metrics = {
+                "stages": {name: h.snapshot() for name, h in self.stages.items()},
+                "end_to_end": self.end_to_end.snapshot(),
+                "streams": {stream: h.snapshot() for stream, h in self.streams.items()},
+            }
+        queues = {}
+        for name, level in self.queues.items():
+            recent = list(level["recent"])
+            queues[name] = {"buffers": level["buffers"], "max_buffers": level["max_buffers"],
+                            "time_ns": level["time"],
+                            "avg_buffers": sum(recent) / len(recent) if recent else 0,
+                            "peak_buffers": max(recent) if recent else 0}
+        metrics["queues"] = queues
+        metrics["buckets"] = list(BUCKETS)
+        for name, provider in self._providers.items():
+            try:
+                metrics[name] = provider()
+            except Exception as e:
+                sys.stderr.write(" Metrics provider %s failed: %s \n" % (name, e))
+        return metrics
+
+    def prometheus(self):
+        metrics = self.metrics()
+        lines = []
+
+        def labelled(metric, labels):
+            return "%s{%s}" % (metric, ",".join(labels)) if labels else metric
+
+        def histogram(metric, labels, snap):
+            cumulative = 0
+            for bound, count in zip(list(BUCKETS) + ["+Inf"], snap["buckets"]):
+                cumulative += count
+                lines.append('%s %d' % (labelled(metric + "_bucket", labels + ['le="%s"' % bound]), cumulative))
+            lines.append("%s %f" % (labelled(metric + "_sum", labels), snap["sum"]))
+            lines.append("%s %d" % (labelled(metric + "_count", labels), snap["count"]))
+
+        def recent(metric, labels, snap):
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99"), ("max", "1")):
+                if key in snap:
+                    lines.append("%s %f" % (labelled(metric, labels + ['quantile="%s"' % quantile]), snap[key]))
+
+        families = [
+            ("deepstream_stage_latency_seconds", [(['stage="%s"' % name], snap)
+                                                  for name, snap in metrics["stages"].items()]),
+            ("deepstream_end_to_end_latency_seconds", [([], metrics["end_to_end"])]),
+            ("deepstream_stream_latency_seconds", [(['stream="%s"' % stream], snap)
+                                                   for stream, snap in metrics["streams"].items()]),
+        ]
+        for metric, series in families:
+            lines.append("# TYPE %s histogram" % metric)
+            for labels, snap in series:
+                histogram(metric, labels, snap)
+            #percentiles over the last window observations
+            lines.append("# TYPE %s_recent gauge" % metric)
+            for labels, snap in series:
+                recent(metric + "_recent", labels, snap)
+        for key in ("buffers", "max_buffers", "avg_buffers", "peak_buffers", "time_ns"):
+            lines.append("# TYPE deepstream_queue_level_%s gauge" % key)
+            for name, level in metrics["queues"].items():
+                lines.append('deepstream_queue_level_%s{queue="%s"} %s' % (key, name, level[key]))
+        for name in self._providers:
+            for key, value in _flatten(metrics.get(name, {})):
+                lines.append("deepstream_%s_%s %s" % (name, key, value))
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            for item in _flatten(value, "%s%s_" % (prefix, key)):
+                yield item
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield "%s%s" % (prefix, key), value
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = self.server.tracer.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif path == "/metrics.json":
+            body = json.dumps(self.server.tracer.metrics()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+
+    # Serves /metrics (Prometheus text) and /metrics.json from a thread
+    def __init__(self, tracer, port=9100, host="127.0.0.1"):
+        self._server = _Server((host, port), _Handler)
+        self._server.tracer = tracer
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,9 +1,27 @@
 import os
-from multiprocessing import Process
-from deepstream_all_save_images import deepstream_main
+import queue
+import signal
+from multiprocessing import Process, Event, Queue, RawArray
+from deepstream_all_save_images import deepstream_main, standby_main
+from frame_ring import FrameRing, encoder_main
 import time
-import json
 import cv2
+from config_loader import load_config, diff_configs, PIPELINE_LIVE_KEYS
+from control import ControlServer
+from camera_health import HealthCache, probe_sources
+from supervisor import Supervisor, Worker, shard_sources, stream_number
+from standby import StandbyPool
+
+
+#how often the legacy check/trigger.txt and check/quit.txt files are looked at
+POLL_INTERVAL = 0.2
+#seconds to wait for a process to exit after terminate() before killing it,
+#deepstream writes out its queued images in that time
+TERMINATE_TIMEOUT = 10
+
+camera_health = HealthCache()
+#workers waiting for a config when warm_standby is on
+standby_pool = None
 
 
 def check_files():
@@ -47,160 +65,295 @@ def gstreamer_pipeline(
         )
     )
 
-def check_feed(src_type, src):
+def check_feed(src_type, src, timeout=10):
     if src_type == "mipi":
         cap = cv2.VideoCapture(gstreamer_pipeline(sensor_id=src), cv2.CAP_GSTREAMER)
+    elif src_type == "rtsp" and hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+        #let FFmpeg give up on its own instead of hanging on dead cameras
+        cap = cv2.VideoCapture(src, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000),
+                                                     cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(timeout * 1000)])
     else:
         cap = cv2.VideoCapture(src)
-    while True:
-        ret, frame = cap.read()
-        break
+    ret, frame = cap.read()
+    cap.release()
     print(src_type, src, ret)
     return ret
 
 def camera_check(config):
+    #probe all cameras in parallel, returns a copy of config with only the
+    #healthy sources or None if there are none
+    if config["backend"] == "simulation":
+        return config
     source_type = config["source_type"]
     if source_type == "rtsp":
         sources = config["source"]
-        camera_ok = []
-        for stream, rtsp in sources.items():
-            camera_ok.append(check_feed("rtsp", rtsp))
-    elif source_type == "usb":
-        camera_ok = [check_feed("usb", 0)]
-    elif source_type == "mipi":
-        camera_ok = [mipi_check("mipi", 0)]
-    if all(camera_ok):
-        with open("check/trigger.txt", "w") as f:
-            f.write("")
-
-def read_config(config_file):
-    try:
-        with open("config.json", "r") as f:
-            config = json.load(f)
-            print(config)    
-
-        if len(list(config)) == 0:
-            print("No configurations provided in json file")
-            return None
-
-        src = ["rtsp", "mipi", "usb"]
-        source_type = config["source_type"]
-        if source_type not in src:
-            print("Wrong source type")
-            return None
-        if source_type == "rtsp":
-            sources = config["source"]
-            if len(list(sources)) == 0:
-                print("No source provided in json file")
-                return None
-            for key, value in sources.items():
-                if value == "":
-                    print("No source provided in json file")
-                    return None
-        display = config["display"]
-        if not isinstance(display, bool):
-            print("wrong value for 'display' in json file. Valid usage is 'display': true or 'display': false")
-            return None
-        MUXER_OUTPUT_WIDTH = config["processing_width"]
-        if type(MUXER_OUTPUT_WIDTH)!=type(1):
-            print("wrong value for 'processing_width' in json file. Should be integer. eg. 640")
-            return None
-        MUXER_OUTPUT_HEIGHT = config["processing_height"]
-        if type(MUXER_OUTPUT_HEIGHT) != type(1):
-            print("wrong value for 'processing_height' in json file. Should be integer. eg. 480")
-            return None
-        TILED_OUTPUT_WIDTH = config["tiler_width"]
-        if type(TILED_OUTPUT_WIDTH)!=type(1):
-            print("wrong value for 'tiler_width' in json file. Should be integer. eg. 640")
-            return None
-        TILED_OUTPUT_HEIGHT = config["tiler_height"]
-        if type(TILED_OUTPUT_HEIGHT) != type(1):
-            print("wrong value for 'tiler_height' in json file. Should be integer. eg. 480")
-            return None
-        image_timer = config["image_timer"]
-        if type(image_timer) != type(1):
-            print("wrong value for 'image_timer' in json file. Should be integer. eg. 600")
-            return None
-        queue_size = config["queue_size"]
-        if type(queue_size) != type(1):
-            print("wrong value for 'queue_size' in json file. Should be integer and greater than 0. e.g. 20")
-            return None
-        else:
-            if queue_size < 1:
-                print("'queue_size' cannot be 0 or less. Switching to default value 20.")
-                queue_size = 20
-                time.sleep(5)
-
-        return config
-
-    except Exception as e:
-        print(e)
-        print("Error in json file")
+    else:
+        sources = {"stream_0": 0}
+    timeout = config["camera_check_timeout"]
+    results = probe_sources(sources, lambda src: check_feed(source_type, src, timeout), camera_health,
+                            timeout=timeout, workers=config["camera_check_workers"])
+    healthy = [stream for stream in sources if results.get(stream)]
+    failed = [stream for stream in sources if not results.get(stream)]
+    if failed:
+        print("Cameras not responding: ", failed)
+    if not healthy:
         return None
+    config = dict(config)
+    if source_type == "rtsp":
+        config["source"] = {stream: sources[stream] for stream in healthy}
+    return config
 
 def terminate_process(running_process):
-    for process in running_process:
+    #last started first: deepstream drains its writer and closes the frame
+    #ring on SIGTERM, the encoder started before it then writes what is left
+    #in the ring before it exits. SIGKILL is only the fallback.
+    for process in reversed(running_process):
         if process.is_alive():
-            print("Terminating deepstream")
-            time.sleep(3)
-            process.terminate()
-        process.join()
-        running_process.remove(process)
-    return running_process
-
-def check_process(running_process):
-    for process in running_process:
-        if not process.is_alive():
+            print("Terminating", process.name)
             process.terminate()
+        process.join(TERMINATE_TIMEOUT)
+        if process.is_alive():
+            print("Killing", process.name)
+            os.kill(process.pid, signal.SIGKILL)
             process.join()
-            running_process.remove(process)
-    return running_process
+    return []
+
+def start_deepstream(config, index=0):
+    #starts the processes of one shard and returns a Worker for the supervisor
+    running_process = []
+    #a warm standby cannot take a frame ring, those are shared by inheritance only
+    if standby_pool is not None and not config["encoder_process"]:
+        worker = standby_pool.take(config, "deepstream-%d" % index)
+        if worker is not None:
+            print("Starting Deepstream on warm standby", worker["process"].pid)
+            return Worker([worker["process"]], worker["process"], worker["ready"], worker["channel"],
+                          worker["heartbeat"])
+    #ready is set by the pad probe once the first batch has gone through the
+    #pipeline, heartbeat holds the time of the first and of the latest batch
+    ready = Event()
+    heartbeat = RawArray("d", 2)
+    frame_ring = None
+    if config["encoder_process"]:
+        #encode images in a separate process, frames are passed through shared memory
+        print("Starting encoder process")
+        frame_ring = FrameRing(config["queue_size"], config["processing_height"], config["processing_width"],
+                               policy=config["ring_policy"])
+        e = Process(target=encoder_main, args=(frame_ring, config), name="encoder-%d" % index)
+        e.start()
+        running_process.append(e)
+    #add/remove source commands go to the running pipeline through these
+    channel = (Queue(), Queue())
+    print("Starting Deepstream")
+    p = Process(target=deepstream_main, args=(config, frame_ring, ready) + channel + (heartbeat,),
+                name="deepstream-%d" % index)
+    p.start()
+    running_process.append(p)
+    return Worker(running_process, p, ready, channel, heartbeat)
+
+def source_command(command, args, supervisor):
+    #"add stream_3 rtsp://..." or "remove stream_3", run by the shard's deepstream process
+    parts = args.split()
+    expected = 2 if command == "add" else 1
+    if len(parts) != expected or not parts[0].startswith("stream_") or not parts[0][len("stream_"):].isdigit():
+        if command == "add":
+            return {"ok": False, "error": "usage: add stream_<n> <uri>"}
+        return {"ok": False, "error": "usage: remove stream_<n>"}
+    if supervisor.state() == "stopped":
+        return {"ok": False, "error": "deepstream is not running"}
+    return supervisor.source_command(command, int(parts[0][len("stream_"):]), *parts[1:])
+
+def update_standby(config):
+    #one warm worker per shard of config
+    global standby_pool
+    if not config["warm_standby"]:
+        if standby_pool is not None:
+            standby_pool.stop()
+            standby_pool = None
+        return
+    size = len(shard_sources(config, config["max_streams_per_shard"]))
+    if standby_pool is None:
+        standby_pool = StandbyPool(standby_main, size)
+    standby_pool.size = size
+
+def supervisor_policy(config):
+    #restart policy of the shards, see supervisor.Shard
+    return dict(backoff=config["restart_backoff"],
+                backoff_max=config["restart_backoff_max"],
+                crash_loop_restarts=config["crash_loop_restarts"],
+                crash_loop_window=config["crash_loop_window"],
+                stall_timeout=config["shard_stall_timeout"],
+                start_timeout=config["shard_start_timeout"])
+
+def make_supervisor(config):
+    return Supervisor(start_deepstream, terminate_process, max_streams_per_shard=config["max_streams_per_shard"],
+                      **supervisor_policy(config))
+
+def reload_config(supervisor, running_config, config_file="config.json"):
+    #applies the changes in config_file to the running shards, returns
+    #(reply, config) with reply None when a restart is needed instead
+    config = load_config(config_file)
+    if config is None:
+        return {"ok": False, "error": "invalid %s" % config_file}, running_config
+    changes = diff_configs(running_config, config)
+    if changes.restart:
+        print("Restarting for changes in", changes.restart)
+        return None, running_config
+
+    supervisor.update_policy(**supervisor_policy(config))
+    camera_health.ttl = config["health_cache_ttl"]
+    update_standby(config)
+
+    pipeline_changes = {key: value for key, value in changes.live.items() if key in PIPELINE_LIVE_KEYS}
+    pipeline_changes.update(changes.rebuild)
+    if pipeline_changes:
+        failed = [reply for reply in supervisor.apply_config(pipeline_changes) if not reply.get("ok")]
+        if failed:
+            print("Restarting, config changes failed: ", failed)
+            return None, running_config
+    #sources that are not running (they failed the camera check) are only
+    #dropped from the config
+    running = set(name for shard in supervisor.shards for name in shard.config["source"])
+    for name in changes.removed:
+        if name in running:
+            reply = supervisor.source_command("remove", stream_number(name))
+            if not reply.get("ok"):
+                print("Restarting, removing %s failed: %s" % (name, reply.get("error")))
+                return None, running_config
+    for name, uri in sorted(changes.added.items()):
+        reply = supervisor.source_command("add", stream_number(name), uri)
+        if not reply.get("ok"):
+            print("Restarting, adding %s failed: %s" % (name, reply.get("error")))
+            return None, running_config
+    print("Reloaded %s without a restart" % config_file)
+    return {"ok": True, "reloaded": changes._asdict()}, config
+
+def get_status(supervisor, switchover):
+    status = supervisor.status()
+    status["cameras"] = camera_health.snapshot()
+    status["switchover"] = switchover
+    if standby_pool is not None:
+        status["standby"] = standby_pool.status()
+    return status
 
 def main():
 
-    running_process = []
-    start = True
+    global standby_pool
+
+    #one deepstream process per shard of cameras, restarted with backoff
+    supervisor = Supervisor(start_deepstream, terminate_process)
+    #with warm_standby, the supervisor of the new config runs next to the old
+    #one until all of its shards are up
+    incoming = None
+    incoming_since = None
+    incoming_config = None
+    #time of the last batch before a restart, to report the gap once the new
+    #pipeline has its first batch
+    switchover = {"last_old_batch": None, "gap": None}
+    #config the running pipeline was started with, reload compares against it
+    running_config = None
+
+    #start/stop/restart/status commands arrive over a local socket, the
+    #trigger/quit files are still honoured
+    commands = queue.Queue()
+    control = ControlServer(commands)
+    control.start()
+
+    #start right away, the cameras are checked as part of starting
+    command, args, replies = "start", "", None
+
     while True:
 
-        if start:
-            start = False
-            config = read_config("config.json")
-            if config is None:
-                continue
-            camera_check(config)
-                
-        status = check_files()
-        if status == "trigger":
-            print("trigger found")
-            time.sleep(3)
-            
-            config = read_config("config.json")
+        if command is None:
+            try:
+                command, args, replies = commands.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                command, args, replies = None, "", None
+        if command is None:
+            status = check_files()
+            if status == "trigger":
+                print("trigger found")
+                command = "reload"
+            elif status == "quit":
+                print("quit found")
+                command = "stop"
+
+        reply = {"ok": True}
+        if command == "reload":
+            #change what can be changed in place, restart for everything else
+            if supervisor.state() == "stopped" or incoming is not None or running_config is None:
+                command = "restart"
+            else:
+                reply, running_config = reload_config(supervisor, running_config)
+                if reply is None:
+                    command = "restart"
+                    reply = {"ok": True}
+        if command == "start" and supervisor.state() != "stopped":
+            reply = {"ok": False, "error": "already running"}
+        elif command in ["start", "restart"]:
+            config = load_config("config.json")
             if config is None:
-                continue
-
-            running_process = terminate_process(running_process)
-            print("Starting Deepstream")
-            time.sleep(3)
-            p = Process(target=deepstream_main, args=(config,))
-            p.start()
-            running_process.append(p)
-
-        if status == "quit":
-            print("quit found")
-            time.sleep(3)
-            running_process = terminate_process(running_process)
-
-        # if status is None:
-        #     for process in running_process:
-        #         if not process.is_alive():
-        #             print("No files found")
-            
+                reply = {"ok": False, "error": "invalid config.json"}
+            else:
+                #start with whichever cameras answer instead of requiring all of them
+                camera_health.ttl = config["health_cache_ttl"]
+                healthy_config = camera_check(config)
+                if healthy_config is None:
+                    reply = {"ok": False, "error": "no camera is responding"}
+                else:
+                    update_standby(config)
+                    if incoming is not None:
+                        incoming.stop()
+                        incoming = None
+                    if config["warm_standby"] and supervisor.state() != "stopped":
+                        #keep the old pipeline running until the new one is up,
+                        #its metrics port and event socket are bound once the
+                        #old one is gone
+                        incoming = make_supervisor(config)
+                        incoming.start(dict(healthy_config, bind_endpoints=False))
+                        incoming_since = time.time()
+                        incoming_config = config
+                    else:
+                        switchover = {"last_old_batch": supervisor.stop(), "gap": None}
+                        supervisor = make_supervisor(config)
+                        supervisor.start(healthy_config)
+                        running_config = config
+        elif command == "stop":
+            if incoming is not None:
+                incoming.stop()
+                incoming = None
+            supervisor.stop()
+        elif command in ["add", "remove"]:
+            #change the sources of the running pipeline without restarting it
+            reply = source_command(command, args, supervisor)
 
-        print("running processes: ", len(running_process))
-        running_process = check_process(running_process)
+        supervisor.poll()
+        if incoming is not None:
+            incoming.poll()
+            if incoming.state() == "running":
+                print("New pipeline is up, stopping the old one")
+                switchover = {"last_old_batch": supervisor.stop(), "gap": None}
+                supervisor = incoming
+                running_config = incoming_config
+                incoming = None
+                failed = [reply for reply in supervisor.apply_config({"bind_endpoints": True}) if not reply.get("ok")]
+                if failed:
+                    print("Unable to bind the metrics port or event socket: ", failed)
+            elif incoming.state() == "failed" or time.time() - incoming_since > incoming.policy["start_timeout"]:
+                print("New pipeline did not come up, keeping the old one")
+                incoming.stop()
+                incoming = None
+        if switchover["last_old_batch"] and switchover["gap"] is None and supervisor.first_batch():
+            #negative when the new pipeline was up before the old one stopped
+            switchover["gap"] = supervisor.first_batch() - switchover["last_old_batch"]
+            print("Switchover: first new batch %.2f s after the last old one" % switchover["gap"])
+        if standby_pool is not None:
+            standby_pool.fill()
 
-        time.sleep(1)
+        if replies is not None:
+            reply.update(get_status(supervisor, switchover))
+            replies.put(reply)
+        command, args, replies = None, "", None
             
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,72 @@
+import time
+
+import numpy as np
+
+
+# ITU-R BT.601 weights of R, G and B
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def dhash(frame, hash_size=8, samples=4):
+    # Difference hash of an RGBA (or RGB) frame as a hash_size**2 bit int.
+    # Only a (hash_size * samples) x ((hash_size + 1) * samples) grid of
+    # pixels is read, so the full frame is never copied; every cell of the
+    # hash averages samples x samples of them to keep sensor noise out. A bit
+    # is set where a cell is brighter than its left neighbour.
+    height, width = frame.shape[:2]
+    rows = hash_size * samples
+    columns = (hash_size + 1) * samples
+    ys = np.arange(rows) * height // rows
+    xs = np.arange(columns) * width // columns
+    luma = frame[ys[:, None], xs[None, :], :3].astype(np.float32).dot(LUMA)
+    cells = luma.reshape(hash_size, samples, hash_size + 1, samples).mean(axis=(1, 3))
+    bits = np.packbits(cells[:, 1:] > cells[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class NegativeDedup:
+
+    # Last saved negative hash per stream. A due negative frame whose hash
+    # is fewer than threshold bits away from it is skipped, unless the last
+    # save is more than max_interval seconds old (0 never forces one), so a
+    # static camera still leaves a regular trace. threshold 0 saves every
+    # frame.
+    def __init__(self, threshold=0, max_interval=0, hash_size=8):
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.hash_size = hash_size
+        self._last = {}
+        self.saved = 0
+        self.skipped = 0
+
+    def should_save(self, stream, frame, now=None):
+        # Returns (save, hash), pass hash to mark_saved() once it is written
+        if now is None:
+            now = time.time()
+        if self.threshold <= 0:
+            self.saved += 1
+            return True, None
+        frame_hash = dhash(frame, self.hash_size)
+        last = self._last.get(stream)
+        if last is not None and hamming(frame_hash, last[0]) < self.threshold \
+                and not (self.max_interval and now - last[1] >= self.max_interval):
+            self.skipped += 1
+            return False, frame_hash
+        self.saved += 1
+        return True, frame_hash
+
+    def mark_saved(self, stream, frame_hash, now=None):
+        if now is None:
+            now = time.time()
+        if frame_hash is not None:
+            self._last[stream] = (frame_hash, now)
+
+    def remove_stream(self, stream):
+        self._last.pop(stream, None)
+
+    def stats(self):
+        return {"saved": self.saved, "skipped": self.skipped}
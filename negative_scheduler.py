@@ -0,0 +1,51 @@
+import time
+import random
+
+
+class NegativeScheduler:
+
+    # Keeps one deadline per stream for negative ("no detection") snapshots.
+    # Initial deadlines are staggered evenly over one interval so streams do
+    # not all copy and encode a frame in the same batch, and every
+    # rescheduling adds up to +/- jitter seconds to keep them apart.
+    def __init__(self, streams, interval, jitter=0, now=None):
+        self.interval = interval
+        self.jitter = jitter
+        self._deadlines = {}
+        if now is None:
+            now = time.time()
+        streams = list(streams)
+        for k, stream in enumerate(streams):
+            self._deadlines[stream] = now + interval + interval * k / len(streams)
+
+    def add_stream(self, stream, now=None):
+        if now is None:
+            now = time.time()
+        self._deadlines[stream] = now + self._next_interval()
+
+    def remove_stream(self, stream):
+        self._deadlines.pop(stream, None)
+
+    def set_interval(self, interval, jitter=None):
+        # Pull existing deadlines in if the new interval is shorter, so the
+        # change takes effect without waiting for the old deadline.
+        now = time.time()
+        self.interval = interval
+        if jitter is not None:
+            self.jitter = jitter
+        for stream, deadline in self._deadlines.items():
+            self._deadlines[stream] = min(deadline, now + interval)
+
+    def due(self, stream, now):
+        return now >= self._deadlines.get(stream, float("inf"))
+
+    def mark_saved(self, stream, now):
+        self._deadlines[stream] = now + self._next_interval()
+
+    def deadline(self, stream):
+        return self._deadlines.get(stream)
+
+    def _next_interval(self):
+        if self.jitter > 0:
+            return max(0.0, self.interval + random.uniform(-self.jitter, self.jitter))
+        return self.interval
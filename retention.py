@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import datetime
+import threading
+from collections import deque
+
+
+LAYOUTS = {
+    "flat": None,
+    "day": "%Y%m%d",
+    "hour": os.path.join("%Y%m%d", "%H"),
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".png", ".webp", ".npy")
+# the hourly detections sidecars of the image writer
+SIDECAR_EXTENSION = ".jsonl"
+
+
+def bucket_dir(directory, timestamp, layout="flat"):
+    # positive/stream_0 -> positive/stream_0/20210316/14 for the "hour" layout
+    fmt = LAYOUTS[layout]
+    if fmt is None:
+        return directory
+    return os.path.join(directory, datetime.datetime.fromtimestamp(timestamp).strftime(fmt))
+
+
+def _limit(value, category):
+    # Limits are either one number for both categories or a dict keyed by
+    # category, 0/None meaning no limit.
+    if isinstance(value, dict):
+        value = value.get(category)
+    return value or 0
+
+
+class RetentionManager:
+
+    # Enforces max bytes and/or max age per (category, stream) directory,
+    # images and detection sidecars alike. Files are tracked in an in-memory index, oldest first, that is seeded by
+    # one scan at start up and then fed by the image writer, so large
+    # directories are never listed again. Deletion happens in batches from a
+    # background thread. With streams given, only those stream directories
+    # are scanned at start up.
+    def __init__(self, categories=("positive", "negative"), max_bytes=0, max_age=0, interval=60, batch_size=200,
+                 on_delete=None, streams=None):
+        self.categories = categories
+        self.streams = set(streams) if streams is not None else None
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_size = batch_size
+        # called with the list of deleted paths after every batch
+        self.on_delete = on_delete
+
+        self._index = {}
+        self._bytes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.deleted = 0
+        self.deleted_bytes = 0
+
+    def enabled(self):
+        return any(_limit(self.max_bytes, c) or _limit(self.max_age, c) for c in self.categories)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def add(self, category, stream, path, size, timestamp):
+        key = (category, stream)
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = deque()
+                self._bytes[key] = 0
+            files = self._index[key]
+            #keep the files oldest first, a sidecar is only added once the
+            #next hour has started and writer threads can finish out of order
+            position = len(files)
+            while position and files[position - 1][0] > timestamp:
+                position -= 1
+            files.insert(position, (timestamp, path, size))
+            self._bytes[key] += size
+
+    def usage(self):
+        with self._lock:
+            return {"%s/stream_%s" % key: {"files": len(files), "bytes": self._bytes[key]}
+                    for key, files in self._index.items()}
+
+    def stats(self):
+        return {"deleted": self.deleted, "deleted_bytes": self.deleted_bytes, "usage": self.usage()}
+
+    def _run(self):
+        self._seed()
+        while not self._stop.wait(self.interval):
+            self.enforce()
+
+    def _seed(self):
+        found = {}
+        for category in self.categories:
+            if not os.path.isdir(category):
+                continue
+            for stream_dir in os.listdir(category):
+                if not stream_dir.startswith("stream_"):
+                    continue
+                stream = stream_dir[len("stream_"):]
+                stream = int(stream) if stream.isdigit() else stream
+                if self.streams is not None and stream not in self.streams:
+                    continue
+                files = []
+                for root, _, names in os.walk(os.path.join(category, stream_dir)):
+                    for name in names:
+                        if not name.endswith(IMAGE_EXTENSIONS + (SIDECAR_EXTENSION,)):
+                            continue
+                        path = os.path.join(root, name)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        files.append((st.st_mtime, path, st.st_size))
+                found[(category, stream)] = files
+        with self._lock:
+            # merge with whatever the writer added while the scan was running
+            for key, files in found.items():
+                known = self._index.get(key, deque())
+                paths = set(path for _, path, _ in known)
+                merged = sorted([f for f in files if f[1] not in paths] + list(known))
+                self._index[key] = deque(merged)
+                self._bytes[key] = sum(size for _, _, size in merged)
+
+    def enforce(self, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            keys = list(self._index)
+        for category, stream in keys:
+            max_bytes = _limit(self.max_bytes, category)
+            max_age = _limit(self.max_age, category)
+            if not max_bytes and not max_age:
+                continue
+            while not self._stop.is_set():
+                batch = self._take_batch((category, stream), max_bytes, max_age, now)
+                if not batch:
+                    break
+                self._delete(batch)
+
+    def _take_batch(self, key, max_bytes, max_age, now):
+        batch = []
+        with self._lock:
+            files = self._index[key]
+            while files and len(batch) < self.batch_size:
+                timestamp, path, size = files[0]
+                too_big = max_bytes and self._bytes[key] > max_bytes
+                too_old = max_age and now - timestamp > max_age
+                if not too_big and not too_old:
+                    break
+                files.popleft()
+                self._bytes[key] -= size
+                batch.append((path, size))
+        return batch
+
+    def _delete(self, batch):
+        parents = set()
+        deleted = []
+        for path, size in batch:
+            try:
+                os.remove(path)
+                self.deleted += 1
+                self.deleted_bytes += size
+                deleted.append(path)
+            except FileNotFoundError:
+                deleted.append(path)
+            except OSError as e:
+                sys.stderr.write("Unable to delete %s: %s\n" % (path, e))
+            parents.add(os.path.dirname(path))
+        if deleted and self.on_delete is not None:
+            self.on_delete(deleted)
+        # drop hour/day buckets that are now empty, never the stream directory
+        for parent in sorted(parents, reverse=True):
+            while not os.path.basename(parent).startswith("stream_"):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
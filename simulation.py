@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+from config_loader import with_defaults
+
+
+# CPU-only stand-ins for the DeepStream parts of deepstream_all_save_images:
+# a synthetic scene, a pyds replacement serving its batch metadata and frame
+# surfaces, and a pipeline made of stock GStreamer elements. The pad probe and
+# the save path run unchanged on top of them.
+
+DEFAULT_SIMULATION = {
+    "source": "videotestsrc",
+    "uri": "",
+    "fps": 30,
+    "objects_per_frame": 3,
+    "track_churn": 0.02,
+    "empty_ratio": 0.2,
+    "num_classes": 6,
+    "seed": 0,
+}
+
+
+def simulation_config(config):
+    sim = dict(DEFAULT_SIMULATION)
+    sim.update(config["simulation"])
+    return sim
+
+
+class SyntheticScene:
+
+    # Tracks per stream that live for a while and move around. Every frame
+    # each track ends with probability track_churn and is replaced by a new
+    # track id. Streams switch between empty and busy periods so that roughly
+    # empty_ratio of the frames carry no objects.
+    def __init__(self, streams, width, height, objects_per_frame=3, track_churn=0.02, empty_ratio=0.2,
+                 num_classes=6, seed=0):
+        self.streams = list(streams)
+        self.width = width
+        self.height = height
+        self.objects_per_frame = objects_per_frame
+        self.track_churn = track_churn
+        self.empty_ratio = empty_ratio
+        self.num_classes = num_classes
+        self._rng = random.Random(seed)
+        self._next_id = 1
+        self._tracks = {stream: [] for stream in self.streams}
+        self._empty = {stream: False for stream in self.streams}
+        self.frames = 0
+        self.objects = 0
+
+    def add_stream(self, stream):
+        self.streams.append(stream)
+        self._tracks[stream] = []
+        self._empty[stream] = False
+
+    def remove_stream(self, stream):
+        self.streams.remove(stream)
+        self._tracks.pop(stream, None)
+        self._empty.pop(stream, None)
+
+    def _new_track(self):
+        rng = self._rng
+        w = rng.uniform(0.05, 0.25) * self.width
+        h = rng.uniform(0.1, 0.5) * self.height
+        track = {
+            "object_id": self._next_id,
+            "class_id": rng.randrange(self.num_classes),
+            "confidence": rng.uniform(0.3, 1.0),
+            "left": rng.uniform(0, self.width - w),
+            "top": rng.uniform(0, self.height - h),
+            "width": w,
+            "height": h,
+            "dx": rng.uniform(-4, 4),
+            "dy": rng.uniform(-2, 2),
+        }
+        self._next_id += 1
+        return track
+
+    def step(self, stream):
+        # Advances one frame of a stream and returns its object dicts
+        rng = self._rng
+        if rng.random() < 0.01:
+            self._empty[stream] = rng.random() < self.empty_ratio
+        tracks = self._tracks[stream]
+        if self._empty[stream]:
+            tracks[:] = []
+        else:
+            tracks[:] = [t for t in tracks if rng.random() >= self.track_churn]
+            while len(tracks) < self.objects_per_frame:
+                tracks.append(self._new_track())
+            for t in tracks:
+                t["left"] = min(max(0.0, t["left"] + t["dx"]), self.width - t["width"])
+                t["top"] = min(max(0.0, t["top"] + t["dy"]), self.height - t["height"])
+                t["confidence"] = min(1.0, max(0.1, t["confidence"] + rng.uniform(-0.05, 0.05)))
+        self.frames += 1
+        self.objects += len(tracks)
+        return tracks
+
+
+class _ListNode:
+
+    # Mimics the pyds GList wrapper: .data and .next, None at the end
+    __slots__ = ("data", "next")
+
+    def __init__(self, data, next_node=None):
+        self.data = data
+        self.next = next_node
+
+
+def _linked(items):
+    head = None
+    for item in reversed(items):
+        head = _ListNode(item, head)
+    return head
+
+
+class RectParams:
+    __slots__ = ("left", "top", "width", "height")
+
+    def __init__(self, left, top, width, height):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+
+class NvDsObjectMeta:
+    __slots__ = ("object_id", "class_id", "confidence", "rect_params")
+
+    def __init__(self, object_id, class_id, confidence, rect_params):
+        self.object_id = object_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.rect_params = rect_params
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsFrameMeta:
+    __slots__ = ("frame_num", "pad_index", "source_id", "batch_id", "buf_pts", "num_obj_meta",
+                 "obj_meta_list", "source_frame_width", "source_frame_height")
+
+    def __init__(self, frame_num, pad_index, batch_id, buf_pts, objects, width, height):
+        self.frame_num = frame_num
+        self.pad_index = pad_index
+        self.source_id = pad_index
+        self.batch_id = batch_id
+        self.buf_pts = buf_pts
+        self.num_obj_meta = len(objects)
+        self.obj_meta_list = _linked(objects)
+        self.source_frame_width = width
+        self.source_frame_height = height
+
+    @staticmethod
+    def cast(data):
+        return data
+
+
+class NvDsBatchMeta:
+    __slots__ = ("frame_meta_list", "num_frames_in_batch")
+
+    def __init__(self, frames):
+        self.frame_meta_list = _linked(frames)
+        self.num_frames_in_batch = len(frames)
+
+
+class SimulatedPyds:
+
+    # The subset of the pyds module used by the pad probe. Every call of
+    # gst_buffer_get_nvds_batch_meta() produces the next batch of the scene,
+    # one frame per stream, and get_nvds_buf_surface() returns a synthetic
+    # RGBA frame of that stream.
+    NvDsFrameMeta = NvDsFrameMeta
+    NvDsObjectMeta = NvDsObjectMeta
+    NVBUF_MEM_CUDA_UNIFIED = 0
+
+    def __init__(self, config, streams, scene=None):
+        from benchmark_encoders import synthetic_frames
+        sim = simulation_config(config)
+        width = config["processing_width"]
+        height = config["processing_height"]
+        if scene is None:
+            scene = SyntheticScene(streams, width, height, objects_per_frame=sim["objects_per_frame"],
+                                   track_churn=sim["track_churn"], empty_ratio=sim["empty_ratio"],
+                                   num_classes=sim["num_classes"], seed=sim["seed"])
+        self.scene = scene
+        self.fps = sim["fps"]
+        self._frames = synthetic_frames(width, height, 4, seed=sim["seed"])
+        self._batch_streams = []
+        self.batches = 0
+
+    def gst_buffer_get_nvds_batch_meta(self, gst_buffer_address):
+        scene = self.scene
+        pts = int(self.batches * 1e9 / self.fps)
+        frames = []
+        self._batch_streams = list(scene.streams)
+        for batch_id, stream in enumerate(self._batch_streams):
+            objects = [NvDsObjectMeta(t["object_id"], t["class_id"], t["confidence"],
+                                      RectParams(t["left"], t["top"], t["width"], t["height"]))
+                       for t in scene.step(stream)]
+            frames.append(NvDsFrameMeta(self.batches, stream, batch_id, pts, objects, scene.width, scene.height))
+        self.batches += 1
+        return NvDsBatchMeta(frames)
+
+    def get_nvds_buf_surface(self, gst_buffer_address, batch_id):
+        return self._frames[self._batch_streams[batch_id] % len(self._frames)]
+
+    def stats(self):
+        return {"batches": self.batches, "frames": self.scene.frames, "objects": self.scene.objects}
+
+
+def build_pipeline(config, streams):
+    # Same chain and element names as deepstream_all_save_images.build_pipeline
+    # with identity stand-ins for the NV elements. The source only paces the
+    # batches; frames and metadata come from SimulatedPyds.
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+
+    sim = simulation_config(config)
+    width = config["processing_width"]
+    height = config["processing_height"]
+    caps = Gst.Caps.from_string("video/x-raw, format=RGBA, width=%d, height=%d, framerate=%d/1"
+                                % (width, height, sim["fps"]))
+
+    pipeline = Gst.Pipeline()
+
+    def make(factory, name):
+        element = Gst.ElementFactory.make(factory, name)
+        if not element:
+            sys.stderr.write(" Unable to create %s \n" % name)
+        pipeline.add(element)
+        return element
+
+    # "streammux" is the capsfilter that fixes size, format and frame rate
+    streammux = make("capsfilter", "Stream-muxer")
+    streammux.set_property("caps", caps)
+    if sim["source"] == "uri":
+        uri = sim["uri"] or list(config["source"].values())[0]
+        source = make("uridecodebin", "uri-decode-bin")
+        source.set_property("uri", uri)
+        convert = make("videoconvert", "convertor_src")
+        scale = make("videoscale", "scaler_src")
+        rate = make("videorate", "rate_src")
+        convert.link(scale)
+        scale.link(rate)
+        rate.link(streammux)
+
+        def on_pad_added(decodebin, pad):
+            if pad.get_current_caps().get_structure(0).get_name().startswith("video"):
+                pad.link(convert.get_static_pad("sink"))
+        source.connect("pad-added", on_pad_added)
+    else:
+        source = make("videotestsrc", "src_elem")
+        source.set_property("is-live", True)
+        source.link(streammux)
+
+    pgie = make("identity", "primary-inference")
+    tracker = make("identity", "tracker")
+    nvvidconv1 = make("identity", "convertor1")
+    filter1 = make("identity", "filter1")
+    tiler = make("identity", "nvtiler")
+    nvvidconv = make("identity", "convertor")
+    nvosd = make("identity", "onscreendisplay")
+    sink = make("fakesink", "fakesink")
+    sink.set_property("sync", 0)
+    sink.set_property("qos", 0)
+    queues = [make("queue", "queue%d" % i) for i in range(1, 9)]
+
+    chain = [streammux, queues[0], pgie, queues[1], tracker, queues[2], nvvidconv1, queues[3], filter1,
+             queues[4], tiler, queues[5], nvvidconv, queues[6], nvosd, queues[7], sink]
+    for upstream, downstream in zip(chain, chain[1:]):
+        upstream.link(downstream)
+
+    return {"pipeline": pipeline, "streammux": streammux, "pgie": pgie, "tracker": tracker,
+            "tiler": tiler, "nvosd": nvosd, "sink": sink, "source_bins": {}, "queues": queues}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline with the CPU-only simulation backend")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--objects", type=int, help="objects per frame")
+    parser.add_argument("--churn", type=float, help="probability per frame that a track ends")
+    parser.add_argument("--fps", type=int, help="batches per second produced by the source")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--workdir", help="directory to write images to, the current directory by default")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = with_defaults(json.load(f))
+    sim = config["simulation"] = dict(config["simulation"])
+    for key, value in (("objects_per_frame", args.objects), ("track_churn", args.churn), ("fps", args.fps)):
+        if value is not None:
+            sim[key] = value
+    config["backend"] = "simulation"
+    config["source_type"] = "rtsp"
+    config["source"] = {"stream_%d" % i: "sim://stream_%d" % i for i in range(args.streams)}
+    config["display"] = False
+    config["encoder_process"] = False
+    config["run_duration"] = args.duration
+
+    if args.workdir:
+        #keep the repo and the deepstream_python_apps "common" package importable
+        here = os.path.dirname(os.path.abspath(__file__))
+        sys.path[:0] = [here, os.path.dirname(here)]
+        os.makedirs(args.workdir, exist_ok=True)
+        os.chdir(args.workdir)
+    import deepstream_all_save_images as ds
+
+    start = time.time()
+    ds.deepstream_main(config)
+    elapsed = time.time() - start
+    sim_stats = ds.pyds.stats()
+    writer_stats = ds.image_writer.stats()
+    print("\nSimulation: %d streams for %.1f s" % (args.streams, elapsed))
+    print("  frames/sec : %.1f (%.1f batches/sec)" % (sim_stats["frames"] / elapsed, sim_stats["batches"] / elapsed))
+    print("  objects    : %d" % sim_stats["objects"])
+    print("  saves/sec  : %.2f (%d written, %d dropped)" % (writer_stats["written"] / elapsed,
+                                                            writer_stats["written"], writer_stats["dropped"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import time
+
+
+class SourceWatchdog:
+
+    # Last buffer time per stream (streammux pad index), fed by the pad probe.
+    # A stream with no buffer for stall_timeout seconds is reported by due()
+    # so that its source bin alone can be rebuilt. After every restart the
+    # stream gets backoff seconds to deliver again before the next attempt,
+    # doubling up to backoff_max, and the backoff is reset once buffers flow.
+    # A stream is only checked from its first buffer on, or from start(),
+    # so building the engine and connecting the cameras never counts as a
+    # stall.
+    def __init__(self, streams, stall_timeout=15, backoff=5, backoff_max=300):
+        self.stall_timeout = stall_timeout
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.started = False
+        self._last_seen = {}
+        self._next_attempt = {}
+        self._backoff = {}
+        self.restarts = {}
+        self.recoveries = {}
+        for stream in streams:
+            self.add_stream(stream)
+
+    def start(self, now=None):
+        # Called once the pipeline delivers its first batch: streams that
+        # have not sent anything yet get stall_timeout from now on
+        if now is None:
+            now = time.time()
+        self.started = True
+        for stream, last in self._last_seen.items():
+            if last is None:
+                self._last_seen[stream] = now
+
+    def add_stream(self, stream):
+        # Not checked before its first buffer
+        self._last_seen[stream] = None
+        self._next_attempt[stream] = 0
+        self._backoff[stream] = self.backoff
+        self.restarts.setdefault(stream, 0)
+        self.recoveries.setdefault(stream, 0)
+
+    def remove_stream(self, stream):
+        self._last_seen.pop(stream, None)
+        self._next_attempt.pop(stream, None)
+        self._backoff.pop(stream, None)
+
+    def heartbeat(self, stream, now):
+        if stream not in self._last_seen:
+            return
+        self._last_seen[stream] = now
+        if self._next_attempt[stream]:
+            #first buffer after a restart
+            self._next_attempt[stream] = 0
+            self._backoff[stream] = self.backoff
+            self.recoveries[stream] += 1
+
+    def due(self, now=None):
+        # Streams that are stalled and past their backoff, the caller is
+        # expected to restart each of them and call restarted()
+        if now is None:
+            now = time.time()
+        return [stream for stream, last in self._last_seen.items()
+                if last is not None and now - last > self.stall_timeout and now >= self._next_attempt[stream]]
+
+    def restarted(self, stream, now=None):
+        if now is None:
+            now = time.time()
+        self.restarts[stream] += 1
+        self._next_attempt[stream] = now + self._backoff[stream]
+        self._backoff[stream] = min(self._backoff[stream] * 2, self.backoff_max)
+
+    def stalled_for(self, stream, now=None):
+        if now is None:
+            now = time.time()
+        return now - self._last_seen[stream]
+
+    def stats(self):
+        now = time.time()
+        return {
+            "restarts": dict((str(s), n) for s, n in self.restarts.items()),
+            "recoveries": dict((str(s), n) for s, n in self.recoveries.items()),
+            "seconds_since_buffer": dict((str(s), now - t) for s, t in self._last_seen.items() if t is not None),
+        }
@@ -0,0 +1,75 @@
+from multiprocessing import Process, Pipe, Event, Queue, RawArray
+
+
+class StandbyPool:
+
+    # Keeps size worker processes running target(conn, ready, commands,
+    # results, heartbeat) that have done their imports and Gst.init and
+    # wait for a config on conn. take() hands one out and fill() spawns
+    # replacements, so a restart only pays for building the pipeline.
+    def __init__(self, target, size=1):
+        self.target = target
+        self.size = size
+        self._workers = []
+        self._spawned = 0
+
+    def fill(self):
+        self._workers = [w for w in self._workers if w["process"].is_alive()]
+        while len(self._workers) < self.size:
+            conn, child_conn = Pipe()
+            worker = {
+                "conn": conn,
+                "ready": Event(),
+                "channel": (Queue(), Queue()),
+                #time of the first and of the latest batch
+                "heartbeat": RawArray("d", 2),
+                "warm": False,
+            }
+            worker["process"] = Process(target=self.target, args=(child_conn, worker["ready"]) +
+                                        worker["channel"] + (worker["heartbeat"],),
+                                        name="standby-%d" % self._spawned)
+            worker["process"].start()
+            child_conn.close()
+            self._spawned += 1
+            self._workers.append(worker)
+
+    def _poll_warm(self):
+        for worker in self._workers:
+            if not worker["warm"] and worker["conn"].poll():
+                try:
+                    worker["warm"] = worker["conn"].recv() == "warm"
+                except EOFError:
+                    pass
+
+    def take(self, config, name):
+        # Starts a waiting worker on config, warm ones first, or returns None
+        self._poll_warm()
+        workers = sorted([w for w in self._workers if w["process"].is_alive()], key=lambda w: not w["warm"])
+        for worker in workers:
+            self._workers.remove(worker)
+            try:
+                worker["conn"].send(config)
+            except (OSError, EOFError):
+                continue
+            worker["conn"].close()
+            worker["process"].name = name
+            return worker
+        return None
+
+    def stop(self):
+        for worker in self._workers:
+            try:
+                worker["conn"].send(None)
+            except (OSError, EOFError):
+                pass
+        for worker in self._workers:
+            worker["process"].join(5)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+                worker["process"].join()
+        self._workers = []
+
+    def status(self):
+        self._poll_warm()
+        return {"size": self.size, "waiting": len(self._workers),
+                "warm": sum(1 for w in self._workers if w["warm"])}
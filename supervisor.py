@@ -0,0 +1,315 @@
+import os
+import time
+import queue
+from collections import deque, namedtuple
+
+
+# Processes of one running shard: processes holds deepstream plus the
+# optional encoder, channel is the (commands, results) queue pair for source
+# changes and heartbeat the time of the first and of the latest batch seen
+# by the pad probe.
+Worker = namedtuple("Worker", ["processes", "process", "ready", "channel", "heartbeat"])
+
+# seconds to wait for a shard to answer a source or config command, a later
+# reply is still applied by poll()
+SOURCE_COMMAND_TIMEOUT = 10
+
+
+def stream_number(name):
+    # "stream_3" -> 3
+    return int(name.split("_")[-1])
+
+
+def shard_sources(config, max_streams_per_shard=0):
+    # Splits config["source"] into one config per shard of at most
+    # max_streams_per_shard streams. Stream numbers are kept so images,
+    # directories and the index do not depend on the sharding. Every shard
+    # gets its own metrics port and event socket and room to add sources up
+    # to a full shard.
+    if config["source_type"] != "rtsp" or not max_streams_per_shard:
+        shard = dict(config)
+        sources = len(config["source"]) if config["source_type"] == "rtsp" else 1
+        shard["max_sources"] = max(sources, config["max_sources"])
+        shards = [shard]
+    else:
+        names = sorted(config["source"], key=stream_number)
+        shards = []
+        for k in range(0, len(names), max_streams_per_shard):
+            shard = dict(config)
+            shard["source"] = {name: config["source"][name] for name in names[k:k + max_streams_per_shard]}
+            shard["max_sources"] = max_streams_per_shard
+            shards.append(shard)
+    for k, shard in enumerate(shards):
+        shard["shard"] = k
+        shard["metrics_port"] = config["metrics_port"] + k
+        if k and config["event_socket"]:
+            #events.sock, events_1.sock, events_2.sock, ...
+            root, ext = os.path.splitext(config["event_socket"])
+            shard["event_socket"] = "%s_%d%s" % (root, k, ext)
+    return shards
+
+
+class Shard:
+
+    # One deepstream_main process and its restart policy. A shard whose
+    # processes exit, that is not ready after start_timeout or that has not
+    # seen a batch for stall_timeout seconds is stopped and started again
+    # after a backoff that doubles up to backoff_max and resets once it is
+    # ready again. crash_loop_restarts failures within crash_loop_window
+    # seconds put it in "crashloop" until the next start/restart command.
+    def __init__(self, index, config, start, terminate, backoff=2, backoff_max=60, crash_loop_restarts=5,
+                 crash_loop_window=300, stall_timeout=120, start_timeout=600):
+        self.index = index
+        self.config = config
+        self._start = start
+        self._terminate = terminate
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.crash_loop_restarts = crash_loop_restarts
+        self.crash_loop_window = crash_loop_window
+        self.stall_timeout = stall_timeout
+        self.start_timeout = start_timeout
+
+        self.state = "stopped"
+        self.worker = None
+        self.started = None
+        self.ready = None
+        self.restarts = 0
+        self.last_failure = None
+        self.next_start = None
+        self._backoff = backoff
+        self._failures = deque()
+        #commands sent to the current worker that have not been answered yet,
+        #{request id: (command, args)}
+        self._requests = 0
+        self._unanswered = {}
+
+    def streams(self):
+        return sorted(stream_number(name) for name in self.config["source"]) \
+            if self.config["source_type"] == "rtsp" else [0]
+
+    def start(self, now=None):
+        if now is None:
+            now = time.time()
+        print("Starting shard %d: streams %s" % (self.index, self.streams()))
+        self.worker = self._start(self.config, self.index)
+        self.state = "starting"
+        self.started = now
+        self.ready = None
+        self.next_start = None
+        self._unanswered = {}
+
+    def stop(self):
+        if self.worker is not None:
+            self._terminate(self.worker.processes)
+        self.worker = None
+        self.state = "stopped"
+        self.started = None
+        self.ready = None
+
+    def poll(self, now):
+        if self.state in ["starting", "running"]:
+            worker = self.worker
+            dead = [p for p in worker.processes if not p.is_alive()]
+            if dead:
+                self._failed(now, "%s exited with code %s" % (dead[0].name, dead[0].exitcode))
+            elif self.state == "starting":
+                if worker.ready.is_set():
+                    self.state = "running"
+                    self.ready = now
+                    self._backoff = self.backoff
+                    print("Shard %d running, first batch after %.2f s" % (self.index, now - self.started))
+                elif self.start_timeout and now - self.started > self.start_timeout:
+                    self._failed(now, "not ready after %d s" % self.start_timeout)
+            elif self.stall_timeout and now - worker.heartbeat[1] > self.stall_timeout:
+                self._failed(now, "no batch for %d s" % self.stall_timeout)
+            elif self._unanswered:
+                self._receive(None, 0)
+        elif self.state == "backoff" and now >= self.next_start:
+            self.restarts += 1
+            self.start(now)
+
+    def _failed(self, now, reason):
+        print("Shard %d failed: %s" % (self.index, reason))
+        self._terminate(self.worker.processes)
+        self.worker = None
+        self.last_failure = {"time": now, "reason": reason}
+        self._failures.append(now)
+        while self._failures and now - self._failures[0] > self.crash_loop_window:
+            self._failures.popleft()
+        if len(self._failures) >= self.crash_loop_restarts:
+            print("Shard %d failed %d times in %d s, not restarting it until the next start/restart"
+                  % (self.index, len(self._failures), self.crash_loop_window))
+            self.state = "crashloop"
+        else:
+            self.state = "backoff"
+            self.next_start = now + self._backoff
+            print("Restarting shard %d in %.0f s" % (self.index, self._backoff))
+            self._backoff = min(self._backoff * 2, self.backoff_max)
+
+    def command(self, command, args, timeout=SOURCE_COMMAND_TIMEOUT):
+        # Runs an add/remove source or a config command in the shard's
+        # deepstream process. Only a running shard takes commands, a starting
+        # one does not read them yet. Every command carries a request id
+        # that the reply repeats, replies to earlier commands that timed out
+        # are applied but not returned.
+        if self.state != "running":
+            return {"ok": False, "error": "shard %d is %s" % (self.index, self.state)}
+        self._requests += 1
+        request = self._requests
+        self._unanswered[request] = (command, args)
+        self.worker.channel[0].put((request, command, args))
+        reply = self._receive(request, timeout)
+        if reply is None:
+            return {"ok": False, "error": "timed out waiting for shard %d" % self.index}
+        return reply
+
+    def _receive(self, request, timeout):
+        # Reads replies until the one to request arrives, for up to timeout
+        # seconds. Source changes a reply confirms are kept in the shard
+        # config, so that a restarted shard has them too.
+        results = self.worker.channel[1]
+        deadline = time.time() + timeout
+        while True:
+            try:
+                received, reply = results.get(timeout=max(0, deadline - time.time())) if timeout \
+                    else results.get_nowait()
+            except queue.Empty:
+                return None
+            if received not in self._unanswered:
+                continue
+            command, args = self._unanswered.pop(received)
+            if reply.get("ok") and command == "add":
+                self.config["source"] = dict(self.config["source"], **{"stream_%d" % args[0]: args[1]})
+            elif reply.get("ok") and command == "remove":
+                name = "stream_%d" % args[0]
+                self.config["source"] = {n: uri for n, uri in self.config["source"].items() if n != name}
+            if received == request:
+                return reply
+            print("Shard %d answered %s %s late: %s" % (self.index, command, args, reply))
+
+    def status(self, now):
+        worker = self.worker
+        return {
+            "shard": self.index,
+            "state": self.state,
+            "streams": self.streams(),
+            "pid": worker.process.pid if worker is not None else None,
+            "uptime": now - self.started if self.started else None,
+            "startup_time": self.ready - self.started if self.ready else None,
+            "last_batch": now - worker.heartbeat[1] if worker is not None and worker.heartbeat[1] else None,
+            "restarts": self.restarts,
+            "last_failure": self.last_failure,
+            "processes": [{"name": p.name, "pid": p.pid, "alive": p.is_alive()}
+                          for p in (worker.processes if worker is not None else [])],
+        }
+
+
+class Supervisor:
+
+    # Runs one shard per group of max_streams_per_shard sources (all sources
+    # in one shard when 0) and keeps them alive, see Shard. start(worker_config,
+    # index) starts the processes of a shard and returns a Worker,
+    # terminate(processes) stops them.
+    def __init__(self, start, terminate, max_streams_per_shard=0, **policy):
+        self._start = start
+        self._terminate = terminate
+        self.max_streams_per_shard = max_streams_per_shard
+        self.policy = policy
+        self.shards = []
+
+    def start(self, config):
+        self.stop()
+        self.shards = [Shard(k, shard, self._start, self._terminate, **self.policy)
+                       for k, shard in enumerate(shard_sources(config, self.max_streams_per_shard))]
+        now = time.time()
+        for shard in self.shards:
+            shard.start(now)
+
+    def stop(self):
+        # Returns the time of the latest batch, read once the processes are gone
+        workers = [shard.worker for shard in self.shards if shard.worker is not None]
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
+        times = [worker.heartbeat[1] for worker in workers if worker.heartbeat[1]]
+        return max(times) if times else None
+
+    def poll(self, now=None):
+        if now is None:
+            now = time.time()
+        for shard in self.shards:
+            shard.poll(now)
+
+    def state(self):
+        states = set(shard.state for shard in self.shards)
+        if not states or states == {"stopped"}:
+            return "stopped"
+        if states == {"running"}:
+            return "running"
+        if states <= {"starting", "running"}:
+            return "starting"
+        if states == {"crashloop"}:
+            return "failed"
+        return "degraded"
+
+    def source_command(self, command, stream, uri=None):
+        # Routes "add" to the running shard with the fewest streams that has
+        # a free batch slot and "remove" to the shard owning the stream.
+        name = "stream_%d" % stream
+        owner = [shard for shard in self.shards if name in shard.config["source"]]
+        if command == "add":
+            if owner:
+                return {"ok": False, "error": "%s is already running in shard %d" % (name, owner[0].index)}
+            free = [shard for shard in self.shards if shard.state == "running"
+                    and len(shard.config["source"]) < shard.config["max_sources"]]
+            if not free:
+                return {"ok": False, "error": "no running shard has a free batch slot"}
+            shard = min(free, key=lambda s: len(s.config["source"]))
+            reply = shard.command("add", (stream, uri))
+        else:
+            if not owner:
+                return {"ok": False, "error": "%s is not running" % name}
+            shard = owner[0]
+            reply = shard.command("remove", (stream,))
+        reply["shard"] = shard.index
+        return reply
+
+    def update_policy(self, **policy):
+        # New restart policy (the Shard arguments), shards keep their current
+        # backoff and failure history
+        self.policy.update(policy)
+        for shard in self.shards:
+            for key, value in policy.items():
+                setattr(shard, key, value)
+
+    def apply_config(self, changes):
+        # Sends {key: value} changes to the deepstream process of every
+        # running shard and keeps them in the shard configs for later
+        # restarts. A starting shard has not seen a batch yet and is started
+        # again on the new config. Returns the replies of those shards.
+        replies = []
+        now = time.time()
+        for shard in self.shards:
+            shard.config = dict(shard.config, **changes)
+            if shard.state == "running":
+                reply = shard.command("config", (changes,))
+            elif shard.state == "starting":
+                shard.stop()
+                shard.start(now)
+                reply = {"ok": True, "restarted": True}
+            else:
+                continue
+            reply["shard"] = shard.index
+            replies.append(reply)
+        return replies
+
+    def first_batch(self):
+        # Time of the first batch of any shard, None before there is one
+        times = [shard.worker.heartbeat[0] for shard in self.shards
+                 if shard.worker is not None and shard.worker.heartbeat[0]]
+        return min(times) if times else None
+
+    def status(self):
+        now = time.time()
+        return {"state": self.state(), "shards": [shard.status(now) for shard in self.shards]}
@@ -0,0 +1,96 @@
+import numpy as np
+
+from best_shot import BestShotSelector
+from image_writer import ObjectInfo
+
+
+def box(object_id, confidence=0.5, size=10.0):
+    return ObjectInfo(object_id, 0, confidence, 0.0, 0.0, size, size)
+
+
+class Collector:
+
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record, copy=True):
+        assert not copy
+        self.records.append(record)
+        return True
+
+    def object_ids(self):
+        return sorted(obj.object_id for record in self.records for obj in record.objects)
+
+
+def frame(value):
+    return np.full((4, 4, 4), value, dtype=np.uint8)
+
+
+def see(selector, stream, objects, value, now):
+    # what the pad probe does for one frame
+    improved = [obj for obj in objects if selector.observe(stream, obj, now)]
+    if improved:
+        selector.snapshot(stream, improved, frame(value), now)
+
+
+def test_keeps_best_frame_of_a_track():
+    out = Collector()
+    selector = BestShotSelector(out.submit, timeout=1.0, min_improvement=1.2)
+    see(selector, 0, [box(1, 0.5, 10)], 1, 0.0)
+    see(selector, 0, [box(1, 0.9, 20)], 2, 0.1)
+    #not enough better
+    see(selector, 0, [box(1, 0.9, 21)], 3, 0.2)
+    selector.expire(0.5)
+    assert out.records == []
+    selector.expire(1.5)
+    assert len(out.records) == 1
+    assert out.records[0].frame[0, 0, 0] == 2
+    assert out.records[0].objects[0].width == 20
+
+
+def test_max_age_sends_long_tracks_off():
+    out = Collector()
+    selector = BestShotSelector(out.submit, timeout=1.0, max_age=2.0)
+    for k in range(5):
+        see(selector, 0, [box(1)], k, k * 0.5)
+    selector.expire(2.5)
+    assert out.object_ids() == [1]
+
+
+def test_tracks_sharing_a_frame_share_a_record():
+    out = Collector()
+    selector = BestShotSelector(out.submit)
+    see(selector, 0, [box(1), box(2)], 1, 0.0)
+    selector.flush()
+    assert len(out.records) == 1
+    assert out.object_ids() == [1, 2]
+
+
+def test_more_new_tracks_than_max_pending_all_get_an_image():
+    out = Collector()
+    selector = BestShotSelector(out.submit, max_pending=3)
+    see(selector, 0, [box(k) for k in range(6)], 1, 0.0)
+    assert len(selector) == 3
+    assert selector.early == 3
+    selector.flush()
+    assert out.object_ids() == list(range(6))
+    assert selector.stats()["dropped"] == 0
+
+
+def test_track_without_snapshot_is_counted_as_dropped():
+    out = Collector()
+    selector = BestShotSelector(out.submit)
+    selector.observe(0, box(1), 0.0)
+    selector.flush()
+    assert out.records == []
+    assert selector.stats()["dropped"] == 1
+
+
+def test_flush_of_one_stream():
+    out = Collector()
+    selector = BestShotSelector(out.submit)
+    see(selector, 0, [box(1)], 1, 0.0)
+    see(selector, 1, [box(1)], 1, 0.0)
+    selector.flush(1)
+    assert [record.stream for record in out.records] == [1]
+    assert selector.pending(0, 1) and not selector.pending(1, 1)
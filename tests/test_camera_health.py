@@ -0,0 +1,57 @@
+import time
+import threading
+
+from camera_health import HealthCache, probe_sources
+
+
+def test_results_are_cached_by_uri():
+    cache = HealthCache(ttl=30)
+    checked = []
+
+    def check(uri):
+        checked.append(uri)
+        return uri != "rtsp://broken"
+
+    sources = {"stream_0": "rtsp://cam0", "stream_1": "rtsp://broken"}
+    assert probe_sources(sources, check, cache) == {"stream_0": True, "stream_1": False}
+    assert probe_sources(sources, check, cache) == {"stream_0": True, "stream_1": False}
+    assert sorted(checked) == ["rtsp://broken", "rtsp://cam0"]
+    #stream_1 now points at another camera, its old result does not apply
+    assert probe_sources({"stream_1": "rtsp://cam1"}, check, cache) == {"stream_1": True}
+    assert checked[-1] == "rtsp://cam1"
+    assert cache.snapshot()["stream_1"]["ok"]
+
+
+def test_stale_results_are_probed_again():
+    cache = HealthCache(ttl=30)
+    cache.update("stream_0", "rtsp://cam0", False, checked_at=time.time() - 31)
+    assert probe_sources({"stream_0": "rtsp://cam0"}, lambda uri: True, cache) == {"stream_0": True}
+
+
+def test_probe_without_answer_fails_at_the_deadline():
+    cache = HealthCache()
+    release = threading.Event()
+
+    def check(uri):
+        if uri == "rtsp://hanging":
+            release.wait(5)
+        return True
+
+    start = time.time()
+    try:
+        results = probe_sources({"stream_0": "rtsp://cam0", "stream_1": "rtsp://hanging"}, check, cache,
+                                timeout=0.3)
+    finally:
+        release.set()
+    assert results == {"stream_0": True, "stream_1": False}
+    assert time.time() - start < 2
+    assert cache.snapshot()["stream_1"]["error"] == "no answer after 0.3 s"
+
+
+def test_exception_counts_as_failed():
+    def check(uri):
+        raise RuntimeError("refused")
+
+    cache = HealthCache()
+    assert probe_sources({"stream_0": "rtsp://cam0"}, check, cache) == {"stream_0": False}
+    assert cache.snapshot()["stream_0"]["error"] == "refused"
@@ -0,0 +1,120 @@
+import os
+import json
+
+import pytest
+
+from config_loader import DEFAULTS, PIPELINE_LIVE_KEYS, diff_configs, load_config, with_defaults
+
+
+BASE = {
+    "source_type": "rtsp",
+    "source": {"stream_0": "rtsp://cam0", "stream_1": "rtsp://cam1"},
+    "display": False,
+    "processing_width": 1280,
+    "processing_height": 720,
+    "tiler_width": 1280,
+    "tiler_height": 720,
+    "image_timer": 300,
+    "queue_size": 20,
+    "pgie_config": __file__,
+}
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    def write(**changes):
+        config = dict(BASE, **changes)
+        path = tmp_path / "config.json"
+        path.write_text(json.dumps(config))
+        return str(path)
+    return write
+
+
+def test_defaults_are_filled_in(write_config):
+    config = load_config(write_config())
+    for key, value in DEFAULTS.items():
+        if key != "pgie_config":
+            assert config[key] == value
+
+
+def test_defaults_are_copies():
+    config = with_defaults({})
+    config["save_classes"].append(3)
+    assert DEFAULTS["save_classes"] == []
+
+
+def test_repository_config_loads():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        assert load_config("config.json") is not None
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize("key, value", [
+    ("display", "yes"),
+    ("image_timer", 1.5),
+    ("writer_workers", 0),
+    ("writer_policy", "drop_all"),
+    ("save_classes", [1, -1]),
+    ("negative_dedup_threshold", 65),
+    ("interval_busy_ratio", 1.5),
+    ("positive_encoder", {"format": "gif"}),
+    ("retention_max_bytes", {"positive": -1}),
+    ("best_shot", 1),
+])
+def test_wrong_values_are_rejected(write_config, key, value):
+    assert load_config(write_config(**{key: value})) is None
+
+
+def test_missing_required_key(tmp_path):
+    config = dict(BASE)
+    del config["queue_size"]
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config))
+    assert load_config(str(path)) is None
+
+
+def test_empty_source_is_rejected(write_config):
+    assert load_config(write_config(source={"stream_0": ""})) is None
+
+
+def test_queue_size_is_corrected(write_config):
+    assert load_config(write_config(queue_size=0))["queue_size"] == 20
+
+
+def test_interval_bounds_are_checked(write_config):
+    assert load_config(write_config(interval_min=5, interval_max=2)) is None
+    assert load_config(write_config(interval_idle_ratio=0.5, interval_busy_ratio=0.3)) is None
+
+
+def test_diff_sorts_keys_by_change(write_config):
+    old = load_config(write_config())
+    new = load_config(write_config(image_timer=60, restart_backoff=5, display=True, writer_workers=4,
+                                   source={"stream_1": "rtsp://other", "stream_2": "rtsp://cam2"}))
+    diff = diff_configs(old, new)
+    assert diff.live == {"image_timer": 60, "restart_backoff": 5}
+    assert diff.rebuild == {"display": True}
+    assert diff.restart == ["writer_workers"]
+    assert diff.removed == ["stream_0", "stream_1"]
+    assert diff.added == {"stream_1": "rtsp://other", "stream_2": "rtsp://cam2"}
+
+
+def test_key_set_to_its_default_is_no_change(write_config):
+    old = load_config(write_config())
+    new = load_config(write_config(track_ttl=DEFAULTS["track_ttl"]))
+    assert diff_configs(old, new) == diff_configs(old, old)
+
+
+def test_unknown_keys_need_a_restart(write_config):
+    diff = diff_configs(load_config(write_config()), load_config(write_config(something_new=1)))
+    assert diff.restart == ["something_new"]
+
+
+def test_queue_size_restarts_with_encoder_process(write_config):
+    old = load_config(write_config(encoder_process=True))
+    new = load_config(write_config(encoder_process=True, queue_size=30))
+    assert "queue_size" in diff_configs(old, new).restart
+    assert "queue_size" in PIPELINE_LIVE_KEYS
@@ -0,0 +1,56 @@
+import queue
+import threading
+
+from control import ControlServer, send_command
+
+
+def serve(server_commands, stop):
+    # stands in for the main loop of main_deploy
+    while not stop.is_set():
+        try:
+            command, args, replies = server_commands.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        replies.put({"ok": True, "command": command, "args": args})
+
+
+def test_command_round_trip(tmp_path):
+    path = str(tmp_path / "control.sock")
+    commands = queue.Queue()
+    control = ControlServer(commands, path=path)
+    control.start()
+    stop = threading.Event()
+    loop = threading.Thread(target=serve, args=(commands, stop), daemon=True)
+    loop.start()
+    try:
+        assert send_command("status", path=path) == {"ok": True, "command": "status", "args": ""}
+        assert send_command("add stream_3 rtsp://cam3\n", path=path) == \
+            {"ok": True, "command": "add", "args": "stream_3 rtsp://cam3"}
+        reply = send_command("explode", path=path)
+        assert not reply["ok"] and "unknown command" in reply["error"]
+    finally:
+        stop.set()
+        loop.join()
+        control.stop()
+
+
+def test_unanswered_command_times_out(tmp_path):
+    path = str(tmp_path / "control.sock")
+    commands = queue.Queue()
+    control = ControlServer(commands, path=path, reply_timeout=0.1)
+    control.start()
+    try:
+        assert send_command("stop", path=path) == {"ok": False, "error": "timed out waiting for 'stop'"}
+        assert commands.get_nowait()[:2] == ("stop", "")
+    finally:
+        control.stop()
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = tmp_path / "control.sock"
+    path.write_text("")
+    control = ControlServer(queue.Queue(), path=str(path))
+    control.start()
+    assert send_command("foo", path=str(path))["error"] == "unknown command 'foo'"
+    control.stop()
+    assert not path.exists()
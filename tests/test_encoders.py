@@ -0,0 +1,58 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from encoders import JpegEncoder, NpyEncoder, PngEncoder, WebpEncoder, make_encoder
+
+
+def frame():
+    # RGBA gradient with a red square, to see the channel order
+    rgba = np.zeros((32, 48, 4), dtype=np.uint8)
+    rgba[..., 1] = np.linspace(0, 255, 48, dtype=np.uint8)
+    rgba[8:16, 8:16] = (255, 0, 0, 255)
+    return rgba
+
+
+def test_format_selects_the_encoder():
+    assert isinstance(make_encoder(), JpegEncoder)
+    assert make_encoder().params == [cv2.IMWRITE_JPEG_QUALITY, 95]
+    for spec, cls, extension in (({"format": "jpeg"}, JpegEncoder, ".jpg"), ({"format": "png"}, PngEncoder, ".png"),
+                                 ({"format": "webp"}, WebpEncoder, ".webp"), ({"format": "npy"}, NpyEncoder, ".npy")):
+        encoder = make_encoder(spec)
+        assert type(encoder) is cls and encoder.extension == extension
+
+
+def test_quality_and_compression_are_passed_on():
+    assert make_encoder({"format": "jpeg", "quality": 70}).params == [cv2.IMWRITE_JPEG_QUALITY, 70]
+    assert make_encoder({"format": "png", "compression": 1}).params == [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    assert make_encoder({"format": "webp", "quality": 75}).params == [cv2.IMWRITE_WEBP_QUALITY, 75]
+    low = len(make_encoder({"format": "jpeg", "quality": 20}).encode(frame()))
+    high = len(make_encoder({"format": "jpeg", "quality": 95}).encode(frame()))
+    assert low < high
+
+
+def test_unknown_format_or_option_is_refused():
+    with pytest.raises(ValueError):
+        make_encoder({"format": "gif"})
+    with pytest.raises(ValueError):
+        make_encoder({"format": "png", "quality": 90})
+    with pytest.raises(ValueError):
+        make_encoder({"format": "npy", "compression": 1})
+
+
+def test_images_are_written_as_bgr(tmp_path):
+    path = str(tmp_path / "frame.png")
+    assert make_encoder({"format": "png"}).write(path, frame())
+    assert tuple(cv2.imread(path)[10, 10]) == (0, 0, 255)
+    decoded = cv2.imdecode(np.frombuffer(make_encoder({"format": "png"}).encode(frame()), np.uint8), cv2.IMREAD_COLOR)
+    assert (decoded == cv2.imread(path)).all()
+
+
+def test_npy_keeps_the_raw_rgba_frame(tmp_path):
+    path = str(tmp_path / "frame.npy")
+    assert make_encoder({"format": "npy"}).write(path, frame())
+    assert os.path.exists(path)
+    assert (np.load(path) == frame()).all()
+    assert make_encoder({"format": "npy"}).encode(frame()) == frame().tobytes()
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+from engine_cache import EngineCache, engine_name, read_pgie_config
+
+
+PGIE_CONFIG = """[property]
+gpu-id=0
+net-scale-factor=0.0039215697906911373
+tlt-encoded-model=models/resnet18.etlt
+labelfile-path=labels.txt
+int8-calib-file=/opt/models/cal.bin
+batch-size=1
+network-mode=2
+num-detected-classes=4
+
+[class-attrs-all]
+pre-cluster-threshold=0.2
+"""
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+    return path
+
+
+@pytest.fixture
+def pgie(tmp_path):
+    path = tmp_path / "config" / "pgie.txt"
+    path.parent.mkdir()
+    path.write_text(PGIE_CONFIG)
+    return str(path)
+
+
+def test_engine_name_matches_nvinfer():
+    assert engine_name("models/resnet18.etlt", 4, 0, 2) == "resnet18.etlt_b4_gpu0_fp16.engine"
+
+
+def test_select_exact_batch(tmp_path):
+    cache = EngineCache(str(tmp_path))
+    for batch in (1, 4, 8):
+        touch(str(tmp_path / engine_name("resnet18.etlt", batch, 0, 2)))
+    assert cache.select("resnet18.etlt", 4, 0, 2) == str(tmp_path / engine_name("resnet18.etlt", 4, 0, 2))
+
+
+def test_select_smallest_larger_batch(tmp_path):
+    cache = EngineCache(str(tmp_path))
+    for batch in (2, 8, 16):
+        touch(str(tmp_path / engine_name("resnet18.etlt", batch, 0, 2)))
+    assert cache.select("resnet18.etlt", 3, 0, 2) == str(tmp_path / engine_name("resnet18.etlt", 8, 0, 2))
+    assert cache.select("resnet18.etlt", 17, 0, 2) is None
+
+
+def test_select_ignores_other_models_gpus_and_precisions(tmp_path):
+    cache = EngineCache(str(tmp_path))
+    touch(str(tmp_path / engine_name("other.etlt", 4, 0, 2)))
+    touch(str(tmp_path / engine_name("resnet18.etlt", 4, 1, 2)))
+    touch(str(tmp_path / engine_name("resnet18.etlt", 4, 0, 1)))
+    touch(str(tmp_path / "resnet18.etlt_b4_gpu0_fp16.engine.tmp"))
+    assert cache.select("resnet18.etlt", 4, 0, 2) is None
+
+
+def test_select_searches_model_directory(tmp_path):
+    cache = EngineCache(str(tmp_path / "engines"))
+    models = tmp_path / "models"
+    touch(str(models / engine_name("resnet18.etlt", 4, 0, 2)))
+    assert cache.select("resnet18.etlt", 4, 0, 2) is None
+    assert cache.select("resnet18.etlt", 4, 0, 2, search=(str(models),)) == \
+        str(models / engine_name("resnet18.etlt", 4, 0, 2))
+
+
+def test_run_config_uses_cached_engine(tmp_path, pgie):
+    cache = EngineCache(str(tmp_path / "engines"))
+    engine = touch(str(tmp_path / "engines" / engine_name("resnet18.etlt", 8, 0, 2)))
+    prop = read_pgie_config(cache.run_config(pgie, 6))["property"]
+    assert prop["model-engine-file"] == os.path.abspath(engine)
+    assert prop["batch-size"] == "6"
+
+
+def test_run_config_points_at_build_name_without_engine(tmp_path, pgie):
+    cache = EngineCache(str(tmp_path / "engines"))
+    path = cache.run_config(pgie, 4)
+    assert os.path.dirname(path) == str(tmp_path / "engines")
+    prop = read_pgie_config(path)["property"]
+    models = tmp_path / "config" / "models"
+    assert prop["model-engine-file"] == str(models / "resnet18.etlt_b4_gpu0_fp16.engine")
+    assert prop["batch-size"] == "4"
+
+
+def test_run_config_makes_relative_paths_absolute(tmp_path, pgie):
+    cache = EngineCache(str(tmp_path / "engines"))
+    parser = read_pgie_config(cache.run_config(pgie, 1))
+    prop = parser["property"]
+    assert prop["tlt-encoded-model"] == str(tmp_path / "config" / "models" / "resnet18.etlt")
+    assert prop["labelfile-path"] == str(tmp_path / "config" / "labels.txt")
+    assert prop["int8-calib-file"] == "/opt/models/cal.bin"
+    #everything else is copied as is
+    assert prop["net-scale-factor"] == "0.0039215697906911373"
+    assert parser["class-attrs-all"]["pre-cluster-threshold"] == "0.2"
+
+
+def test_collect_moves_built_engines_into_cache(tmp_path, pgie):
+    cache = EngineCache(str(tmp_path / "engines"))
+    built = touch(str(tmp_path / "config" / "models" / engine_name("resnet18.etlt", 2, 0, 2)))
+    moved = cache.collect(pgie)
+    assert moved == [str(tmp_path / "engines" / os.path.basename(built))]
+    assert not os.path.exists(built)
+    assert cache.select("resnet18.etlt", 2, 0, 2) == moved[0]
@@ -0,0 +1,81 @@
+import json
+import socket
+import threading
+import time
+
+from event_stream import EVENT_FIELDS, EventPublisher, encode_batch, read_events
+
+
+EVENT = (1, 42, 7, 2, 0.87654, 100.25, 200.5, 64.0, 128.0)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_encode_batch_is_one_json_line():
+    data = encode_batch(12.5, [EVENT])
+    assert data.endswith(b"\n") and data.count(b"\n") == 1
+    batch = json.loads(data.decode("utf-8"))
+    assert batch["time"] == 12.5
+    assert dict(zip(EVENT_FIELDS, batch["events"][0]))["confidence"] == 0.877
+
+
+def test_consumer_receives_published_batches(tmp_path):
+    path = str(tmp_path / "events.sock")
+    publisher = EventPublisher(path)
+    publisher.start()
+    received = []
+    consumer = threading.Thread(target=lambda: received.extend(read_events(path, timeout=5)))
+    consumer.start()
+    wait_for(publisher.active)
+    for k in range(10):
+        publisher.publish(float(k), [EVENT])
+    publisher.stop()
+    consumer.join()
+    assert [timestamp for timestamp, _ in received] == [float(k) for k in range(10)]
+    assert received[0][1][0]["track"] == 7
+    assert publisher.stats()["sent"] == 10
+
+
+def test_nothing_is_collected_without_consumers(tmp_path):
+    publisher = EventPublisher(str(tmp_path / "events.sock"))
+    publisher.start()
+    assert not publisher.active()
+    publisher.stop()
+
+
+def test_full_queue_drops_batches(tmp_path):
+    publisher = EventPublisher(str(tmp_path / "events.sock"), queue_size=2)
+    #not started, nothing takes batches off the queue
+    assert publisher.publish(0.0, [EVENT]) and publisher.publish(1.0, [EVENT])
+    assert not publisher.publish(2.0, [EVENT])
+    assert publisher.stats()["dropped"] == 1
+
+
+def test_unread_batches_count_as_dropped_on_stop(tmp_path):
+    path = str(tmp_path / "events.sock")
+    publisher = EventPublisher(path, queue_size=1000, stop_timeout=0.2)
+    publisher.start()
+    #a consumer that never reads
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(path)
+    wait_for(publisher.active)
+    events = [EVENT] * 200
+    for k in range(500):
+        publisher.publish(float(k), events)
+    publisher.stop()
+    data = b""
+    while True:
+        chunk = sock.recv(1 << 20)
+        if not chunk:
+            break
+        data += chunk
+    sock.close()
+    stats = publisher.stats()
+    assert stats["subscriber_dropped"] > 0
+    assert data.count(b"\n") + stats["subscriber_dropped"] + stats["dropped"] == 500
@@ -0,0 +1,68 @@
+import os
+import signal
+
+import cv2
+import numpy as np
+
+from config_loader import with_defaults
+from frame_ring import FrameRing, RingWriter, encoder_main
+from image_writer import ObjectInfo, SaveRecord
+
+
+def frame(value, height=8, width=12):
+    return np.full((height, width, 4), value, dtype=np.uint8)
+
+
+def test_acquire_and_release_track_occupancy():
+    ring = FrameRing(3, 8, 12, policy="wait", wait=1)
+    slots = [ring.acquire(), ring.acquire()]
+    assert sorted(slots) == sorted(set(slots))
+    stats = ring.stats()
+    assert (stats["in_use"], stats["occupancy"], stats["high_water"], stats["acquired"]) == (2, 2.0 / 3, 2, 2)
+    ring.release(slots[0])
+    stats = ring.stats()
+    assert (stats["in_use"], stats["high_water"], stats["released"], stats["dropped"]) == (1, 2, 1, 0)
+
+
+def test_full_ring_drops_and_counts():
+    ring = FrameRing(2, 8, 12, policy="wait", wait=1)
+    writer = RingWriter(ring)
+    assert writer.submit(SaveRecord("negative", 0, 0.0, frame(1), []))
+    assert writer.submit(SaveRecord("negative", 0, 1.0, frame(2), []))
+    ring.policy = "drop_newest"
+    assert not writer.submit(SaveRecord("negative", 0, 2.0, frame(3), []))
+    ring.policy, ring.wait = "wait", 0.01
+    assert not writer.submit(SaveRecord("negative", 0, 3.0, frame(4), []))
+    stats = writer.stats()
+    assert (stats["in_use"], stats["occupancy"], stats["dropped"]) == (2, 1.0, 2)
+
+
+def test_frame_that_does_not_fit_is_refused():
+    ring = FrameRing(1, 8, 12, policy="wait", wait=1)
+    assert not RingWriter(ring).submit(SaveRecord("negative", 0, 0.0, frame(1, 16, 12), []))
+    assert ring.stats()["acquired"] == 0
+
+
+def test_encoder_drains_the_ring_to_files(tmp_path):
+    positive, negative = str(tmp_path / "positive"), str(tmp_path / "negative")
+    config = with_defaults({"source_type": "rtsp", "source": {"stream_0": "rtsp://cam0"}, "writer_workers": 2,
+                            "positive_encoder": {"format": "png"}, "negative_encoder": {"format": "png"}})
+    ring = FrameRing(4, 8, 12, policy="wait", wait=1)
+    writer = RingWriter(ring)
+    obj = ObjectInfo(1, 0, 0.9, 2.0, 2.0, 4.0, 4.0)
+    #smaller than a slot, only its part of the slot is written
+    assert writer.submit(SaveRecord(positive, 0, 0.0, frame(10, 6, 10), [obj]))
+    assert writer.submit(SaveRecord(negative, 0, 1.0, frame(20), []))
+    assert writer.submit(SaveRecord(negative, 0, 2.0, frame(30), []))
+    writer.stop()
+    handler = signal.getsignal(signal.SIGTERM)
+    try:
+        encoder_main(ring, config)
+    finally:
+        signal.signal(signal.SIGTERM, handler)
+    names = sorted(os.listdir(os.path.join(positive, "stream_0")))
+    assert names[0].startswith("detections_")
+    assert cv2.imread(os.path.join(positive, "stream_0", names[1])).shape == (6, 10, 3)
+    assert len(os.listdir(os.path.join(negative, "stream_0"))) == 2
+    stats = ring.stats()
+    assert (stats["in_use"], stats["acquired"], stats["released"]) == (0, 3, 3)
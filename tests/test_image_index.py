@@ -0,0 +1,56 @@
+import os
+
+from image_index import ImageIndex, image_rows, query
+from image_writer import ObjectInfo, SaveRecord
+from retention import RetentionManager
+
+
+def record(stream, timestamp, objects, category="positive"):
+    return SaveRecord(category, stream, timestamp, None, objects)
+
+
+def test_rows_per_object():
+    objects = [ObjectInfo(3, 1, 0.9, 1.0, 2.0, 3.0, 4.0), ObjectInfo(2 ** 64 - 1, 2, 0.5, 0.0, 0.0, 1.0, 1.0)]
+    rows = image_rows(record(0, 10.0, objects), "a.jpg", objects)
+    assert rows[0] == (10.0, 0, "positive", "a.jpg", 3, 1, 0.9, 1.0, 2.0, 3.0, 4.0)
+    #untracked objects have no track id
+    assert rows[1][4] is None
+    assert image_rows(record(0, 10.0, [], "negative"), "b.jpg", []) == \
+        [(10.0, 0, "negative", "b.jpg", None, None, None, None, None, None, None)]
+
+
+def test_batched_insert_and_query(tmp_path):
+    db = str(tmp_path / "images.db")
+    index = ImageIndex(db, batch_size=4, flush_interval=0.05)
+    index.start()
+    for i in range(10):
+        obj = ObjectInfo(i, i % 2, 0.9, 0.0, 0.0, 1.0, 1.0)
+        index.add(image_rows(record(i % 3, float(i), [obj]), "img_%d.jpg" % i, [obj]))
+    index.add(image_rows(record(0, 20.0, [], "negative"), "neg.jpg", []))
+    index.stop()
+    assert index.stats() == {"inserted": 11, "removed": 0, "dropped": 0, "pending": 0}
+    assert [row["path"] for row in query(db, stream=0, category="positive")] == ["img_0.jpg", "img_3.jpg",
+                                                                                 "img_6.jpg", "img_9.jpg"]
+    assert [row["track_id"] for row in query(db, class_id=1, start=3, end=8)] == [3, 5, 7]
+    assert [row["path"] for row in query(db, category="negative")] == ["neg.jpg"]
+    assert len(query(db, limit=2)) == 2
+
+
+def test_retention_removes_deleted_images(tmp_path):
+    db = str(tmp_path / "images.db")
+    category = str(tmp_path / "positive")
+    os.makedirs(os.path.join(category, "stream_0"))
+    index = ImageIndex(db, flush_interval=0.05)
+    retention = RetentionManager(categories=(category,), max_bytes=2, on_delete=index.remove)
+    index.start()
+    obj = ObjectInfo(1, 0, 0.9, 0.0, 0.0, 1.0, 1.0)
+    for i in range(4):
+        path = os.path.join(category, "stream_0", "img_%d.jpg" % i)
+        with open(path, "wb") as f:
+            f.write(b"x")
+        retention.add(category, 0, path, 1, float(i))
+        index.add(image_rows(record(0, float(i), [obj]), path, [obj]))
+    retention.enforce(now=10)
+    index.stop()
+    assert index.removed == 2
+    assert [os.path.basename(row["path"]) for row in query(db)] == ["img_2.jpg", "img_3.jpg"]
@@ -0,0 +1,147 @@
+import os
+import json
+
+import cv2
+import numpy as np
+
+from encoders import make_encoder
+from image_writer import ImageWriter, ObjectInfo, SaveRecord, crop_object
+from retention import RetentionManager
+
+
+def record(stream=0, timestamp=0.0):
+    return SaveRecord("negative", stream, timestamp, np.zeros((4, 4, 4), dtype=np.uint8), [])
+
+
+def test_drop_oldest_queues_every_record():
+    #no worker threads, the queue only fills up
+    writer = ImageWriter(queue_size=2, policy="drop_oldest")
+    assert [writer.submit(record(timestamp=i)) for i in range(5)] == [True] * 5
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["dropped"], stats["pending"]) == (5, 3, 2)
+    #the newest records are the ones left
+    assert [r.timestamp for r in writer._queue] == [3, 4]
+
+
+def test_drop_newest_refuses_records_once_full():
+    writer = ImageWriter(queue_size=2, policy="drop_newest")
+    assert [writer.submit(record(timestamp=i)) for i in range(5)] == [True, True, False, False, False]
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["dropped"], stats["pending"]) == (2, 3, 2)
+    assert [r.timestamp for r in writer._queue] == [0, 1]
+
+
+def test_stop_drains_the_queue(tmp_path):
+    category = str(tmp_path / "negative")
+    writer = ImageWriter(workers=2, queue_size=8, encoders={category: make_encoder({"format": "npy"})})
+    for i in range(6):
+        #queued before the workers run, stop() still writes all of them
+        assert writer.submit(SaveRecord(category, 0, float(i), np.full((4, 4, 4), i, dtype=np.uint8), []))
+    writer.start()
+    writer.stop()
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["written"], stats["failed"], stats["pending"]) == (6, 6, 0, 0)
+    assert len(os.listdir(os.path.join(category, "stream_0"))) == 6
+
+
+def test_stop_without_drain_counts_the_queue_as_dropped():
+    writer = ImageWriter(queue_size=8)
+    for i in range(3):
+        writer.submit(record(timestamp=i))
+    writer.stop(drain=False)
+    stats = writer.stats()
+    assert (stats["written"], stats["dropped"], stats["pending"]) == (0, 3, 0)
+
+
+def test_submit_copies_the_frame():
+    writer = ImageWriter()
+    frame = np.zeros((4, 4, 4), dtype=np.uint8)
+    writer.submit(SaveRecord("negative", 0, 0.0, frame, []))
+    frame[:] = 255
+    assert not writer._queue[0].frame.any()
+
+
+def test_failed_write_is_counted(tmp_path):
+    #the category directory cannot be created below a file
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    writer = ImageWriter()
+    assert not writer.write(SaveRecord(str(blocker), 0, 0.0, np.zeros((4, 4, 4), dtype=np.uint8), []))
+    assert (writer.written, writer.failed) == (0, 1)
+
+
+def positive(directory, stream, timestamp):
+    obj = ObjectInfo(1, 0, 0.9, 1.0, 1.0, 2.0, 2.0)
+    return SaveRecord(directory, stream, timestamp, np.zeros((4, 4, 4), dtype=np.uint8), [obj])
+
+
+def test_sidecar_rotates_hourly_and_retention_removes_it(tmp_path):
+    category = str(tmp_path / "positive")
+    retention = RetentionManager(categories=(category,), max_age=3600)
+    writer = ImageWriter(encoders={category: make_encoder({"format": "png"})}, layout="hour", retention=retention)
+    start = 1600000000.0 - 1600000000.0 % 3600
+    times = [start + 60, start + 120, start + 3600 + 60, start + 7200 + 60, start + 7200 + 120]
+    for timestamp in times:
+        assert writer.write(positive(category, 0, timestamp))
+    writer.sidecar.close()
+    stream_dir = os.path.join(category, "stream_0")
+    sidecars = sorted(os.path.join(root, name) for root, _, names in os.walk(stream_dir)
+                      for name in names if name.endswith(".jsonl"))
+    assert len(sidecars) == 3
+    with open(sidecars[0]) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["timestamp"] for line in lines] == times[:2]
+    assert os.path.exists(os.path.join(os.path.dirname(sidecars[0]), lines[0]["image"]))
+
+    #the first hour is too old: its images, its sidecar and its directory go
+    retention.enforce(now=start + 3600 + 150)
+    assert not os.path.exists(os.path.dirname(sidecars[0]))
+    assert os.path.exists(sidecars[1])
+    retention.enforce(now=times[-1] + 3601)
+    assert os.listdir(stream_dir) == []
+    assert retention.usage() == {"%s/stream_0" % category: {"files": 0, "bytes": 0}}
+
+
+def test_crop_object_pads_and_clips():
+    frame = np.arange(10 * 20 * 4, dtype=np.uint32).reshape(10, 20, 4)
+    obj = ObjectInfo(1, 0, 0.9, 4.0, 2.0, 6.0, 4.0)
+    assert crop_object(frame, obj).shape == (4, 6, 4)
+    assert (crop_object(frame, obj) == frame[2:6, 4:10]).all()
+    #half the bbox size on every side, clipped to the frame
+    assert (crop_object(frame, obj, 0.5) == frame[0:8, 1:13]).all()
+    assert crop_object(frame, ObjectInfo(1, 0, 0.9, 25.0, 2.0, 6.0, 4.0)) is None
+
+
+def test_crop_mode_writes_one_image_per_object_and_the_sidecar(tmp_path):
+    category = str(tmp_path / "positive")
+    writer = ImageWriter(save_mode="both", encoders={category: make_encoder({"format": "png"})})
+    objects = [ObjectInfo(7, 2, 0.8, 0.0, 0.0, 2.0, 2.0), ObjectInfo(9, 1, 0.7, 2.0, 1.0, 3.0, 3.0)]
+    frame = np.zeros((8, 8, 4), dtype=np.uint8)
+    assert writer.write(SaveRecord(category, 3, 1600000000.0, frame, objects))
+    writer.sidecar.close()
+    stream_dir = os.path.join(category, "stream_3")
+    names = sorted(os.listdir(stream_dir))
+    images = [name for name in names if name.endswith(".png")]
+    assert len(images) == 3
+    assert any(name.endswith("_id7.png") for name in images) and any(name.endswith("_id9.png") for name in images)
+    assert cv2.imread(os.path.join(stream_dir, [n for n in images if n.endswith("_id9.png")][0])).shape == (3, 3, 3)
+
+    sidecar = [name for name in names if name.endswith(".jsonl")]
+    assert len(sidecar) == 1
+    with open(os.path.join(stream_dir, sidecar[0])) as f:
+        lines = [json.loads(line) for line in f]
+    #the full frame lists every object, each crop its own
+    assert sorted(len(line["objects"]) for line in lines) == [1, 1, 2]
+    full = [line for line in lines if len(line["objects"]) == 2][0]
+    assert full["stream"] == 3 and full["timestamp"] == 1600000000.0
+    assert [obj["object_id"] for obj in full["objects"]] == [7, 9]
+    assert all(os.path.exists(os.path.join(stream_dir, line["image"])) for line in lines)
+
+
+def test_negative_images_are_never_cropped_or_listed(tmp_path):
+    category = str(tmp_path / "negative")
+    writer = ImageWriter(save_mode="crop", encoders={category: make_encoder({"format": "png"})})
+    assert writer.write(SaveRecord(category, 0, 0.0, np.zeros((4, 4, 4), dtype=np.uint8), []))
+    writer.sidecar.close()
+    names = os.listdir(os.path.join(category, "stream_0"))
+    assert len(names) == 1 and names[0].endswith(".png")
@@ -0,0 +1,63 @@
+from interval_controller import IntervalController, replay
+
+
+def run_period(controller, now, busy, idle, batches=10):
+    # busy and idle frames of stream 0, then one tick at now
+    for _ in range(batches):
+        controller.batch()
+    for _ in range(busy):
+        controller.observe(0, 3, now)
+    for _ in range(idle):
+        controller.observe(0, 0, now)
+    controller.tick(now)
+
+
+def test_busy_scene_drops_to_min_interval():
+    changes = []
+    controller = IntervalController(interval=5, min_interval=1, apply=changes.append)
+    controller.tick(0)
+    run_period(controller, 5, busy=5, idle=5)
+    assert controller.interval == 1
+    assert changes == [1]
+
+
+def test_idle_scene_steps_up_after_hold_periods():
+    controller = IntervalController(interval=0, max_interval=2, hold=2)
+    controller.tick(0)
+    for k in range(1, 7):
+        run_period(controller, 5 * k, busy=0, idle=10)
+    assert controller.interval == 2
+    assert controller.changes == 2
+
+
+def test_busiest_stream_decides():
+    controller = IntervalController(interval=4, min_interval=0)
+    controller.tick(0)
+    for _ in range(10):
+        controller.observe(0, 0, 1)
+    controller.observe(1, 2, 1)
+    controller.observe(1, 0, 1)
+    controller.tick(5)
+    assert controller.interval == 0
+
+
+def test_below_target_fps_raises_interval():
+    controller = IntervalController(interval=0, max_interval=3, target_fps=30)
+    controller.tick(0)
+    run_period(controller, 5, busy=10, idle=0, batches=50)
+    assert controller.interval == 1
+
+
+def test_counts_after_a_tick_go_to_the_next_period():
+    controller = IntervalController(interval=0, max_interval=5, hold=1)
+    controller.tick(0)
+    run_period(controller, 5, busy=0, idle=10)
+    assert controller._frames == {} and controller._batches == 0
+    controller.observe(0, 0, 6)
+    assert controller._frames == {0: 1}
+
+
+def test_replay_share_of_inferred_frames():
+    controller = IntervalController(interval=1, period=5)
+    records = [(t * 0.1, 0, 0) for t in range(10)]
+    assert replay(records, controller) == 0.5
@@ -0,0 +1,42 @@
+from latency_tracer import BUCKETS, LatencyTracer, RollingHistogram
+
+
+def test_histogram_buckets_and_percentiles():
+    histogram = RollingHistogram(window=4)
+    for value in (0.0004, 0.001, 0.003, 0.02, 10.0):
+        histogram.observe(value)
+    snap = histogram.snapshot()
+    assert snap["count"] == 5 and abs(snap["sum"] - 10.0244) < 1e-9
+    #a value on a bucket bound belongs to that bucket, above the last one to +Inf
+    assert snap["buckets"][:5] == [1, 1, 0, 1, 0]
+    assert snap["buckets"][BUCKETS.index(0.025)] == 1
+    assert snap["buckets"][-1] == 1 and len(snap["buckets"]) == len(BUCKETS) + 1
+    #percentiles only over the last window values
+    assert (snap["p50"], snap["max"]) == (0.003, 10.0)
+    assert "p50" not in RollingHistogram().snapshot()
+
+
+def test_prometheus_text():
+    tracer = LatencyTracer(window=10)
+    for value in (0.002, 0.004, 0.3):
+        tracer.end_to_end.observe(value)
+    tracer.streams[1] = RollingHistogram(10)
+    tracer.streams[1].observe(0.05)
+    tracer.add_provider("writer", lambda: {"written": 3, "retention": {"deleted": 1}, "policy": "drop_oldest"})
+    lines = tracer.prometheus().splitlines()
+
+    assert "# TYPE deepstream_end_to_end_latency_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith("deepstream_end_to_end_latency_seconds_bucket")]
+    assert len(buckets) == len(BUCKETS) + 1
+    #cumulative counts up to +Inf
+    assert 'deepstream_end_to_end_latency_seconds_bucket{le="0.001"} 0' in buckets
+    assert 'deepstream_end_to_end_latency_seconds_bucket{le="0.005"} 2' in buckets
+    assert 'deepstream_end_to_end_latency_seconds_bucket{le="+Inf"} 3' in buckets
+    assert "deepstream_end_to_end_latency_seconds_count 3" in lines
+    assert "deepstream_end_to_end_latency_seconds_sum 0.306000" in lines
+    assert 'deepstream_end_to_end_latency_seconds_recent{quantile="0.5"} 0.004000' in lines
+    assert 'deepstream_stream_latency_seconds_bucket{stream="1",le="0.05"} 1' in lines
+    #numbers of the providers, nested dicts flattened
+    assert "deepstream_writer_written 3" in lines
+    assert "deepstream_writer_retention_deleted 1" in lines
+    assert not any("policy" in line for line in lines)
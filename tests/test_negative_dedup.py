@@ -0,0 +1,47 @@
+import numpy as np
+
+from negative_dedup import NegativeDedup, dhash, hamming
+
+
+def scene(seed, height=360, width=640):
+    # smooth random RGBA frame, a stand-in for a camera image
+    rng = np.random.RandomState(seed)
+    small = rng.randint(0, 256, (9, 16, 4)).astype(np.uint8)
+    return np.ascontiguousarray(np.repeat(np.repeat(small, height // 9 + 1, 0)[:height], width // 16, 1))
+
+
+def test_hash_ignores_noise_and_sees_scene_changes():
+    frame = scene(1)
+    noisy = np.clip(frame.astype(np.int16) + np.random.RandomState(2).randint(-6, 7, frame.shape), 0, 255)
+    assert hamming(dhash(frame), dhash(noisy.astype(np.uint8))) <= 3
+    assert hamming(dhash(frame), dhash(scene(3))) > 10
+
+
+def test_threshold_zero_saves_everything():
+    dedup = NegativeDedup(threshold=0)
+    assert dedup.should_save(0, scene(1), 0) == (True, None)
+
+
+def test_repeated_scene_is_skipped():
+    dedup = NegativeDedup(threshold=5)
+    save, frame_hash = dedup.should_save(0, scene(1), 0)
+    assert save
+    dedup.mark_saved(0, frame_hash, 0)
+    assert not dedup.should_save(0, scene(1), 10)[0]
+    assert dedup.should_save(0, scene(4), 20)[0]
+    #streams are compared with their own last image only
+    assert dedup.should_save(1, scene(1), 30)[0]
+
+
+def test_unsaved_frame_is_not_the_reference():
+    dedup = NegativeDedup(threshold=5)
+    dedup.should_save(0, scene(1), 0)
+    #never marked saved, e.g. refused by the writer
+    assert dedup.should_save(0, scene(1), 10)[0]
+
+
+def test_max_interval_forces_a_save():
+    dedup = NegativeDedup(threshold=5, max_interval=60)
+    dedup.mark_saved(0, dedup.should_save(0, scene(1), 0)[1], 0)
+    assert not dedup.should_save(0, scene(1), 59)[0]
+    assert dedup.should_save(0, scene(1), 60)[0]
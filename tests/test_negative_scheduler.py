@@ -0,0 +1,28 @@
+from negative_scheduler import NegativeScheduler
+
+
+def test_deadlines_are_staggered():
+    scheduler = NegativeScheduler([0, 1, 2, 3], 8, now=100)
+    assert [scheduler.deadline(s) for s in range(4)] == [108, 110, 112, 114]
+
+
+def test_due_and_mark_saved():
+    scheduler = NegativeScheduler([0], 10, now=0)
+    assert not scheduler.due(0, 9)
+    assert scheduler.due(0, 10)
+    scheduler.mark_saved(0, 10)
+    assert scheduler.deadline(0) == 20
+
+
+def test_jitter_stays_in_range():
+    scheduler = NegativeScheduler([0], 10, jitter=2, now=0)
+    for _ in range(50):
+        scheduler.mark_saved(0, 100)
+        assert 108 <= scheduler.deadline(0) <= 112
+
+
+def test_unknown_and_removed_streams_are_never_due():
+    scheduler = NegativeScheduler([0], 1, now=0)
+    scheduler.remove_stream(0)
+    assert not scheduler.due(0, 1e9)
+    assert not scheduler.due(5, 1e9)
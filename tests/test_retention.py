@@ -0,0 +1,81 @@
+import os
+
+from retention import RetentionManager, bucket_dir
+
+
+def make_files(directory, count, size=100, start=1000.0):
+    # count files of size bytes, one per second from start, oldest first
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(count):
+        path = os.path.join(directory, "img_%03d.jpg" % i)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        os.utime(path, (start + i, start + i))
+        files.append((start + i, path, size))
+    return files
+
+
+def test_oldest_files_go_first_in_batches(tmp_path):
+    category = str(tmp_path / "positive")
+    deleted = []
+    retention = RetentionManager(categories=(category,), max_bytes=500, batch_size=2, on_delete=deleted.append)
+    files = make_files(os.path.join(category, "stream_0"), 10)
+    for timestamp, path, size in files:
+        retention.add(category, 0, path, size, timestamp)
+    retention.enforce(now=2000)
+    assert deleted == [[files[0][1], files[1][1]], [files[2][1], files[3][1]], [files[4][1]]]
+    assert sorted(os.listdir(os.path.join(category, "stream_0"))) == ["img_%03d.jpg" % i for i in range(5, 10)]
+    assert retention.usage() == {"%s/stream_0" % category: {"files": 5, "bytes": 500}}
+    assert retention.stats()["deleted"] == 5 and retention.stats()["deleted_bytes"] == 500
+
+
+def test_byte_caps_per_category(tmp_path):
+    positive, negative = str(tmp_path / "positive"), str(tmp_path / "negative")
+    retention = RetentionManager(categories=(positive, negative), max_bytes={positive: 300, negative: 0})
+    for category in (positive, negative):
+        for stream in (0, 1):
+            for timestamp, path, size in make_files(os.path.join(category, "stream_%d" % stream), 5):
+                retention.add(category, stream, path, size, timestamp)
+    assert retention.enabled()
+    retention.enforce(now=2000)
+    usage = retention.usage()
+    #the cap holds for every stream directory of the category
+    assert usage["%s/stream_0" % positive] == {"files": 3, "bytes": 300}
+    assert usage["%s/stream_1" % positive] == {"files": 3, "bytes": 300}
+    assert usage["%s/stream_0" % negative] == {"files": 5, "bytes": 500}
+
+
+def test_max_age_removes_old_files_and_empty_buckets(tmp_path):
+    category = str(tmp_path / "negative")
+    stream_dir = os.path.join(category, "stream_0")
+    retention = RetentionManager(categories=(category,), max_age=3600)
+    old, new = 1600000000.0, 1600000000.0 + 2 * 86400
+    for timestamp in (old, new):
+        directory = bucket_dir(stream_dir, timestamp, "day")
+        for ts, path, size in make_files(directory, 2, start=timestamp):
+            retention.add(category, 0, path, size, ts)
+    retention.enforce(now=new + 60)
+    #the day directory of the old files is gone, the stream directory stays
+    assert os.listdir(stream_dir) == [os.path.basename(bucket_dir(stream_dir, new, "day"))]
+    assert retention.usage()["%s/stream_0" % category]["files"] == 2
+
+
+def test_start_up_scan_finds_existing_files(tmp_path):
+    category = str(tmp_path / "positive")
+    make_files(os.path.join(category, "stream_0"), 4)
+    make_files(os.path.join(category, "stream_1"), 2)
+    with open(os.path.join(category, "stream_0", "notes.txt"), "w") as f:
+        f.write("not an image")
+    retention = RetentionManager(categories=(category,), max_bytes=200, streams=[0])
+    retention._seed()
+    assert retention.usage() == {"%s/stream_0" % category: {"files": 4, "bytes": 400}}
+    retention.enforce(now=2000)
+    assert sorted(os.listdir(os.path.join(category, "stream_0"))) == ["img_002.jpg", "img_003.jpg", "notes.txt"]
+    #not one of its streams
+    assert len(os.listdir(os.path.join(category, "stream_1"))) == 2
+
+
+def test_disabled_without_limits():
+    assert not RetentionManager().enabled()
+    assert RetentionManager(max_age={"negative": 60}).enabled()
@@ -0,0 +1,41 @@
+from source_watchdog import SourceWatchdog
+
+
+def test_no_stall_before_first_buffer():
+    watchdog = SourceWatchdog([0, 1], stall_timeout=15)
+    assert watchdog.due(1e12) == []
+
+
+def test_start_arms_streams_without_buffers():
+    watchdog = SourceWatchdog([0, 1], stall_timeout=15)
+    watchdog.heartbeat(0, 100)
+    watchdog.start(110)
+    assert watchdog.due(120) == [0]
+    assert watchdog.due(130) == [0, 1]
+
+
+def test_added_stream_is_checked_from_its_first_buffer():
+    watchdog = SourceWatchdog([0], stall_timeout=15)
+    watchdog.start(0)
+    watchdog.heartbeat(0, 1000)
+    watchdog.add_stream(1)
+    assert watchdog.due(1010) == []
+    watchdog.heartbeat(1, 1010)
+    assert watchdog.due(1030) == [0, 1]
+
+
+def test_restart_backoff_doubles_and_resets():
+    watchdog = SourceWatchdog([0], stall_timeout=10, backoff=5, backoff_max=12)
+    watchdog.heartbeat(0, 0)
+    watchdog.restarted(0, 20)
+    assert watchdog.due(24) == []
+    assert watchdog.due(25) == [0]
+    watchdog.restarted(0, 25)
+    assert watchdog.due(34) == []
+    assert watchdog.due(35) == [0]
+    watchdog.restarted(0, 35)
+    #capped at backoff_max
+    assert watchdog.due(47) == [0]
+    watchdog.heartbeat(0, 50)
+    assert watchdog.recoveries[0] == 1 and watchdog.restarts[0] == 3
+    assert watchdog._backoff[0] == 5
@@ -0,0 +1,197 @@
+import queue
+
+from config_loader import with_defaults
+from supervisor import Supervisor, Worker, shard_sources
+
+
+class FakeEvent:
+
+    def __init__(self):
+        self.value = False
+
+    def is_set(self):
+        return self.value
+
+
+class FakeProcess:
+
+    def __init__(self, name):
+        self.name = name
+        self.pid = 1
+        self.exitcode = None
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+
+class FakeCommands:
+
+    # command queue of a shard process that answers every command at once
+    def __init__(self, results):
+        self.results = results
+        self.sent = []
+        self.answer = True
+
+    def put(self, item):
+        self.sent.append(item)
+        if self.answer:
+            self.results.put((item[0], {"ok": True}))
+
+
+class FakeLauncher:
+
+    # start/terminate pair for Supervisor, keeps the workers it started
+    def __init__(self):
+        self.workers = []
+        self.terminated = []
+
+    def start(self, config, index):
+        process = FakeProcess("deepstream-%d" % index)
+        results = queue.Queue()
+        worker = Worker([process], process, FakeEvent(), (FakeCommands(results), results), [0.0, 0.0])
+        self.workers.append(worker)
+        return worker
+
+    def terminate(self, processes):
+        self.terminated.extend(processes)
+
+
+def rtsp_config(streams, **extra):
+    config = {"source_type": "rtsp", "source": {"stream_%d" % s: "rtsp://cam%d" % s for s in streams},
+              "metrics_port": 9100, "event_socket": "check/events.sock"}
+    config.update(extra)
+    return with_defaults(config)
+
+
+def test_single_shard_without_limit():
+    shards = shard_sources(rtsp_config([0, 1, 2], max_sources=5))
+    assert len(shards) == 1
+    assert shards[0]["max_sources"] == 5
+    assert shards[0]["event_socket"] == "check/events.sock"
+
+
+def test_shards_keep_stream_numbers():
+    shards = shard_sources(rtsp_config([0, 2, 10, 3, 4]), 2)
+    assert [sorted(s["source"]) for s in shards] == [["stream_0", "stream_2"], ["stream_3", "stream_4"],
+                                                     ["stream_10"]]
+    assert [s["shard"] for s in shards] == [0, 1, 2]
+    assert [s["max_sources"] for s in shards] == [2, 2, 2]
+    assert [s["metrics_port"] for s in shards] == [9100, 9101, 9102]
+    assert [s["event_socket"] for s in shards] == ["check/events.sock", "check/events_1.sock",
+                                                   "check/events_2.sock"]
+
+
+def test_crash_loop_stops_restarting():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate, backoff=1, backoff_max=4, crash_loop_restarts=3,
+                            crash_loop_window=100)
+    supervisor.start(rtsp_config([0]))
+    shard = supervisor.shards[0]
+    now = 0
+    for failures in range(1, 4):
+        launcher.workers[-1].process.alive = False
+        supervisor.poll(now)
+        if failures < 3:
+            assert shard.state == "backoff"
+            now = shard.next_start
+            supervisor.poll(now)
+            assert shard.state == "starting"
+    assert shard.state == "crashloop"
+    assert supervisor.state() == "failed"
+    assert len(launcher.workers) == 3
+
+
+def test_backoff_doubles_and_resets_when_ready():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate, backoff=1, backoff_max=3, crash_loop_restarts=10)
+    supervisor.start(rtsp_config([0]))
+    shard = supervisor.shards[0]
+    delays = []
+    now = 0
+    for _ in range(3):
+        launcher.workers[-1].process.alive = False
+        supervisor.poll(now)
+        delays.append(shard.next_start - now)
+        now = shard.next_start
+        supervisor.poll(now)
+    assert delays == [1, 2, 3]
+    launcher.workers[-1].ready.value = True
+    supervisor.poll(now)
+    assert shard.state == "running"
+    assert shard._backoff == 1
+
+
+def running(supervisor, launcher):
+    for worker in launcher.workers:
+        worker.ready.value = True
+    supervisor.poll(0)
+
+
+def test_add_goes_to_shard_with_a_free_slot():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate, max_streams_per_shard=2)
+    supervisor.start(rtsp_config([0, 1, 2]))
+    running(supervisor, launcher)
+    reply = supervisor.source_command("add", 5, "rtsp://cam5")
+    assert reply == {"ok": True, "shard": 1}
+    assert launcher.workers[1].channel[0].sent == [(1, "add", (5, "rtsp://cam5"))]
+    assert "stream_5" in supervisor.shards[1].config["source"]
+    assert not supervisor.source_command("add", 6, "rtsp://cam6")["ok"]
+    assert supervisor.source_command("remove", 0)["shard"] == 0
+    assert "stream_0" not in supervisor.shards[0].config["source"]
+
+
+def test_starting_shard_refuses_commands():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate)
+    supervisor.start(rtsp_config([0]))
+    reply = supervisor.shards[0].command("add", (1, "rtsp://cam1"))
+    assert reply == {"ok": False, "error": "shard 0 is starting"}
+    assert not supervisor.source_command("add", 1, "rtsp://cam1")["ok"]
+    assert launcher.workers[0].channel[0].sent == []
+
+
+def test_late_reply_is_not_taken_for_the_next_one():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate)
+    supervisor.start(rtsp_config([0]))
+    running(supervisor, launcher)
+    shard = supervisor.shards[0]
+    commands, results = launcher.workers[0].channel
+    commands.answer = False
+    assert "timed out" in shard.command("add", (1, "rtsp://cam1"), timeout=0.01)["error"]
+    assert "stream_1" not in shard.config["source"]
+    #the add is answered after the timeout, before the reply to the remove
+    results.put((1, {"ok": True}))
+    commands.answer = True
+    assert supervisor.source_command("remove", 0) == {"ok": True, "shard": 0}
+    assert sorted(shard.config["source"]) == ["stream_1"]
+
+
+def test_late_reply_is_applied_by_poll():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate)
+    supervisor.start(rtsp_config([0]))
+    running(supervisor, launcher)
+    shard = supervisor.shards[0]
+    commands, results = launcher.workers[0].channel
+    commands.answer = False
+    shard.command("remove", (0,), timeout=0.01)
+    results.put((1, {"ok": True}))
+    supervisor.poll(0)
+    assert shard.config["source"] == {}
+    assert shard._unanswered == {}
+
+
+def test_config_restarts_starting_shards():
+    launcher = FakeLauncher()
+    supervisor = Supervisor(launcher.start, launcher.terminate, max_streams_per_shard=1)
+    supervisor.start(rtsp_config([0, 1]))
+    launcher.workers[0].ready.value = True
+    supervisor.poll(0)
+    replies = supervisor.apply_config({"bind_endpoints": True})
+    assert replies == [{"ok": True, "shard": 0}, {"ok": True, "restarted": True, "shard": 1}]
+    assert launcher.workers[0].channel[0].sent == [(1, "config", ({"bind_endpoints": True},))]
+    assert len(launcher.workers) == 3
+    assert all(shard.config["bind_endpoints"] for shard in supervisor.shards)
@@ -0,0 +1,37 @@
+from track_cache import TrackCache
+
+
+def test_new_then_known():
+    tracks = TrackCache(max_size=3)
+    assert not tracks.seen(1, 0)
+    assert tracks.seen(1, 1)
+    assert 1 in tracks
+
+
+def test_evicts_least_recently_seen():
+    tracks = TrackCache(max_size=2)
+    tracks.seen(1, 0)
+    tracks.seen(2, 1)
+    #seeing 1 again keeps it, 2 is the oldest now
+    tracks.seen(1, 2)
+    tracks.seen(3, 3)
+    assert len(tracks) == 2
+    assert 1 in tracks and 3 in tracks and 2 not in tracks
+
+
+def test_ttl_expires_ids():
+    tracks = TrackCache(max_size=0, ttl=5)
+    tracks.seen(1, 0)
+    tracks.seen(2, 4)
+    tracks.expire(6)
+    assert 1 not in tracks and 2 in tracks
+    #an id not seen for longer than ttl counts as new again
+    assert not tracks.seen(2, 20)
+
+
+def test_resize_evicts_down_to_new_size():
+    tracks = TrackCache(max_size=5)
+    for object_id in range(5):
+        tracks.seen(object_id, 1e12 + object_id)
+    tracks.resize(max_size=2)
+    assert sorted(tracks._last_seen) == [3, 4]
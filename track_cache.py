@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+
+
+class TrackCache:
+
+    # Per stream record of object ids that already had an image saved.
+    # Lookups are O(1); ids are evicted least-recently-seen first once more
+    # than max_size ids are held, and/or once they have not been seen for
+    # ttl seconds. Seeing an id again refreshes it, so a long-lived track is
+    # not pushed out by newer ids and saved a second time.
+    def __init__(self, max_size=20, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._last_seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def __contains__(self, object_id):
+        return object_id in self._last_seen
+
+    def seen(self, object_id, now=None):
+        # Returns True if object_id was already known, False if it is new.
+        # Either way the id is marked as most recently seen.
+        if now is None:
+            now = time.time()
+        known = object_id in self._last_seen
+        if known and self.ttl > 0 and now - self._last_seen[object_id] > self.ttl:
+            known = False
+        self._last_seen[object_id] = now
+        self._last_seen.move_to_end(object_id)
+        if not known:
+            self._evict(now)
+        return known
+
+    def expire(self, now=None):
+        if now is None:
+            now = time.time()
+        self._evict(now)
+
+    def resize(self, max_size=None, ttl=None):
+        if max_size is not None:
+            self.max_size = max_size
+        if ttl is not None:
+            self.ttl = ttl
+        self._evict(time.time())
+
+    def _evict(self, now):
+        if self.max_size > 0:
+            while len(self._last_seen) > self.max_size:
+                self._last_seen.popitem(last=False)
+        if self.ttl > 0:
+            # Entries are ordered by last seen time, so stop at the first one
+            # that is still fresh.
+            while self._last_seen:
+                object_id, last_seen = next(iter(self._last_seen.items()))
+                if now - last_seen <= self.ttl:
+                    break
+                del self._last_seen[object_id]